@@ -0,0 +1,135 @@
+"""partition vehicle_track_readings by timestamp
+
+Revision ID: a1c3e5f70001
+Revises:
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from datetime import date, datetime, timedelta, timezone
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c3e5f70001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "vehicle_track_readings"
+NEW_TABLE = f"{TABLE}_new"
+
+# Интервал и именование секций на момент ревизии (TRACK_PARTITION_INTERVAL=week,
+# TRACK_PARTITIONS_AHEAD=4): миграция не зависит от текущего кода и настроек
+# приложения. Дальнейшие секции создает partition_manager по своим настройкам.
+PARTITIONS_AHEAD = 4
+
+COLUMNS = "id, detector_id, timestamp, vehicle_identifier, speed, created_at"
+
+INDEXES = [
+    ("idx_track_timestamp", "timestamp"),
+    ("idx_track_vehicle", "vehicle_identifier"),
+    ("idx_track_detector", "detector_id"),
+    ("idx_track_vehicle_timestamp", "vehicle_identifier, timestamp"),
+    ("idx_track_detector_timestamp", "detector_id, timestamp"),
+]
+
+
+def _week_bounds(day: date):
+    """Границы [понедельник, понедельник следующей недели) недели дня day"""
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
+
+
+def _partition_name(start: date) -> str:
+    return f"{TABLE}_p{start:%Y%m%d}"
+
+
+def _bound(day) -> str:
+    return f"'{day.isoformat()} 00:00:00+00'"
+
+
+def _table_kind(bind, name: str):
+    """'p' - секционированная таблица, 'r' - обычная, None - таблицы нет"""
+    return bind.execute(
+        sa.text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+        {"name": name}
+    ).scalar()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    kind = _table_kind(bind, TABLE)
+    if kind == "p":
+        return  # Таблица уже создана секционированной (create_all на пустой БД)
+
+    op.execute(f"""
+        CREATE TABLE {NEW_TABLE} (
+            id UUID NOT NULL,
+            detector_id UUID NOT NULL REFERENCES detectors (id),
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            vehicle_identifier VARCHAR(100) NOT NULL,
+            speed NUMERIC(10, 2),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT {TABLE}_pkey_new PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    op.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {NEW_TABLE} DEFAULT")
+
+    # Секции на весь диапазон имеющихся данных и PARTITIONS_AHEAD недель вперед
+    today = datetime.now(timezone.utc).date()
+    first_day = today
+    if kind == "r":
+        first, last = bind.execute(sa.text(f"SELECT min(timestamp), max(timestamp) FROM {TABLE}")).one()
+        if first is not None:
+            first_day = min(first.astimezone(timezone.utc).date(), today)
+
+    _, horizon = _week_bounds(today)
+    for _ in range(PARTITIONS_AHEAD):
+        _, horizon = _week_bounds(horizon)
+
+    day = first_day
+    while day < horizon:
+        lower, upper = _week_bounds(day)
+        op.execute(
+            f"CREATE TABLE {_partition_name(lower)} PARTITION OF {NEW_TABLE} "
+            f"FOR VALUES FROM ({_bound(lower)}) TO ({_bound(upper)})"
+        )
+        day = upper
+
+    if kind == "r":
+        op.execute(f"INSERT INTO {NEW_TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}")
+        op.execute(f"DROP TABLE {TABLE}")
+
+    op.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}")
+    op.execute(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {TABLE}_pkey_new TO {TABLE}_pkey")
+
+    # Индексы создаются после загрузки данных - на родителе, с наследованием секциями
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON {TABLE} ({columns})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"""
+        CREATE TABLE {NEW_TABLE} (
+            id UUID NOT NULL,
+            detector_id UUID NOT NULL REFERENCES detectors (id),
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            vehicle_identifier VARCHAR(100) NOT NULL,
+            speed NUMERIC(10, 2),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT {TABLE}_pkey_new PRIMARY KEY (id)
+        )
+    """)
+    op.execute(f"INSERT INTO {NEW_TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}")
+    op.execute(f"DROP TABLE {TABLE}")  # Удаляет и все секции
+    op.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}")
+    op.execute(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {TABLE}_pkey_new TO {TABLE}_pkey")
+
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON {TABLE} ({columns})")
@@ -0,0 +1,79 @@
+"""compact track storage tables
+
+Revision ID: b2d4f6a80002
+Revises: a1c3e5f70001
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a80002'
+down_revision: Union[str, Sequence[str], None] = 'a1c3e5f70001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "vehicle_track_readings_compact"
+
+INDEXES = [
+    ("idx_track_compact_timestamp", "timestamp"),
+    ("idx_track_compact_vehicle_timestamp", "vehicle_code, timestamp"),
+    ("idx_track_compact_detector_timestamp", "detector_code, timestamp"),
+]
+
+
+def _table_exists(bind, name: str) -> bool:
+    return bool(bind.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p'))"),
+        {"name": name}
+    ).scalar())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    if not _table_exists(bind, "vehicles_dict"):
+        op.execute("""
+            CREATE TABLE vehicles_dict (
+                id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                vehicle_identifier VARCHAR(100) NOT NULL UNIQUE
+            )
+        """)
+
+    if not _table_exists(bind, "detector_codes"):
+        op.execute("""
+            CREATE TABLE detector_codes (
+                code INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                detector_id UUID NOT NULL UNIQUE REFERENCES detectors (id)
+            )
+        """)
+
+    if not _table_exists(bind, TABLE):
+        op.execute(f"""
+            CREATE TABLE {TABLE} (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                detector_code INTEGER NOT NULL REFERENCES detector_codes (code),
+                vehicle_code INTEGER NOT NULL REFERENCES vehicles_dict (id),
+                speed REAL,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """)
+        # Секции по времени создаются менеджером секций (при старте приложения)
+        op.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+        for name, columns in INDEXES:
+            op.execute(f"CREATE INDEX {name} ON {TABLE} ({columns})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    op.execute("DROP TABLE IF EXISTS detector_codes")
+    op.execute("DROP TABLE IF EXISTS vehicles_dict")
@@ -0,0 +1,79 @@
+"""unique vehicles.plate_number, index locations.address
+
+Revision ID: c3e5a7b90003
+Revises: b2d4f6a80002
+Create Date: 2026-10-16 14:00:00.000000
+
+vehicles.plate_number becomes a unique key: one vehicle per plate. Existing
+duplicates (left by the old per-row get-or-create) are merged into the
+oldest row: references are repointed, the merged rows are copied to
+vehicles_merged (with the id they were merged into) and logged, then
+deleted. locations.address gets a plain lookup index; addresses stay
+non-unique.
+"""
+from typing import Sequence, Union
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e5a7b90003'
+down_revision: Union[str, Sequence[str], None] = 'b2d4f6a80002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger(f"alembic.migration.{revision}")
+
+# Tables referencing vehicles (table, column)
+VEHICLE_REFERENCES = [("fines", "vehicle_id")]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    # Duplicate plates: keep the oldest row per plate, the rest are merged into it
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS vehicles_merged AS
+        SELECT v.*, NULL::uuid AS merged_into, now() AS merged_at FROM vehicles v WITH NO DATA
+    """)
+    op.execute("""
+        CREATE TEMP TABLE vehicles_merge AS
+        SELECT id, first_value(id) OVER (
+            PARTITION BY plate_number ORDER BY created_at NULLS LAST, id
+        ) AS keep_id
+        FROM vehicles
+    """)
+    op.execute("DELETE FROM vehicles_merge WHERE id = keep_id")
+
+    merged = bind.execute(sa.text(
+        "SELECT v.plate_number, m.id, m.keep_id FROM vehicles_merge m "
+        "JOIN vehicles v ON v.id = m.id ORDER BY v.plate_number"
+    )).all()
+    for plate_number, vehicle_id, keep_id in merged:
+        logger.warning(f"Merging duplicate vehicle {vehicle_id} ({plate_number}) into {keep_id}")
+    if merged:
+        logger.warning(f"Merged {len(merged)} duplicate vehicles, copies kept in vehicles_merged")
+
+    op.execute("""
+        INSERT INTO vehicles_merged
+        SELECT v.*, m.keep_id, now() FROM vehicles v JOIN vehicles_merge m ON m.id = v.id
+    """)
+    for ref_table, ref_column in VEHICLE_REFERENCES:
+        op.execute(
+            f"UPDATE {ref_table} r SET {ref_column} = m.keep_id "
+            f"FROM vehicles_merge m WHERE r.{ref_column} = m.id"
+        )
+    op.execute("DELETE FROM vehicles t USING vehicles_merge m WHERE t.id = m.id")
+    op.execute("DROP TABLE vehicles_merge")
+
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_vehicles_plate_number ON vehicles (plate_number)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_locations_address ON locations (address)")
+
+
+def downgrade() -> None:
+    """Downgrade schema (merged vehicles stay in vehicles_merged)."""
+    op.execute("DROP INDEX IF EXISTS idx_locations_address")
+    op.execute("DROP INDEX IF EXISTS uq_vehicles_plate_number")
@@ -0,0 +1,96 @@
+"""natural key unique indexes for upsert imports, import_jobs mode and merge counts
+
+Revision ID: d4f6b8c10004
+Revises: c3e5a7b90003
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f6b8c10004'
+down_revision: Union[str, Sequence[str], None] = 'c3e5a7b90003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger(f"alembic.migration.{revision}")
+
+
+# table, natural key, unique index, row identity, order of rows kept (the first) among duplicates.
+# Only readings are unique by their natural key: two fines, accidents or evacuations may share
+# theirs, so those tables are not deduplicated (see f6a8b0d30006).
+NATURAL_KEYS = [
+    # Partitioned tables are keyed by (id, timestamp)
+    ("vehicle_track_readings", "detector_id, vehicle_identifier, timestamp", "uq_track_readings_natural_key",
+     ["id", "timestamp"], "created_at NULLS LAST, id"),
+    ("vehicle_track_readings_compact", "detector_code, vehicle_code, timestamp", "uq_track_compact_natural_key",
+     ["id", "timestamp"], "id"),
+]
+
+IMPORT_JOB_COLUMNS = [
+    ("mode", "VARCHAR(20) NOT NULL DEFAULT 'append'"),
+    ("inserted", "INTEGER"),
+    ("updated", "INTEGER"),
+    ("skipped", "INTEGER"),
+]
+
+
+def _table_exists(bind, name: str) -> bool:
+    return bool(bind.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p'))"),
+        {"name": name}
+    ).scalar())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    for table, key, index, identity, order in NATURAL_KEYS:
+        if not _table_exists(bind, table):
+            continue
+
+        # Readings imported twice before upserts existed: the oldest row per key
+        # stays, the rest are copied to {table}_duplicates (kept after the
+        # migration for review) and then deleted (nothing references these tables)
+        op.execute(f"""
+            CREATE TEMP TABLE {table}_ranked AS
+            SELECT {', '.join(identity)} FROM (
+                SELECT {', '.join(identity)}, row_number() OVER (PARTITION BY {key} ORDER BY {order}) AS position
+                FROM {table}
+            ) ranked
+            WHERE position > 1
+        """)
+        matches = " AND ".join(f"t.{column} = d.{column}" for column in identity)
+        op.execute(f"CREATE TABLE IF NOT EXISTS {table}_duplicates AS SELECT * FROM {table} WITH NO DATA")
+        copied = bind.execute(sa.text(
+            f"INSERT INTO {table}_duplicates SELECT t.* FROM {table} t JOIN {table}_ranked d ON {matches}"
+        )).rowcount
+        if copied:
+            logger.warning(f"Moved {copied} duplicate rows of {table} to {table}_duplicates")
+        op.execute(f"DELETE FROM {table} t USING {table}_ranked d WHERE {matches}")
+        op.execute(f"DROP TABLE {table}_ranked")
+
+        op.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({key})")
+
+    # import_jobs is created by the application (create_all); older tables get the new columns
+    if _table_exists(bind, "import_jobs"):
+        for column, definition in IMPORT_JOB_COLUMNS:
+            op.execute(f"ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS {column} {definition}")
+
+
+def downgrade() -> None:
+    """Downgrade schema (the *_duplicates tables are kept)."""
+    bind = op.get_bind()
+
+    if _table_exists(bind, "import_jobs"):
+        for column, _ in IMPORT_JOB_COLUMNS:
+            op.execute(f"ALTER TABLE import_jobs DROP COLUMN IF EXISTS {column}")
+
+    for _, _, index, _, _ in NATURAL_KEYS:
+        op.execute(f"DROP INDEX IF EXISTS {index}")
@@ -0,0 +1,48 @@
+"""import_jobs owner and heartbeat
+
+Revision ID: e5f7a9c20005
+Revises: d4f6b8c10004
+Create Date: 2026-10-17 10:00:00.000000
+
+Each import job records the web process that runs it and a heartbeat that
+process refreshes, so recovery only settles jobs whose owner is gone.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f7a9c20005'
+down_revision: Union[str, Sequence[str], None] = 'd4f6b8c10004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+IMPORT_JOB_COLUMNS = [
+    ("owner", "VARCHAR(255)"),
+    ("heartbeat_at", "TIMESTAMP WITH TIME ZONE"),
+]
+
+
+def _table_exists(bind, name: str) -> bool:
+    return bool(bind.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p'))"),
+        {"name": name}
+    ).scalar())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # import_jobs is created by the application (create_all); older tables get the new columns.
+    # Jobs without an owner are treated as orphaned by the first process that starts.
+    if _table_exists(op.get_bind(), "import_jobs"):
+        for column, definition in IMPORT_JOB_COLUMNS:
+            op.execute(f"ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS {column} {definition}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if _table_exists(op.get_bind(), "import_jobs"):
+        for column, _ in IMPORT_JOB_COLUMNS:
+            op.execute(f"ALTER TABLE import_jobs DROP COLUMN IF EXISTS {column}")
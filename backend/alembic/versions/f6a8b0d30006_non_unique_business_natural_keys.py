@@ -0,0 +1,67 @@
+"""non-unique natural keys of fines, accidents and evacuations
+
+Revision ID: f6a8b0d30006
+Revises: e5f7a9c20005
+Create Date: 2026-10-17 14:00:00.000000
+
+Two fines, accidents or evacuations may share their natural key, so the
+key is enforced only by upsert imports. Databases migrated by an earlier
+d4f6b8c10004 lose its unique indexes, and the rows it moved to
+<table>_duplicates are put back.
+"""
+from typing import Sequence, Union
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6a8b0d30006'
+down_revision: Union[str, Sequence[str], None] = 'e5f7a9c20005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger(f"alembic.migration.{revision}")
+
+# table, natural key, unique index of d4f6b8c10004, index used by upsert imports
+NATURAL_KEYS = [
+    ("fines", "vehicle_id, issued_at, violation_code", "uq_fines_natural_key", "idx_fines_natural_key"),
+    ("accidents", "location_id, occurred_at, accident_type", "uq_accidents_natural_key",
+     "idx_accidents_natural_key"),
+    ("evacuations", "location_id, evacuated_at", "uq_evacuations_natural_key", "idx_evacuations_natural_key"),
+]
+
+
+def _table_exists(bind, name: str) -> bool:
+    return bool(bind.execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p'))"),
+        {"name": name}
+    ).scalar())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    for table, key, unique_index, index in NATURAL_KEYS:
+        if not _table_exists(bind, table):
+            continue
+
+        op.execute(f"DROP INDEX IF EXISTS {unique_index}")
+        if _table_exists(bind, f"{table}_duplicates"):
+            restored = bind.execute(sa.text(
+                f"INSERT INTO {table} SELECT d.* FROM {table}_duplicates d "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = d.id)"
+            )).rowcount
+            if restored:
+                logger.warning(f"Restored {restored} rows of {table} from {table}_duplicates")
+            op.execute(f"DROP TABLE {table}_duplicates")
+
+        op.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({key})")
+
+
+def downgrade() -> None:
+    """Downgrade schema (the unique indexes are not restored: the tables may hold rows sharing a key)."""
+    for _, _, _, index in NATURAL_KEYS:
+        op.execute(f"DROP INDEX IF EXISTS {index}")
@@ -25,6 +25,37 @@ class Settings:
     
     # File upload
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
-    UPLOAD_DIR: str = "uploads"
+    UPLOAD_DIR: str = "uploads"  # uploads are spooled here while they are imported
+    # Detector readings exports are much larger than other imports; 0 - no limit
+    TRACK_IMPORT_MAX_FILE_SIZE: int = int(os.getenv("TRACK_IMPORT_MAX_FILE_SIZE", 10 * 1024 ** 3))  # 10GB
+    # Import jobs run in a pool of worker processes
+    IMPORT_JOB_WORKERS: int = int(os.getenv("IMPORT_JOB_WORKERS", 2))
+    # Each web process refreshes the heartbeat of its import jobs this often; jobs whose owner
+    # has been silent for IMPORT_JOB_STALE_SECONDS are taken over by another process
+    IMPORT_JOB_HEARTBEAT_SECONDS: int = int(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", 30))
+    IMPORT_JOB_STALE_SECONDS: int = int(os.getenv("IMPORT_JOB_STALE_SECONDS", 300))
+    # Imports of more than one chunk (PostgreSQL) convert chunks in this many processes; 1 - sequential
+    IMPORT_PARALLEL_WORKERS: int = int(os.getenv("IMPORT_PARALLEL_WORKERS", os.cpu_count() or 1))
+    # Parquet exports: codec of column chunks (zstd, snappy, gzip, none)
+    EXPORT_PARQUET_COMPRESSION: str = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+    # CSV exports through COPY TO STDOUT (PostgreSQL): faster, but values are rendered by the
+    # server (timestamps as "+00", numerics and booleans in PostgreSQL text form); off by default
+    EXPORT_CSV_COPY: bool = os.getenv("EXPORT_CSV_COPY", "false").lower() in ("1", "true", "yes")
+    
+    # Traffic analysis
+    CONVOY_DETECTION_WORKERS: int = int(os.getenv("CONVOY_DETECTION_WORKERS", os.cpu_count() or 1))
+    TRIP_DWELL_GAP_SECONDS: int = int(os.getenv("TRIP_DWELL_GAP_SECONDS", 1800))
+    TRIP_MAX_SPEED_KMH: float = float(os.getenv("TRIP_MAX_SPEED_KMH", 200))
+    
+    # vehicle_track_readings storage: standard (UUID keys) or compact (integer codes, PostgreSQL only)
+    TRACK_STORAGE_MODE: str = os.getenv("TRACK_STORAGE_MODE", "standard")
+    # Rows per COPY batch (and per commit) in the detector readings bulk import
+    TRACK_IMPORT_BATCH_SIZE: int = int(os.getenv("TRACK_IMPORT_BATCH_SIZE", 100000))
+    
+    # vehicle_track_readings partitioning (PostgreSQL only)
+    TRACK_PARTITION_INTERVAL: str = os.getenv("TRACK_PARTITION_INTERVAL", "week")  # day, week
+    TRACK_PARTITIONS_AHEAD: int = int(os.getenv("TRACK_PARTITIONS_AHEAD", 4))
+    TRACK_RETENTION_DAYS: int = int(os.getenv("TRACK_RETENTION_DAYS", 0))  # 0 - keep everything
+    TRACK_ARCHIVE_SCHEMA: str = os.getenv("TRACK_ARCHIVE_SCHEMA", "archive")  # empty - drop detached partitions
     
 settings = Settings()
\ No newline at end of file
@@ -5,7 +5,7 @@ from app.routers import auth, data, analytics, import_export, content, traffic_a
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.responses import JSONResponse
 from app.database import engine, Base
-from app.models import User, Location, Vehicle, Fine, Accident, TrafficLight, ContentPage, Detector, VehicleTrackReading, RoadNetworkEdge
+from app.models import User, Location, Vehicle, Fine, Accident, TrafficLight, ContentPage, Detector, VehicleTrackReading, VehicleDict, DetectorCode, CompactTrackReading, RoadNetworkEdge, ConvoyDetectionRun, ConvoyPair, Trip, RouteStat, RouteStatsRefresh, ImportJob
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,6 +32,56 @@ def create_tables():
 create_tables()
 
 
+def maintain_track_partitions():
+    """Create upcoming vehicle_track_readings partitions (PostgreSQL only)"""
+    from app.database import SessionLocal
+    from app.services.partition_manager import maintain_partitions
+    
+    db = SessionLocal()
+    try:
+        maintain_partitions(db)
+    except Exception as e:
+        logger.warning(f"Partition maintenance note: {e}")
+    finally:
+        db.close()
+
+maintain_track_partitions()
+
+
+def resume_route_stats_refreshes():
+    """Requeue route stats refreshes interrupted by a restart and run the pending queue"""
+    from app.database import SessionLocal
+    from app.services.route_stats_service import RouteStatsService, schedule_route_stats_refresh
+
+    db = SessionLocal()
+    try:
+        requeued = RouteStatsService(db).requeue_interrupted_refreshes()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted route stats refreshes")
+        schedule_route_stats_refresh()
+    except Exception as e:
+        logger.warning(f"Route stats refresh queue note: {e}")
+    finally:
+        db.close()
+
+resume_route_stats_refreshes()
+
+
+def resume_import_jobs():
+    """Fail import jobs interrupted by a restart, requeue pending ones and start the job heartbeat"""
+    from app.services.import_jobs import resume_import_jobs as resume_jobs, start_job_monitor
+
+    try:
+        requeued = resume_jobs()
+        if requeued:
+            logger.info(f"Requeued {requeued} pending import jobs")
+    except Exception as e:
+        logger.warning(f"Import job recovery note: {e}")
+    start_job_monitor()
+
+resume_import_jobs()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Numeric, DateTime, Date, Text, Boolean, Float, ForeignKey, Index
+from sqlalchemy import Column, String, Integer, BigInteger, Numeric, DateTime, Date, Text, Boolean, Float, REAL, ForeignKey, Index, Identity
 from datetime import datetime  
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -28,6 +28,11 @@ class Location(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     evacuations = relationship("Evacuation", back_populates="location")
+    
+    # Lookup by address during imports (not unique: the API may store an address twice)
+    __table_args__ = (
+        Index('idx_locations_address', 'address'),
+    )
 
 class Vehicle(Base):
     __tablename__ = "vehicles"
@@ -36,6 +41,11 @@ class Vehicle(Base):
     plate_number = Column(String(20), nullable=False)
     type = Column(String(50))  # car, truck, motorcycle
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Natural key: one vehicle per plate (get-or-create during imports)
+    __table_args__ = (
+        Index('uq_vehicles_plate_number', 'plate_number', unique=True),
+    )
 
 class Fine(Base):
     __tablename__ = "fines"
@@ -55,6 +65,7 @@ class Fine(Base):
         Index('idx_fines_issued_at', 'issued_at'),
         Index('idx_fines_vehicle_id', 'vehicle_id'),
         Index('idx_fines_visibility', 'visibility'),
+        Index('idx_fines_natural_key', 'vehicle_id', 'issued_at', 'violation_code'),  # upsert imports (not unique)
     )
 
 class Accident(Base):
@@ -72,6 +83,7 @@ class Accident(Base):
     __table_args__ = (
         Index('idx_accidents_occurred_at', 'occurred_at'),
         Index('idx_accidents_visibility', 'visibility'),
+        Index('idx_accidents_natural_key', 'location_id', 'occurred_at', 'accident_type'),  # upsert imports (not unique)
     )
 
     location = relationship("Location", backref="accidents")
@@ -126,6 +138,10 @@ class Evacuation(Base):
     visibility = Column(String, default="private")
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index('idx_evacuations_natural_key', 'location_id', 'evacuated_at'),  # upsert imports (not unique)
+    )
+    
     location = relationship("Location", back_populates="evacuations")
 
 
@@ -154,9 +170,11 @@ class VehicleTrackReading(Base):
     """Запись прохождения ТС через детектор"""
     __tablename__ = "vehicle_track_readings"
     
+    # В PostgreSQL таблица секционирована по timestamp (RANGE), поэтому
+    # ключ секционирования входит в первичный ключ
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     detector_id = Column(UUID(as_uuid=True), ForeignKey("detectors.id"), nullable=False)
-    timestamp = Column(DateTime(timezone=True), nullable=False)  # Временная_метка
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False)  # Временная_метка
     vehicle_identifier = Column(String(100), nullable=False)  # Идентификатор_ТС
     speed = Column(Numeric(10, 2))  # Скорость_прохождения (опционально)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -168,6 +186,52 @@ class VehicleTrackReading(Base):
         Index('idx_track_vehicle', 'vehicle_identifier'),
         Index('idx_track_detector', 'detector_id'),
         Index('idx_track_vehicle_timestamp', 'vehicle_identifier', 'timestamp'),
+        Index('idx_track_detector_timestamp', 'detector_id', 'timestamp'),
+        # Естественный ключ чтения - для импорта с upsert
+        Index('uq_track_readings_natural_key', 'detector_id', 'vehicle_identifier', 'timestamp', unique=True),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+
+class VehicleDict(Base):
+    """Словарь идентификаторов ТС для компактного хранения чтений"""
+    __tablename__ = "vehicles_dict"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    vehicle_identifier = Column(String(100), unique=True, nullable=False)
+
+
+class DetectorCode(Base):
+    """Целочисленный код детектора для компактного хранения чтений"""
+    __tablename__ = "detector_codes"
+    
+    code = Column(Integer, primary_key=True, autoincrement=True)
+    detector_id = Column(UUID(as_uuid=True), ForeignKey("detectors.id"), unique=True, nullable=False)
+
+
+class CompactTrackReading(Base):
+    """
+    Запись прохождения ТС через детектор в компактном виде (TRACK_STORAGE_MODE=compact)
+    
+    Вместо UUID и строкового идентификатора ТС хранятся целочисленные коды
+    из detector_codes и vehicles_dict, скорость - REAL. Режим рассчитан на
+    PostgreSQL: таблица секционирована по timestamp, id - identity.
+    """
+    __tablename__ = "vehicle_track_readings_compact"
+    
+    id = Column(BigInteger, Identity(), primary_key=True)
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False)
+    detector_code = Column(Integer, ForeignKey("detector_codes.code"), nullable=False)
+    vehicle_code = Column(Integer, ForeignKey("vehicles_dict.id"), nullable=False)
+    speed = Column(REAL)
+    
+    # Индексы по одной колонке не нужны - их покрывают составные индексы
+    __table_args__ = (
+        Index('idx_track_compact_timestamp', 'timestamp'),
+        Index('idx_track_compact_vehicle_timestamp', 'vehicle_code', 'timestamp'),
+        Index('idx_track_compact_detector_timestamp', 'detector_code', 'timestamp'),
+        Index('uq_track_compact_natural_key', 'detector_code', 'vehicle_code', 'timestamp', unique=True),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
 
 
@@ -187,4 +251,143 @@ class RoadNetworkEdge(Base):
     
     __table_args__ = (
         Index('idx_edge_from_to', 'from_detector_id', 'to_detector_id'),
-    )
\ No newline at end of file
+    )
+
+class ConvoyDetectionRun(Base):
+    """Запуск пакетного поиска колонн (совместного движения) за временное окно"""
+    __tablename__ = "convoy_detection_runs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False)
+    min_common_nodes = Column(Integer, nullable=False)
+    max_time_gap_seconds = Column(Integer, nullable=False)
+    max_lead_seconds = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    readings_count = Column(Integer, default=0)
+    pairs_count = Column(Integer, default=0)
+    groups_count = Column(Integer, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
+    
+    pairs = relationship("ConvoyPair", back_populates="run", cascade="all, delete-orphan")
+
+
+class ConvoyPair(Base):
+    """Пара ТС, движущихся совместно (результат пакетного поиска колонн)"""
+    __tablename__ = "convoy_pairs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    run_id = Column(UUID(as_uuid=True), ForeignKey("convoy_detection_runs.id", ondelete="CASCADE"), nullable=False)
+    group_index = Column(Integer, nullable=False)  # Номер колонны внутри запуска
+    vehicle_a = Column(String(100), nullable=False)
+    vehicle_b = Column(String(100), nullable=False)
+    common_nodes_count = Column(Integer, nullable=False)
+    first_seen_at = Column(DateTime(timezone=True), nullable=False)
+    last_seen_at = Column(DateTime(timezone=True), nullable=False)
+    mean_lead_seconds = Column(Float)  # Среднее опережение vehicle_b относительно vehicle_a
+    
+    run = relationship("ConvoyDetectionRun", back_populates="pairs")
+    
+    __table_args__ = (
+        Index('idx_convoy_pairs_run_group', 'run_id', 'group_index'),
+        Index('idx_convoy_pairs_run_vehicle', 'run_id', 'vehicle_a'),
+    )
+
+
+class Trip(Base):
+    """Поездка ТС - непрерывный участок трека между остановками (результат сегментации)"""
+    __tablename__ = "trips"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    vehicle_identifier = Column(String(100), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False)
+    start_detector_id = Column(UUID(as_uuid=True), ForeignKey("detectors.id"), nullable=False)
+    end_detector_id = Column(UUID(as_uuid=True), ForeignKey("detectors.id"), nullable=False)
+    detector_sequence = Column(Text, nullable=False)  # UUID детекторов через запятую, в порядке прохождения
+    readings_count = Column(Integer, nullable=False)
+    average_speed_kmh = Column(Float)  # Средняя скорость по чтениям с известной скоростью
+    speed_readings_count = Column(Integer, default=0)
+    end_reason = Column(String(20), nullable=False)  # dwell, revisit, speed (window_end - поездки до сегментации по сеансам)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_trips_start_time', 'start_time'),
+        Index('idx_trips_vehicle_start', 'vehicle_identifier', 'start_time'),
+        Index('idx_trips_start_end_detectors', 'start_detector_id', 'end_detector_id'),
+    )
+
+
+class RouteStat(Base):
+    """Почасовая статистика маршрута (агрегат поездок по часу начала)"""
+    __tablename__ = "route_stats"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    signature_hash = Column(String(40), nullable=False)  # SHA-1 от detector_sequence
+    detector_sequence = Column(Text, nullable=False)  # UUID детекторов через запятую, как в trips
+    hour_bucket = Column(DateTime(timezone=True), nullable=False)  # Начало часа
+    vehicles_count = Column(Integer, nullable=False, default=0)  # Число прохождений маршрута
+    speed_sum = Column(Float, nullable=False, default=0.0)
+    speed_count = Column(Integer, nullable=False, default=0)
+    passage_time_sum = Column(Float, nullable=False, default=0.0)  # Секунды
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        Index('idx_route_stats_signature_hour', 'signature_hash', 'hour_bucket', unique=True),
+        Index('idx_route_stats_hour', 'hour_bucket'),
+    )
+
+
+class RouteStatsRefresh(Base):
+    """Отложенное обновление поездок и статистики маршрутов за период (после импорта чтений)"""
+    __tablename__ = "route_stats_refreshes"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    start_time = Column(DateTime(timezone=True), nullable=False)  # Первое импортированное чтение
+    end_time = Column(DateTime(timezone=True), nullable=False)  # Последнее импортированное чтение
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index('idx_route_stats_refreshes_status_created', 'status', 'created_at'),
+    )
+
+
+class ImportJob(Base):
+    """Background import of an uploaded file, run by the import worker pool"""
+    __tablename__ = "import_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    model_type = Column(String(50), nullable=False)  # fines, accidents, ..., vehicle_track_readings
+    file_name = Column(String(255))
+    file_path = Column(String(500), nullable=False)  # Spooled upload, removed when the job finishes
+    file_type = Column(String(20), nullable=False)  # csv, excel, parquet, arrow
+    column_mapping = Column(Text)  # JSON
+    detector_coords = Column(Text)  # JSON, vehicle_track_readings only
+    sheet_name = Column(String(100))
+    mode = Column(String(20), nullable=False, default="append")  # append, upsert
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    rows_processed = Column(Integer, default=0)  # Progress while running
+    total_processed = Column(Integer)
+    successful = Column(Integer)
+    failed = Column(Integer)
+    inserted = Column(Integer)
+    updated = Column(Integer)  # upsert: stored rows changed by the import
+    skipped = Column(Integer)  # upsert: rows equal to stored ones or repeated in the file
+    errors = Column(Text)  # JSON list of row/batch errors
+    error = Column(Text)  # Reason the whole job failed
+    created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    owner = Column(String(255))  # Web process whose worker pool runs the job: host:pid:token
+    heartbeat_at = Column(DateTime(timezone=True))  # Refreshed by the owner while the job is pending or running
+    
+    __table_args__ = (
+        Index('idx_import_jobs_status_created', 'status', 'created_at'),
+    )
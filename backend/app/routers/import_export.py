@@ -1,33 +1,72 @@
+import asyncio
 import json
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-import io
 from typing import Optional
 from fastapi import Form
 from app.database import get_db
 from app import models
 from app.routers.auth import require_role
-from app.utils.importer import FineImporter, AccidentImporter, TrafficLightImporter, EvacuationImporter
+from app.config import settings
+from app.utils.importer import VehicleTrackReadingImporter
 from app.utils.exporter import PredefinedExports, DataExporter
-from app.schemas.import_export import ImportRequest, ImportResponse, FileType, DEFAULT_COLUMN_MAPPINGS
+from app.utils.uploads import save_upload, remove_upload
+from app.services.import_jobs import (
+    ImportJobService, IMPORT_FILE_TYPES, IMPORT_MODEL_TYPES, TRACK_READINGS, submit_import_job, supported_file_types,
+    supports_upsert
+)
+from app.schemas.import_export import (
+    ImportRequest, ImportResponse, ImportJobResponse, ImportMode, FileType, DEFAULT_COLUMN_MAPPINGS
+)
 import pandas as pd
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 router = APIRouter(prefix="/api/v1", tags=["import-export"])
 
+# Export format -> (media type, file extension)
+EXPORT_FORMATS = {
+    FileType.CSV: ("text/csv", "csv"),
+    FileType.EXCEL: ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    FileType.PARQUET: ("application/vnd.apache.parquet", "parquet"),
+    FileType.ARROW: ("application/vnd.apache.arrow.stream", "arrow"),
+}
 
-@router.post("/import/{model_type}", response_model=ImportResponse)
+
+@router.post("/import/{model_type}", response_model=ImportJobResponse, status_code=202)
 async def import_data(
     model_type: str,
+    response: Response,
     file: UploadFile = File(...),
     column_mapping: Optional[str] = Form(None),   # <- accept as string
+    detector_coords: Optional[str] = Form(None),  # vehicle_track_readings: {"detector_id": [lat, lon]}
     sheet_name: Optional[str] = Query(None),
+    mode: ImportMode = Query(ImportMode.APPEND, description="upsert: merge rows by their natural key (PostgreSQL)"),
+    wait: bool = Query(False, description="Wait for the job to finish and return its result"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role("admin"))
 ):
+    """
+    Queue an import job for the uploaded file
+
+    The upload is spooled to disk and imported by the import worker pool;
+    the response is the job (202), poll GET /import/jobs/{id} for progress.
+    With wait=true the request returns the finished job instead (200).
+    The default append mode inserts every row (track readings already
+    stored are skipped); with mode=upsert rows are merged by their natural
+    key - changed rows are updated, so uploading the same file again
+    changes nothing. The job reports inserted, updated and skipped rows.
+    """
+    if model_type not in IMPORT_MODEL_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported model type: {model_type}")
+    if mode == ImportMode.UPSERT:
+        if not supports_upsert(model_type):
+            raise HTTPException(status_code=400, detail=f"Upsert is not supported for {model_type}")
+        if db.get_bind().dialect.name != "postgresql":
+            raise HTTPException(status_code=400, detail="Upsert imports require PostgreSQL")
+
     # --- parse mapping ---
     if column_mapping:
         try:
@@ -36,62 +75,129 @@ async def import_data(
                 raise ValueError("column_mapping must be a JSON object (dict)")
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid JSON in column_mapping: {e}")
+    elif model_type == TRACK_READINGS:
+        mapping = VehicleTrackReadingImporter.DEFAULT_COLUMN_MAPPING
     else:
         # fallback to default mapping or error
         if model_type not in DEFAULT_COLUMN_MAPPINGS:
             raise HTTPException(status_code=400, detail="No column_mapping provided and no default mapping found")
         mapping = DEFAULT_COLUMN_MAPPINGS[model_type]
 
+    coords = None
+    if detector_coords:
+        try:
+            coords = {str(key): [float(value[0]), float(value[1])] for key, value in json.loads(detector_coords).items()}
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON in detector_coords: {e}")
+
     # --- check file ---
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
     ext = file.filename.split(".")[-1].lower()
-    if ext not in ("csv", "xlsx", "xls"):
+    file_type = IMPORT_FILE_TYPES.get(ext)
+    if file_type not in supported_file_types(model_type):
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    content = await file.read()
-    if not content:
-        raise HTTPException(status_code=400, detail="Empty file")
-
-    # --- select importer class (you already have these) ---
-    if model_type == "fines":
-        importer = FineImporter(db)
-        import_func = importer.import_fines
-    elif model_type == "accidents":
-        importer = AccidentImporter(db)
-        import_func = importer.import_accidents
-    elif model_type == "traffic_lights":
-        importer = TrafficLightImporter(db)
-        import_func = importer.import_traffic_lights
-    elif model_type == "evacuations":
-        importer = EvacuationImporter(db)
-        import_func = importer.import_evacuations
-    else:
-        raise HTTPException(status_code=400, detail=f"Unsupported model type: {model_type}")
-
-    # --- execute import (expecting dict result matching ImportResponse) ---
+    # --- spool upload to disk (413 past the size limit); the job owns the file ---
+    max_size = settings.TRACK_IMPORT_MAX_FILE_SIZE if model_type == TRACK_READINGS else settings.MAX_FILE_SIZE
+    path = await save_upload(file, max_size)
     try:
-        result = import_func(
-            file_content=content,
-            file_type='excel' if ext in ('xlsx','xls') else 'csv',
+        job = ImportJobService(db).create_job(
+            model_type=model_type,
+            file_name=file.filename,
+            file_path=path,
+            file_type=file_type,
             column_mapping=mapping,
-            sheet_name=sheet_name
+            sheet_name=sheet_name,
+            detector_coords=coords,
+            mode=mode.value,
+            created_by=current_user.id
         )
-        return ImportResponse(**result)
-    except HTTPException:
+    except Exception:
+        remove_upload(path)
         raise
+
+    try:
+        future = submit_import_job(job.id)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Import workers unavailable: {e}")
+
+    if wait:
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            pass  # Worker crash - recorded on the job
+        db.refresh(job)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=f"Import failed: {job.error}")
+        response.status_code = 200
+
+    return _import_job_response(job)
+
+
+@router.get("/import/jobs/{job_id}", response_model=ImportJobResponse)
+def get_import_job(
+    job_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_role("admin"))
+):
+    """Import job status, progress (rows processed, throughput) and errors"""
+    job = db.get(models.ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    return _import_job_response(job)
+
+
+def _import_job_response(job: models.ImportJob) -> dict:
+    rows_per_second = None
+    if job.started_at is not None:
+        finished_at = job.finished_at or datetime.now(timezone.utc)
+        started_at = job.started_at
+        if started_at.tzinfo is None:  # SQLite returns naive timestamps
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        if finished_at.tzinfo is None:
+            finished_at = finished_at.replace(tzinfo=timezone.utc)
+        elapsed = (finished_at - started_at).total_seconds()
+        if elapsed > 0:
+            rows_per_second = round((job.rows_processed or 0) / elapsed, 1)
+
+    return {
+        "id": str(job.id),
+        "model_type": job.model_type,
+        "file_name": job.file_name,
+        "mode": job.mode or ImportMode.APPEND,
+        "status": job.status,
+        "rows_processed": job.rows_processed or 0,
+        "rows_per_second": rows_per_second,
+        "total_processed": job.total_processed,
+        "successful": job.successful,
+        "failed": job.failed,
+        "inserted": job.inserted,
+        "updated": job.updated,
+        "skipped": job.skipped,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
 
 
 @router.get("/export/{export_type}")
 def export_data(
     export_type: str,
     format: FileType = FileType.CSV,
+    start_time: Optional[datetime] = Query(None, description="vehicle_track_readings: from this time"),
+    end_time: Optional[datetime] = Query(None, description="vehicle_track_readings: before this time"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(require_role("admin"))
 ):
-    """Export data in CSV or Excel format"""
+    """
+    Export data in CSV, Excel, Parquet or Arrow IPC stream format
+
+    Parquet (row groups, EXPORT_PARQUET_COMPRESSION) and Arrow need pyarrow.
+    Detector readings (vehicle_track_readings) can be limited to a time range.
+    """
     
     exporter = PredefinedExports(db)
     
@@ -108,19 +214,17 @@ def export_data(
         elif export_type == "evacuations":
             data = exporter.export_evacuations(format.value)
             filename = "evacuations"
+        elif export_type == TRACK_READINGS:
+            data = exporter.export_track_readings(format.value, start_time, end_time)
+            filename = TRACK_READINGS
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported export type: {export_type}")
         
-        # Determine content type and file extension
-        if format == FileType.CSV:
-            media_type = "text/csv"
-            extension = "csv"
-        else:
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            extension = "xlsx"
+        media_type, extension = EXPORT_FORMATS[format]
         
+        # The file is written while it is sent (the query already ran above)
         return StreamingResponse(
-            io.BytesIO(data),
+            data,
             media_type=media_type,
             headers={
                 "Content-Disposition": f"attachment; filename={filename}.{extension}"
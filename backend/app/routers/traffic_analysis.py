@@ -2,15 +2,20 @@
 API endpoints для анализа транспортных потоков
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from datetime import datetime
+import uuid
+import numpy as np
 
 from app.database import get_db
 from app import models
 from app.routers.auth import require_role, get_current_user
 from app.services.traffic_analysis_service import TrafficAnalysisService
+from app.services.road_graph import get_road_graph
+from app.services.convoy_service import ConvoyDetectionService, run_convoy_detection
+from app.services.trip_service import TripSegmentationService
 from app.schemas.traffic_analysis import (
     JointMovementRequest,
     JointMovementAnalysisResponse,
@@ -20,7 +25,15 @@ from app.schemas.traffic_analysis import (
     RouteClusterResponse,
     DetectorResponse,
     VehicleTrackReadingResponse,
-    VehicleTrackResponse
+    VehicleTrackResponse,
+    ShortestPathResponse,
+    GraphNeighbourhoodResponse,
+    GraphComponentsResponse,
+    ConvoyDetectionRequest,
+    ConvoyRunResponse,
+    TripSegmentationRequest,
+    TripSegmentationResponse,
+    TripResponse
 )
 
 router = APIRouter(prefix="/api/v1/traffic-analysis", tags=["traffic-analysis"])
@@ -130,13 +143,19 @@ def cluster_routes(
         start_time=request.start_time,
         end_time=request.end_time,
         top_n=request.top_n,
-        min_vehicles_per_route=request.min_vehicles_per_route
+        min_vehicles_per_route=request.min_vehicles_per_route,
+        clustering_mode=request.clustering_mode,
+        similarity_threshold=request.similarity_threshold,
+        source=request.source
     )
     
     # Подсчитываем общее количество проанализированных ТС
+    # (почасовая статистика хранит только количество прохождений)
     total_vehicles = set()
     for route in routes_data:
         total_vehicles.update(route["vehicles"])
+    total_vehicles_analyzed = len(total_vehicles) if request.source != "stats" else \
+        sum(route["total_vehicles"] for route in routes_data)
     
     time_range_hours = (request.end_time - request.start_time).total_seconds() / 3600.0
     
@@ -150,13 +169,151 @@ def cluster_routes(
             "average_speed_kmh": route_data["average_speed_kmh"],
             "average_passage_time_seconds": route_data["average_passage_time_seconds"],
             "coordinates": route_data["coordinates"],
-            "vehicles": route_data["vehicles"]
+            "vehicles": route_data["vehicles"],
+            "variants_count": route_data["variants_count"]
         })
     
     return {
         "routes": routes,
         "time_range_hours": round(time_range_hours, 2),
-        "total_vehicles_analyzed": len(total_vehicles)
+        "total_vehicles_analyzed": total_vehicles_analyzed
+    }
+
+
+@router.post("/trips/segment", response_model=TripSegmentationResponse)
+def segment_trips(
+    request: TripSegmentationRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """
+    Сегментация треков ТС за период на поездки
+    
+    Трек разбивается при стоянке дольше dwell_gap_seconds, повторном
+    прохождении детектора и невозможной скорости между детекторами.
+    Сеансы ТС (чтения без стоянок), пересекающие период, пересегментируются
+    целиком. Поездки сохраняются и используются кластеризацией (source="trips").
+    """
+    if request.start_time >= request.end_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_time must be before end_time"
+        )
+    
+    return TripSegmentationService(db).segment(
+        start_time=request.start_time,
+        end_time=request.end_time,
+        dwell_gap_seconds=request.dwell_gap_seconds,
+        max_speed_kmh=request.max_speed_kmh
+    )
+
+
+@router.get("/trips", response_model=List[TripResponse])
+def get_trips(
+    start_time: datetime,
+    end_time: datetime,
+    vehicle_identifier: Optional[str] = None,
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """Сохраненные поездки за период (опционально - одного ТС)"""
+    trips = []
+    for trip in TripSegmentationService(db).iter_trips(start_time, end_time, vehicle_identifier):
+        trips.append({
+            "id": str(trip.id),
+            "vehicle_identifier": trip.vehicle_identifier,
+            "start_time": trip.start_time,
+            "end_time": trip.end_time,
+            "start_detector_id": str(trip.start_detector_id),
+            "end_detector_id": str(trip.end_detector_id),
+            "detector_sequence": trip.detector_sequence.split(","),
+            "readings_count": trip.readings_count,
+            "average_speed_kmh": round(trip.average_speed_kmh, 2) if trip.average_speed_kmh is not None else None,
+            "end_reason": trip.end_reason
+        })
+        if len(trips) >= limit:
+            break
+    
+    return trips
+
+
+@router.post("/convoys/detect", response_model=ConvoyRunResponse, status_code=status.HTTP_202_ACCEPTED)
+def detect_convoys(
+    request: ConvoyDetectionRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """
+    Пакетный поиск колонн по всему парку ТС за временное окно
+    
+    Запуск выполняется в фоне; результат сохраняется и доступен через
+    GET /convoys/runs/{run_id}.
+    """
+    if request.start_time >= request.end_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_time must be before end_time"
+        )
+    
+    run = ConvoyDetectionService(db).create_run(
+        start_time=request.start_time,
+        end_time=request.end_time,
+        min_common_nodes=request.min_common_nodes,
+        max_time_gap_seconds=request.max_time_gap_seconds,
+        max_lead_seconds=request.max_lead_seconds
+    )
+    background_tasks.add_task(run_convoy_detection, run.id)
+    
+    return _convoy_run_response(run)
+
+
+@router.get("/convoys/runs/{run_id}", response_model=ConvoyRunResponse)
+def get_convoy_run(
+    run_id: uuid.UUID,
+    group_index: Optional[int] = Query(None, ge=0),
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """Состояние запуска поиска колонн и найденные пары ТС"""
+    run = db.get(models.ConvoyDetectionRun, run_id)
+    if run is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Convoy detection run {run_id} not found"
+        )
+    
+    pairs_query = db.query(models.ConvoyPair).filter(models.ConvoyPair.run_id == run.id)
+    if group_index is not None:
+        pairs_query = pairs_query.filter(models.ConvoyPair.group_index == group_index)
+    pairs = pairs_query.order_by(
+        models.ConvoyPair.group_index,
+        models.ConvoyPair.common_nodes_count.desc()
+    ).limit(limit).all()
+    
+    response = _convoy_run_response(run)
+    response["pairs"] = pairs
+    return response
+
+
+def _convoy_run_response(run: models.ConvoyDetectionRun) -> dict:
+    return {
+        "id": str(run.id),
+        "status": run.status,
+        "start_time": run.start_time,
+        "end_time": run.end_time,
+        "min_common_nodes": run.min_common_nodes,
+        "max_time_gap_seconds": run.max_time_gap_seconds,
+        "max_lead_seconds": run.max_lead_seconds,
+        "readings_count": run.readings_count,
+        "pairs_count": run.pairs_count,
+        "groups_count": run.groups_count,
+        "error": run.error,
+        "created_at": run.created_at,
+        "finished_at": run.finished_at,
+        "pairs": []
     }
 
 
@@ -216,6 +373,125 @@ def build_road_graph(
     }
 
 
+@router.get("/graph/shortest-path", response_model=ShortestPathResponse)
+def get_shortest_path(
+    from_detector_id: str = Query(...),
+    to_detector_id: str = Query(...),
+    algorithm: str = Query(default="dijkstra", pattern="^(dijkstra|astar)$"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """
+    Кратчайший путь по графу дорожной сети между двумя детекторами
+    
+    Детекторы задаются внешним ID_детектора. Граф берется из кэша процесса.
+    """
+    graph = get_road_graph(db)
+    
+    source = graph.ordinal(from_detector_id)
+    target = graph.ordinal(to_detector_id)
+    for detector_id, ordinal in ((from_detector_id, source), (to_detector_id, target)):
+        if ordinal is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Detector {detector_id} not found in road graph"
+            )
+    
+    result = graph.shortest_path(source, target, algorithm)
+    
+    if result is None:
+        return {
+            "from_detector_id": from_detector_id,
+            "to_detector_id": to_detector_id,
+            "algorithm": algorithm,
+            "found": False
+        }
+    
+    path, distance = result
+    return {
+        "from_detector_id": from_detector_id,
+        "to_detector_id": to_detector_id,
+        "algorithm": algorithm,
+        "found": True,
+        "distance_meters": round(distance, 2),
+        "path": [
+            {
+                "detector_id": graph.external_ids[node],
+                "latitude": float(graph.latitudes[node]),
+                "longitude": float(graph.longitudes[node])
+            }
+            for node in path
+        ]
+    }
+
+
+@router.get("/graph/neighbourhood/{detector_id}", response_model=GraphNeighbourhoodResponse)
+def get_graph_neighbourhood(
+    detector_id: str,
+    hops: int = Query(default=1, ge=1, le=10),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """Детекторы, достижимые из заданного не более чем за hops ребер графа"""
+    graph = get_road_graph(db)
+    
+    source = graph.ordinal(detector_id)
+    if source is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Detector {detector_id} not found in road graph"
+        )
+    
+    reached = graph.k_hop_neighbourhood(source, hops)
+    
+    neighbours = [
+        {
+            "detector_id": graph.external_ids[node],
+            "hops": depth,
+            "latitude": float(graph.latitudes[node]),
+            "longitude": float(graph.longitudes[node])
+        }
+        for node, depth in sorted(reached.items(), key=lambda item: (item[1], item[0]))
+        if node != source
+    ]
+    
+    return {
+        "detector_id": detector_id,
+        "max_hops": hops,
+        "neighbours": neighbours
+    }
+
+
+@router.get("/graph/components", response_model=GraphComponentsResponse)
+def get_graph_components(
+    min_size: int = Query(default=1, ge=1),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(require_analytics_access)
+):
+    """Компоненты связности графа дорожной сети (по убыванию размера)"""
+    graph = get_road_graph(db)
+    
+    labels = graph.connected_components()
+    components = []
+    if len(labels):
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        for members in np.split(order, boundaries):
+            if len(members) >= min_size:
+                components.append({
+                    "size": len(members),
+                    "detector_ids": [graph.external_ids[node] for node in members]
+                })
+    components.sort(key=lambda component: component["size"], reverse=True)
+    
+    return {
+        "nodes_count": graph.nodes_count,
+        "edges_count": graph.edges_count,
+        "components_count": int(labels.max()) + 1 if len(labels) else 0,
+        "components": components
+    }
+
+
 @router.get("/detectors", response_model=List[DetectorResponse])
 def get_detectors(
     db: Session = Depends(get_db),
@@ -1,10 +1,17 @@
 from pydantic import BaseModel, ConfigDict
 from typing import Dict, List, Optional
+from datetime import datetime
 from enum import Enum
 
 class FileType(str, Enum):
     CSV = "csv"
     EXCEL = "excel"
+    PARQUET = "parquet"  # exports and track reading imports, requires pyarrow
+    ARROW = "arrow"  # Arrow IPC stream
+
+class ImportMode(str, Enum):
+    APPEND = "append"  # insert every row (track readings: skip readings already stored)
+    UPSERT = "upsert"  # merge by the natural key: re-importing a file changes nothing (PostgreSQL)
 
 class ImportRequest(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
@@ -19,6 +26,32 @@ class ImportResponse(BaseModel):
     successful: int
     failed: int
     errors: List[str]
+    inserted: Optional[int] = None
+    updated: Optional[int] = None
+    skipped: Optional[int] = None  # upsert: unchanged rows and rows repeated in the file
+
+class ImportJobResponse(BaseModel):
+    """Import job state; result fields are filled in once the job completes"""
+    model_config = ConfigDict(protected_namespaces=())
+    
+    id: str
+    model_type: str
+    file_name: Optional[str] = None
+    mode: ImportMode = ImportMode.APPEND
+    status: str  # pending, running, completed, failed
+    rows_processed: int = 0
+    rows_per_second: Optional[float] = None
+    total_processed: Optional[int] = None
+    successful: Optional[int] = None
+    failed: Optional[int] = None
+    inserted: Optional[int] = None
+    updated: Optional[int] = None
+    skipped: Optional[int] = None
+    errors: List[str] = []
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 class ExportRequest(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
@@ -3,7 +3,7 @@
 """
 
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
 from datetime import datetime
 
 
@@ -95,6 +95,12 @@ class RouteClusterRequest(BaseModel):
     end_time: datetime
     top_n: int = Field(default=10, ge=1, le=50)
     min_vehicles_per_route: int = Field(default=2, ge=1)
+    # exact - точная сигнатура маршрута, similarity - объединение похожих маршрутов
+    clustering_mode: Literal["exact", "similarity"] = "exact"
+    similarity_threshold: float = Field(default=0.8, ge=0.5, le=1.0)
+    # readings - трек ТС за весь период, trips - сохраненные поездки (после сегментации),
+    # stats - почасовая статистика маршрутов
+    source: Literal["readings", "trips", "stats"] = "readings"
 
 
 class RouteClusterResponse(BaseModel):
@@ -107,6 +113,7 @@ class RouteClusterResponse(BaseModel):
     average_passage_time_seconds: Optional[float] = None
     coordinates: List[Dict]
     vehicles: List[str]
+    variants_count: int = 1
 
 
 class RouteClusteringResponse(BaseModel):
@@ -114,3 +121,124 @@ class RouteClusteringResponse(BaseModel):
     routes: List[RouteClusterResponse]
     time_range_hours: float
     total_vehicles_analyzed: int
+
+
+class GraphPathNode(BaseModel):
+    """Узел пути по графу дорожной сети"""
+    detector_id: str
+    latitude: float
+    longitude: float
+
+
+class ShortestPathResponse(BaseModel):
+    """Кратчайший путь между двумя детекторами"""
+    from_detector_id: str
+    to_detector_id: str
+    algorithm: str
+    found: bool
+    distance_meters: Optional[float] = None
+    path: List[GraphPathNode] = []
+
+
+class GraphNeighbour(BaseModel):
+    """Детектор в k-окрестности"""
+    detector_id: str
+    hops: int
+    latitude: float
+    longitude: float
+
+
+class GraphNeighbourhoodResponse(BaseModel):
+    """k-окрестность детектора в графе"""
+    detector_id: str
+    max_hops: int
+    neighbours: List[GraphNeighbour]
+
+
+class GraphComponent(BaseModel):
+    """Компонента связности графа"""
+    size: int
+    detector_ids: List[str]
+
+
+class GraphComponentsResponse(BaseModel):
+    """Компоненты связности графа дорожной сети"""
+    nodes_count: int
+    edges_count: int
+    components_count: int
+    components: List[GraphComponent]
+
+
+class ConvoyDetectionRequest(BaseModel):
+    """Запрос пакетного поиска колонн за временное окно"""
+    start_time: datetime
+    end_time: datetime
+    min_common_nodes: int = Field(default=3, ge=2, le=20)
+    max_time_gap_seconds: int = Field(default=300, ge=10, le=3600)
+    max_lead_seconds: int = Field(default=60, ge=5, le=300)
+
+
+class ConvoyPairResponse(BaseModel):
+    """Пара ТС, движущихся совместно"""
+    group_index: int
+    vehicle_a: str
+    vehicle_b: str
+    common_nodes_count: int
+    first_seen_at: datetime
+    last_seen_at: datetime
+    mean_lead_seconds: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ConvoyRunResponse(BaseModel):
+    """Состояние и результат запуска поиска колонн"""
+    id: str
+    status: str
+    start_time: datetime
+    end_time: datetime
+    min_common_nodes: int
+    max_time_gap_seconds: int
+    max_lead_seconds: int
+    readings_count: Optional[int] = None
+    pairs_count: Optional[int] = None
+    groups_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    pairs: List[ConvoyPairResponse] = []
+
+
+class TripSegmentationRequest(BaseModel):
+    """Запрос сегментации треков на поездки (пустые пороги - значения из настроек)"""
+    start_time: datetime
+    end_time: datetime
+    dwell_gap_seconds: Optional[int] = Field(default=None, ge=60, le=86400)
+    max_speed_kmh: Optional[float] = Field(default=None, ge=30, le=500)
+
+
+class TripSegmentationResponse(BaseModel):
+    """Результат сегментации треков"""
+    vehicles_count: int
+    trips_count: int
+    skipped_short_segments: int
+    end_reasons: Dict[str, int]
+    dwell_gap_seconds: float
+    max_speed_kmh: float
+    window_start: datetime  # Период, в котором поездки могли измениться (сеансы целиком)
+    window_end: datetime
+
+
+class TripResponse(BaseModel):
+    """Поездка ТС"""
+    id: str
+    vehicle_identifier: str
+    start_time: datetime
+    end_time: datetime
+    start_detector_id: str
+    end_detector_id: str
+    detector_sequence: List[str]
+    readings_count: int
+    average_speed_kmh: Optional[float] = None
+    end_reason: str
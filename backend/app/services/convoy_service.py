@@ -0,0 +1,458 @@
+"""
+Пакетный поиск колонн (совместного движения) по всему парку ТС
+
+В отличие от TrafficAnalysisService.find_joint_movements, который ищет
+попутчиков одного целевого ТС, здесь все чтения временного окна
+обрабатываются за один проход. Окно читается срезами по READINGS_SLICE в
+компактные массивы; в каждом срезе чтения сортируются по (детектор, время),
+и для каждого прохождения двоичным поиском находятся прохождения того же
+детектора другими ТС не позже чем через max_time_gap_seconds. Большие срезы
+делятся по детекторам между процессами пула. Пары, набравшие достаточно
+таких прохождений, проверяются тем же критерием, что и в
+find_joint_movements, результат сохраняется в таблицы
+convoy_detection_runs / convoy_pairs.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, and_
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import logging
+import multiprocessing
+import uuid
+import numpy as np
+import pandas as pd
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services.track_storage import get_track_storage
+from app.services.tracks import to_epoch_ms, from_epoch_ms, match_visits, is_joint_movement
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки при потоковом чтении строк из БД
+READINGS_YIELD_PER = 50000
+
+# Длительность среза окна, читаемого из БД за один раз
+READINGS_SLICE = timedelta(hours=1)
+
+# Ниже этого количества чтений в срезе пул процессов не используется
+PARALLEL_MIN_READINGS = 200000
+
+
+def _detector_pairs(vehicles: np.ndarray, timestamps: np.ndarray, detectors: np.ndarray,
+                    max_gap_ms: int) -> Tuple[np.ndarray, ...]:
+    """
+    Пары прохождений одного детектора разными ТС с разницей не более max_gap_ms
+
+    Входные массивы отсортированы по (детектор, время). Партнеры прохождения
+    i - прохождения i + 1 .. end_i, где end_i находится двоичным поиском
+    (np.searchsorted) по монотонному ключу (номер детектора, время); пары
+    порождаются векторно. Время - O(N log N + число пар).
+
+    Returns:
+        (vehicle_a, vehicle_b, visit_a, visit_b) для каждой пары, где
+        vehicle_a < vehicle_b, visit_a / visit_b - позиции прохождений во входных массивах
+    """
+    total = len(timestamps)
+    if total < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    # Детекторы разнесены по ключу дальше, чем на max_gap_ms: окно поиска не
+    # переходит на следующий детектор
+    detector_rank = np.r_[0, np.cumsum(detectors[1:] != detectors[:-1])]
+    base = int(timestamps.min())
+    span = int(timestamps.max()) - base + max_gap_ms + 1
+    keys = detector_rank * span + (timestamps - base)
+
+    positions = np.arange(total)
+    counts = np.searchsorted(keys, keys + max_gap_ms, side="right") - positions - 1
+    first = np.repeat(positions, counts)
+    group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + (np.arange(len(first)) - group_starts)
+
+    different = vehicles[first] != vehicles[second]
+    first, second = first[different], second[different]
+
+    swap = vehicles[first] > vehicles[second]
+    visit_a = np.where(swap, second, first)
+    visit_b = np.where(swap, first, second)
+    return vehicles[visit_a], vehicles[visit_b], visit_a, visit_b
+
+
+def _chunk_bounds(detectors: np.ndarray, chunks_count: int) -> List[Tuple[int, int]]:
+    """Разбиение отсортированного массива на куски по границам детекторов"""
+    total = len(detectors)
+    if total == 0:
+        return []
+
+    detector_starts = np.flatnonzero(np.r_[True, detectors[1:] != detectors[:-1]])
+    targets = np.linspace(0, total, chunks_count + 1)[1:-1]
+    positions = np.minimum(np.searchsorted(detector_starts, targets), len(detector_starts) - 1)
+    cuts = np.unique(detector_starts[positions])
+    bounds = np.r_[0, cuts[(cuts > 0) & (cuts < total)], total]
+
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _group_labels(vehicle_a: np.ndarray, vehicle_b: np.ndarray) -> np.ndarray:
+    """Номер колонны для каждой пары - компоненты связности графа пар (union-find)"""
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(node, node) != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    for a, b in zip(vehicle_a.tolist(), vehicle_b.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    roots = [find(a) for a in vehicle_a.tolist()]
+    _, labels = np.unique(np.array(roots, dtype=np.int64), return_inverse=True)
+    return labels
+
+
+def _encode(values: pd.Series, codes: Dict) -> np.ndarray:
+    """Коды значений колонки; новые значения получают следующие коды"""
+    for value in pd.unique(values):
+        codes.setdefault(value, len(codes))
+    return values.map(codes).to_numpy(dtype=np.int64)
+
+
+def _epoch_ms(values: pd.Series) -> np.ndarray:
+    """Время в миллисекундах эпохи, как to_epoch_ms (время без зоны считается UTC)"""
+    nanoseconds = pd.DatetimeIndex(pd.to_datetime(values, utc=True)).as_unit("ns").asi8
+    return (nanoseconds + 500_000) // 1_000_000
+
+
+class ConvoyDetectionService:
+    """Сервис пакетного поиска колонн"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_run(self, start_time: datetime, end_time: datetime,
+                   min_common_nodes: int = 3,
+                   max_time_gap_seconds: int = 300,
+                   max_lead_seconds: int = 60) -> models.ConvoyDetectionRun:
+        """Создание записи о запуске (выполняется отдельно через run)"""
+        run = models.ConvoyDetectionRun(
+            start_time=start_time,
+            end_time=end_time,
+            min_common_nodes=min_common_nodes,
+            max_time_gap_seconds=max_time_gap_seconds,
+            max_lead_seconds=max_lead_seconds,
+            status="pending"
+        )
+        self.db.add(run)
+        self.db.commit()
+        self.db.refresh(run)
+        return run
+
+    def run(self, run_id: uuid.UUID) -> Optional[models.ConvoyDetectionRun]:
+        """Выполнение поиска колонн и сохранение найденных пар"""
+        run = self.db.get(models.ConvoyDetectionRun, run_id)
+        if run is None:
+            return None
+
+        run.status = "running"
+        self.db.commit()
+
+        try:
+            max_gap_ms = run.max_time_gap_seconds * 1000
+            vehicle_names, vehicles, detectors, timestamps, candidates = self._scan_window(
+                run.start_time, run.end_time, max_gap_ms, run.min_common_nodes
+            )
+            convoys = self._joint_pairs(candidates, vehicles, detectors, timestamps, max_gap_ms,
+                                        run.min_common_nodes, run.max_lead_seconds)
+
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "run_id": run.id,
+                    "group_index": int(group),
+                    "vehicle_a": vehicle_names[a],
+                    "vehicle_b": vehicle_names[b],
+                    "common_nodes_count": int(count),
+                    "first_seen_at": from_epoch_ms(first),
+                    "last_seen_at": from_epoch_ms(last),
+                    "mean_lead_seconds": round(float(lead), 2)
+                }
+                for a, b, count, first, last, lead, group in zip(*convoys)
+            ]
+            if rows:
+                self.db.execute(insert(models.ConvoyPair), rows)
+
+            run.status = "completed"
+            run.readings_count = len(vehicles)
+            run.pairs_count = len(rows)
+            run.groups_count = len(np.unique(convoys[-1])) if rows else 0
+            run.finished_at = datetime.now(timezone.utc)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Convoy detection run {run_id} failed: {e}")
+            run.status = "failed"
+            run.error = str(e)
+            run.finished_at = datetime.now(timezone.utc)
+            self.db.commit()
+
+        return run
+
+    def _scan_window(self, start_time: datetime, end_time: datetime, max_gap_ms: int,
+                     min_common_nodes: int) -> Tuple:
+        """
+        Чтение окна срезами по READINGS_SLICE и отбор пар-кандидатов
+
+        Как и при поиске попутчиков одного ТС, для каждой пары считается число
+        прохождений каждого из ТС, рядом с которыми (тот же детектор,
+        не дальше max_gap_ms) было замечено другое ТС - верхняя оценка числа
+        совпадений. Дальше проверяются только пары, где она не меньше
+        min_common_nodes хотя бы для одного из ТС.
+
+        Срез дополняется хвостом предыдущих (чтения не раньше чем за max_gap_ms
+        до его начала); пара засчитывается срезу, которому принадлежит ее более
+        позднее прохождение, поэтому пары на границе срезов не теряются и не
+        считаются дважды. Прохождения различаются по сквозному номеру чтения в окне.
+
+        Returns:
+            (имена ТС по коду, vehicles, detectors, timestamps - все чтения окна,
+            (vehicle_a, vehicle_b, a_as_target, b_as_target) - пары-кандидаты)
+        """
+        vehicle_codes: Dict[str, int] = {}
+        detector_codes: Dict = {}
+        columns: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        visits_a, visits_b = [], []
+        loaded = 0
+
+        # Хвост предыдущих срезов: сквозные номера, ТС, детекторы, время
+        empty = np.empty(0, dtype=np.int64)
+        carry = (empty, empty, empty, empty)
+
+        workers = max(1, settings.CONVOY_DETECTION_WORKERS)
+        executor = None
+        try:
+            slice_start = start_time
+            while slice_start <= end_time:
+                slice_end = min(slice_start + READINGS_SLICE, end_time)
+                last = slice_end >= end_time
+                vehicles, detectors, timestamps = self._load_slice(
+                    slice_start, slice_end, last, vehicle_codes, detector_codes
+                )
+                columns.append((vehicles, detectors, timestamps))
+                numbers = loaded + np.arange(len(vehicles))
+                loaded += len(vehicles)
+
+                carried = len(carry[0])
+                numbers, vehicles, detectors, timestamps = (
+                    np.concatenate((previous, current))
+                    for previous, current in zip(carry, (numbers, vehicles, detectors, timestamps))
+                )
+
+                if executor is None and workers > 1 and len(vehicles) >= PARALLEL_MIN_READINGS:
+                    # Фоновая задача работает в потоке сервера: fork многопоточного процесса
+                    # может унаследовать захваченные блокировки, поэтому пул запускается через spawn
+                    executor = ProcessPoolExecutor(
+                        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                vehicle_a, vehicle_b, visit_a, visit_b = self._slice_pairs(
+                    vehicles, detectors, timestamps, max_gap_ms, executor, workers
+                )
+
+                # Пары только из хвоста уже засчитаны предыдущим срезам
+                own = np.maximum(visit_a, visit_b) >= carried
+                keys = (vehicle_a[own] << 32) | vehicle_b[own]
+                visits_a.append(np.unique(np.column_stack((keys, numbers[visit_a[own]])), axis=0))
+                visits_b.append(np.unique(np.column_stack((keys, numbers[visit_b[own]])), axis=0))
+
+                if last:
+                    break
+                slice_start = slice_end
+                tail = timestamps >= to_epoch_ms(slice_start) - max_gap_ms
+                carry = (numbers[tail], vehicles[tail], detectors[tail], timestamps[tail])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        vehicles, detectors, timestamps = (
+            np.concatenate(column) if column else empty for column in zip(*columns)
+        ) if columns else (empty, empty, empty)
+        return (
+            list(vehicle_codes), vehicles, detectors, timestamps,
+            self._candidates(visits_a, visits_b, min_common_nodes)
+        )
+
+    def _load_slice(self, start_time: datetime, end_time: datetime, include_end: bool,
+                    vehicle_codes: Dict[str, int], detector_codes: Dict) -> Tuple[np.ndarray, ...]:
+        """
+        Чтения среза [start_time, end_time) (с end_time, если include_end) в массивы кодов
+
+        Строки читаются пачками по READINGS_YIELD_PER и преобразуются
+        поколоночно; коды ТС и детекторов сквозные для всего окна.
+        """
+        readings = get_track_storage()
+        upper = readings.timestamp <= end_time if include_end else readings.timestamp < end_time
+        statement = readings.select(
+            readings.vehicle_identifier,
+            readings.detector_id,
+            readings.timestamp
+        ).where(
+            and_(readings.timestamp >= start_time, upper)
+        ).execution_options(yield_per=READINGS_YIELD_PER)
+
+        parts = []
+        for rows in self.db.execute(statement).partitions():
+            frame = pd.DataFrame(rows, columns=["vehicle", "detector", "timestamp"])
+            parts.append((
+                _encode(frame["vehicle"], vehicle_codes),
+                _encode(frame["detector"], detector_codes),
+                _epoch_ms(frame["timestamp"])
+            ))
+
+        if not parts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    @staticmethod
+    def _slice_pairs(vehicles: np.ndarray, detectors: np.ndarray, timestamps: np.ndarray,
+                     max_gap_ms: int, executor: Optional[ProcessPoolExecutor],
+                     workers: int) -> Tuple[np.ndarray, ...]:
+        """
+        Пары прохождений среза (_detector_pairs), параллельно по детекторам в executor
+
+        Returns:
+            (vehicle_a, vehicle_b, visit_a, visit_b), visit_* - позиции во входных массивах
+        """
+        order = np.lexsort((timestamps, detectors))
+        sorted_vehicles, sorted_detectors, sorted_timestamps = vehicles[order], detectors[order], timestamps[order]
+
+        if executor is None or len(vehicles) < PARALLEL_MIN_READINGS:
+            vehicle_a, vehicle_b, visit_a, visit_b = _detector_pairs(
+                sorted_vehicles, sorted_timestamps, sorted_detectors, max_gap_ms
+            )
+        else:
+            futures = [
+                (start, executor.submit(
+                    _detector_pairs,
+                    sorted_vehicles[start:end], sorted_timestamps[start:end], sorted_detectors[start:end],
+                    max_gap_ms
+                ))
+                for start, end in _chunk_bounds(sorted_detectors, workers * 4)
+            ]
+            parts = []
+            for start, future in futures:
+                part_a, part_b, part_visit_a, part_visit_b = future.result()
+                parts.append((part_a, part_b, part_visit_a + start, part_visit_b + start))
+            vehicle_a, vehicle_b, visit_a, visit_b = (np.concatenate(column) for column in zip(*parts))
+
+        return vehicle_a, vehicle_b, order[visit_a], order[visit_b]
+
+    @staticmethod
+    def _candidates(visits_a: List[np.ndarray], visits_b: List[np.ndarray],
+                    min_common_nodes: int) -> Tuple[np.ndarray, ...]:
+        """
+        Пары, у которых хотя бы одно ТС набрало min_common_nodes прохождений рядом с другим
+
+        visits_a / visits_b - строки (ключ пары, номер прохождения) по срезам;
+        ключ пары - vehicle_a << 32 | vehicle_b.
+
+        Returns:
+            (vehicle_a, vehicle_b, a_as_target, b_as_target) - пары и то, для какого
+            из ТС в роли целевого оценка достаточна
+        """
+        counts = []
+        for visits in (visits_a, visits_b):
+            distinct = np.unique(np.concatenate(visits), axis=0)[:, 0] if visits else np.empty(0, dtype=np.int64)
+            counts.append(np.unique(distinct, return_counts=True))
+
+        pair_keys = np.union1d(counts[0][0], counts[1][0])
+        if len(pair_keys) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty.astype(bool), empty.astype(bool)
+
+        per_pair = []
+        for counted_keys, counted in counts:
+            result = np.zeros(len(pair_keys), dtype=np.int64)
+            result[np.searchsorted(pair_keys, counted_keys)] = counted
+            per_pair.append(result)
+
+        a_as_target = per_pair[0] >= min_common_nodes
+        b_as_target = per_pair[1] >= min_common_nodes
+        keep = a_as_target | b_as_target
+        pair_keys = pair_keys[keep]
+        return pair_keys >> 32, pair_keys & 0xFFFFFFFF, a_as_target[keep], b_as_target[keep]
+
+    def _joint_pairs(self, candidates: Tuple[np.ndarray, ...], vehicles: np.ndarray,
+                     detectors: np.ndarray, timestamps: np.ndarray, max_gap_ms: int,
+                     min_common_nodes: int, max_lead_seconds: int) -> Tuple[np.ndarray, ...]:
+        """
+        Отбор пар-кандидатов по критерию совместного движения
+
+        Критерий тот же, что и в TrafficAnalysisService.find_joint_movements
+        (match_visits + is_joint_movement): пара сохраняется, если поиск попутчиков
+        vehicle_a нашел бы vehicle_b или наоборот. Совпадения и время первого /
+        последнего из них берутся по треку того ТС, для которого критерий выполнен.
+        """
+        pair_a, pair_b, a_as_target, b_as_target = candidates
+        if len(pair_a) == 0:
+            return tuple(np.empty(0) for _ in range(7))
+
+        # Треки ТС - срезы массивов, отсортированных по (ТС, время)
+        order = np.lexsort((timestamps, vehicles))
+        vehicles, detectors, timestamps = vehicles[order], detectors[order], timestamps[order]
+        bounds = np.searchsorted(vehicles, np.arange(vehicles.max() + 2))
+        tracks: Dict[int, Tuple[List[int], List[int]]] = {}
+
+        def track(vehicle: int) -> Tuple[List[int], List[int]]:
+            if vehicle not in tracks:
+                start, end = bounds[vehicle], bounds[vehicle + 1]
+                tracks[vehicle] = (detectors[start:end].tolist(), timestamps[start:end].tolist())
+            return tracks[vehicle]
+
+        result = []
+        for a, b, try_a, try_b in zip(pair_a.tolist(), pair_b.tolist(),
+                                      a_as_target.tolist(), b_as_target.tolist()):
+            for target, other, sign, enabled in ((a, b, 1, try_a), (b, a, -1, try_b)):
+                if not enabled:
+                    continue
+                target_detectors, target_times = track(target)
+                other_detectors, other_times = track(other)
+                matches = match_visits(target_detectors, target_times, other_detectors, other_times, max_gap_ms)
+                if not is_joint_movement(matches, target_detectors, target_times,
+                                         min_common_nodes, max_lead_seconds):
+                    continue
+
+                # Опережение vehicle_b относительно vehicle_a
+                leads = [sign * (other_time - target_times[idx]) / 1000.0 for idx, other_time in matches]
+                result.append((
+                    a, b, len(matches),
+                    target_times[matches[0][0]], target_times[matches[-1][0]],
+                    sum(leads) / len(leads)
+                ))
+                break
+
+        if not result:
+            return tuple(np.empty(0) for _ in range(7))
+
+        pair_a, pair_b, counts, first_seen, last_seen, mean_leads = (np.array(column) for column in zip(*result))
+        return (
+            pair_a, pair_b, counts, first_seen, last_seen,
+            mean_leads, _group_labels(pair_a, pair_b)
+        )
+
+
+def run_convoy_detection(run_id: uuid.UUID):
+    """Точка входа фоновой задачи - работает в собственной сессии БД"""
+    db = SessionLocal()
+    try:
+        ConvoyDetectionService(db).run(run_id)
+    finally:
+        db.close()
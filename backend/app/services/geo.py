@@ -0,0 +1,73 @@
+"""
+Геометрические утилиты для графа дорожной сети
+"""
+
+from typing import Iterator, Tuple
+from collections import defaultdict
+import math
+import numpy as np
+
+
+EARTH_RADIUS_METERS = 6371000  # Радиус Земли в метрах
+
+# Соседние ячейки сетки, которые нужно проверить для каждой ячейки.
+# Берется только "половина" окрестности, чтобы каждая пара ячеек
+# просматривалась ровно один раз.
+_FORWARD_NEIGHBOUR_CELLS = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def haversine_vectorized(lat1: np.ndarray, lon1: np.ndarray,
+                         lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Векторное вычисление расстояний по формуле гаверсинусов (в метрах)"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(lon2 - lon1)
+    
+    a = np.sin(delta_phi / 2) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    
+    return EARTH_RADIUS_METERS * c
+
+
+def grid_candidate_pairs(lats: np.ndarray, lons: np.ndarray,
+                        cell_size_meters: float) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Сеточный пространственный индекс для поиска пар-кандидатов
+    
+    Координаты проецируются на плоскость (равнопромежуточная проекция),
+    точки раскладываются по ячейкам размером cell_size_meters. Любая пара
+    точек на расстоянии не более cell_size_meters лежит в одной или в
+    соседних ячейках, поэтому сравниваются только такие пары.
+    Масштаб по долготе берется по самой "северной" точке, чтобы проекция
+    не завышала расстояния и не теряла кандидатов.
+    
+    Возвращает пачки (idx1, idx2) индексов с idx1 < idx2 для каждой пары.
+    """
+    lon_scale = math.cos(math.radians(float(np.max(np.abs(lats)))))
+    x = np.radians(lons) * EARTH_RADIUS_METERS * lon_scale
+    y = np.radians(lats) * EARTH_RADIUS_METERS
+    
+    cell_x = np.floor(x / cell_size_meters).astype(np.int64)
+    cell_y = np.floor(y / cell_size_meters).astype(np.int64)
+    
+    buckets = defaultdict(list)
+    for idx, cell in enumerate(zip(cell_x.tolist(), cell_y.tolist())):
+        buckets[cell].append(idx)
+    buckets = {cell: np.array(indices, dtype=np.int64) for cell, indices in buckets.items()}
+    
+    for (cx, cy), members in buckets.items():
+        # Пары внутри ячейки
+        if len(members) > 1:
+            idx1, idx2 = np.triu_indices(len(members), k=1)
+            yield members[idx1], members[idx2]
+        
+        # Пары с соседними ячейками
+        for dx, dy in _FORWARD_NEIGHBOUR_CELLS:
+            neighbours = buckets.get((cx + dx, cy + dy))
+            if neighbours is None:
+                continue
+            idx1 = np.repeat(members, len(neighbours))
+            idx2 = np.tile(neighbours, len(members))
+            yield np.minimum(idx1, idx2), np.maximum(idx1, idx2)
@@ -0,0 +1,419 @@
+"""
+Background import jobs
+
+POST /api/v1/import/{model_type} spools the upload to disk, records an
+import_jobs row and hands the job id to a pool of worker processes
+(IMPORT_JOB_WORKERS). The worker runs the regular importer in its own
+database session and writes progress (rows processed) to the job row while
+the import runs, so GET /api/v1/import/jobs/{id} can report progress,
+throughput and errors without touching the importing transaction. Route
+stats refreshes queued by an import are run by the web process once the
+job is done.
+
+Workers are started with the "spawn" method: forking a process that holds
+open database connections and server threads is not safe.
+
+A job is owned by the web process that queued it (its pool runs the job).
+Every web process refreshes the heartbeat of its own jobs and takes over
+jobs whose owner is gone (silent for IMPORT_JOB_STALE_SECONDS, or a dead
+process on the same host); a conditional UPDATE of the owner makes sure
+only one process settles each of them.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import or_, update
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services.route_stats_service import schedule_route_stats_refresh
+from app.utils.importer import DataImporter, IMPORT_SPECS, VehicleTrackReadingImporter
+from app.utils.uploads import remove_upload
+
+logger = logging.getLogger(__name__)
+
+# File extension -> file type passed to importers
+IMPORT_FILE_TYPES = {
+    "csv": "csv",
+    "xlsx": "excel",
+    "xls": "excel",
+    "parquet": "parquet",
+    "arrow": "arrow",
+    "feather": "arrow",
+    "ipc": "arrow",
+}
+
+TRACK_READINGS = "vehicle_track_readings"
+
+IMPORT_MODEL_TYPES = set(IMPORT_SPECS) | {TRACK_READINGS}
+
+# Minimum interval between progress writes to the job row
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Owner recorded on jobs queued by this process; the random token tells a restarted
+# process apart from its predecessor with the same pid (e.g. pid 1 in a container)
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def supports_upsert(model_type: str) -> bool:
+    """Whether the model can be imported in upsert mode (it has a natural key)"""
+    return model_type == TRACK_READINGS or bool(IMPORT_SPECS[model_type].natural_key)
+
+
+def supported_file_types(model_type: str) -> set:
+    """File types an importer can read (spec-based importers: Excel and CSV only)"""
+    if model_type == TRACK_READINGS:
+        return set(IMPORT_FILE_TYPES.values())
+    return {"csv", "excel"}
+
+
+class ImportJobService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_job(self, model_type: str, file_name: str, file_path: str, file_type: str,
+                   column_mapping: Dict[str, str], sheet_name: Optional[str] = None,
+                   detector_coords: Optional[Dict[str, Any]] = None, mode: str = "append",
+                   created_by: Optional[uuid.UUID] = None) -> models.ImportJob:
+        job = models.ImportJob(
+            model_type=model_type,
+            file_name=file_name,
+            file_path=file_path,
+            file_type=file_type,
+            column_mapping=json.dumps(column_mapping, ensure_ascii=False),
+            detector_coords=json.dumps(detector_coords, ensure_ascii=False) if detector_coords else None,
+            sheet_name=sheet_name,
+            mode=mode,
+            status="pending",
+            rows_processed=0,
+            created_by=created_by,
+            owner=OWNER,
+            heartbeat_at=datetime.now(timezone.utc)
+        )
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def run(self, job_id: uuid.UUID):
+        """Run a pending job to completion (in a worker process)"""
+        # Claimed with a conditional UPDATE: a job queued twice runs only once
+        claimed = self.db.execute(
+            update(models.ImportJob)
+            .where(models.ImportJob.id == job_id, models.ImportJob.status == "pending")
+            .values(status="running", started_at=datetime.now(timezone.utc))
+        ).rowcount
+        self.db.commit()
+
+        job = self.db.get(models.ImportJob, job_id)
+        if job is None:
+            logger.warning(f"Import job {job_id} not found")
+            return
+        if not claimed:
+            logger.warning(f"Import job {job_id} is already {job.status}")
+            return
+
+        try:
+            result = self._import(job, self._progress_writer(job.id))
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Import job {job_id} failed: {e}")
+            job = self.db.get(models.ImportJob, job_id)
+            job.status = "failed"
+            job.error = str(e)
+        else:
+            job = self.db.get(models.ImportJob, job_id)
+            job.status = "completed"
+            job.total_processed = result["total_processed"]
+            job.rows_processed = result["total_processed"]
+            job.successful = result["successful"]
+            job.failed = result["failed"]
+            job.inserted = result.get("inserted")
+            job.updated = result.get("updated")
+            job.skipped = result.get("skipped")
+            job.errors = json.dumps(result["errors"][:100], ensure_ascii=False)
+        finally:
+            remove_upload(job.file_path)
+
+        job.finished_at = datetime.now(timezone.utc)
+        self.db.commit()
+
+    def _import(self, job: models.ImportJob, progress: Callable[[int], None]) -> Dict[str, Any]:
+        mapping = json.loads(job.column_mapping or "{}")
+        mode = job.mode or "append"
+
+        if job.model_type == TRACK_READINGS:
+            importer = VehicleTrackReadingImporter(self.db, progress)
+            coords = {
+                key: tuple(value) for key, value in json.loads(job.detector_coords or "{}").items()
+            }
+            if job.file_type == "csv":
+                return importer.import_from_csv(job.file_path, mapping, coords, mode=mode)
+            if job.file_type == "parquet":
+                return importer.import_from_parquet(job.file_path, mapping, coords, mode=mode)
+            if job.file_type == "arrow":
+                return importer.import_from_arrow(job.file_path, mapping, coords, mode=mode)
+            return importer.import_from_excel(job.file_path, mapping, coords, job.sheet_name or 0, mode=mode)
+
+        return DataImporter(self.db, progress).import_spec(
+            IMPORT_SPECS[job.model_type],
+            source=job.file_path,
+            file_type=job.file_type,
+            column_mapping=mapping,
+            sheet_name=job.sheet_name,
+            mode=mode
+        )
+
+    def _progress_writer(self, job_id: uuid.UUID) -> Callable[[int], None]:
+        """
+        Progress callback for importers
+
+        Progress goes through a separate short-lived session: the importer's
+        session may hold an open transaction that must not be committed here.
+        """
+        last_write = [0.0]
+
+        def write_progress(rows_processed: int):
+            now = time.monotonic()
+            if now - last_write[0] < PROGRESS_INTERVAL_SECONDS:
+                return
+            last_write[0] = now
+
+            progress_db = SessionLocal()
+            try:
+                progress_db.execute(
+                    update(models.ImportJob)
+                    .where(models.ImportJob.id == job_id)
+                    .values(rows_processed=rows_processed)
+                )
+                progress_db.commit()
+            except Exception as e:
+                progress_db.rollback()
+                logger.warning(f"Import job {job_id} progress update failed: {e}")
+            finally:
+                progress_db.close()
+
+        return write_progress
+
+    def mark_failed(self, job_id: uuid.UUID, error: str):
+        job = self.db.get(models.ImportJob, job_id)
+        if job is None:
+            return
+        job.status = "failed"
+        job.error = error
+        job.finished_at = datetime.now(timezone.utc)
+        self.db.commit()
+        remove_upload(job.file_path)
+
+    def touch_owned_jobs(self) -> int:
+        """Refresh the heartbeat of this process's pending and running jobs"""
+        touched = self.db.execute(
+            update(models.ImportJob)
+            .where(models.ImportJob.owner == OWNER, models.ImportJob.status.in_(("pending", "running")))
+            .values(heartbeat_at=datetime.now(timezone.utc))
+        ).rowcount
+        self.db.commit()
+        return touched
+
+    def recover_orphaned_jobs(self) -> List[uuid.UUID]:
+        """
+        Settle jobs whose owner process is gone (at startup and periodically)
+
+        A running job's worker died with its owner; the import may have
+        committed part of the file, so it is marked failed rather than re-run.
+        A pending job never started: it is returned for resubmission if its
+        upload is still on disk, otherwise marked failed. Jobs of live owners,
+        here or on other hosts, are left alone.
+        """
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+        jobs = self.db.query(models.ImportJob).filter(
+            models.ImportJob.status.in_(("pending", "running")),
+            or_(models.ImportJob.owner.is_(None), models.ImportJob.owner != OWNER)
+        ).all()
+
+        resubmit = []
+        for job in jobs:
+            if not _owner_gone(job.owner, job.heartbeat_at, stale_before) or not self._take_over(job):
+                continue
+            if job.status == "running":
+                self.mark_failed(job.id, "Import interrupted: the server process running it stopped")
+            elif job.file_path and os.path.exists(job.file_path):
+                resubmit.append(job.id)
+            else:
+                self.mark_failed(job.id, "Upload lost in a server restart")
+        return resubmit
+
+    def _take_over(self, job: models.ImportJob) -> bool:
+        """Become the job's owner unless another process has already taken it over"""
+        claimed = self.db.execute(
+            update(models.ImportJob)
+            .where(
+                models.ImportJob.id == job.id,
+                models.ImportJob.status == job.status,
+                models.ImportJob.owner.is_not_distinct_from(job.owner),
+                models.ImportJob.heartbeat_at.is_not_distinct_from(job.heartbeat_at)
+            )
+            .values(owner=OWNER, heartbeat_at=datetime.now(timezone.utc))
+        ).rowcount
+        self.db.commit()
+        return bool(claimed)
+
+
+def _owner_gone(owner: Optional[str], heartbeat_at: Optional[datetime], stale_before: datetime) -> bool:
+    """Whether a job's owner stopped: no heartbeat for too long, or a dead process on this host"""
+    if owner is None or heartbeat_at is None:
+        return True  # Queued before owners were recorded
+    if heartbeat_at.tzinfo is None:  # SQLite returns naive timestamps
+        heartbeat_at = heartbeat_at.replace(tzinfo=timezone.utc)
+    if heartbeat_at < stale_before:
+        return True
+
+    host, pid, _ = owner.rsplit(":", 2)
+    return host == socket.gethostname() and not _process_exists(int(pid))
+
+
+def _process_exists(pid: int) -> bool:
+    if os.name != "posix":
+        return True  # No cheap check: rely on the heartbeat
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists, owned by another user
+    return True
+
+
+def run_import_job(job_id: uuid.UUID):
+    """Worker process entry point - runs the job in its own database session"""
+    db = SessionLocal()
+    try:
+        ImportJobService(db).run(job_id)
+    finally:
+        db.close()
+
+
+_executor_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, settings.IMPORT_JOB_WORKERS),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _reset_executor():
+    """Drop a broken pool so the next job starts fresh workers"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def submit_import_job(job_id: uuid.UUID) -> Future:
+    """Queue a job on the worker pool; a job that cannot be queued is marked failed"""
+    start_job_monitor()  # Keeps the heartbeat of the job fresh while it is queued and running
+    try:
+        future = _get_executor().submit(run_import_job, job_id)
+    except Exception as e:
+        logger.error(f"Could not queue import job {job_id}: {e}")
+        db = SessionLocal()
+        try:
+            ImportJobService(db).mark_failed(job_id, f"Could not queue import job: {e}")
+        finally:
+            db.close()
+        raise
+
+    def fail_on_crash(done: Future):
+        # Errors inside run() are stored on the job; this handles a worker that died
+        error = done.exception()
+        if error is None:
+            return
+        logger.error(f"Import job {job_id} worker crashed: {error}")
+        if isinstance(error, BrokenProcessPool):
+            _reset_executor()
+
+        db = SessionLocal()
+        try:
+            job = db.get(models.ImportJob, job_id)
+            if job is not None and job.status in ("pending", "running"):
+                ImportJobService(db).mark_failed(job_id, f"Import worker crashed: {error}")
+        finally:
+            db.close()
+
+    def refresh_route_stats(done: Future):
+        # Readings imports queue route stats refreshes; the queue is drained here, in the
+        # web process, not in the worker that may exit with the refresh thread still running
+        try:
+            schedule_route_stats_refresh()
+        except Exception as e:
+            logger.error(f"Could not schedule route stats refresh after import job {job_id}: {e}")
+
+    future.add_done_callback(fail_on_crash)
+    future.add_done_callback(refresh_route_stats)
+    return future
+
+
+def resume_import_jobs() -> int:
+    """
+    Refresh this process's jobs, settle orphaned ones and requeue those pending
+
+    Returns:
+        Number of jobs requeued
+    """
+    db = SessionLocal()
+    try:
+        service = ImportJobService(db)
+        service.touch_owned_jobs()
+        job_ids = service.recover_orphaned_jobs()
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        submit_import_job(job_id)
+    return len(job_ids)
+
+
+_monitor_lock = threading.Lock()
+_monitor: Optional[threading.Thread] = None
+
+
+def _monitor_jobs():
+    while True:
+        time.sleep(settings.IMPORT_JOB_HEARTBEAT_SECONDS)
+        try:
+            requeued = resume_import_jobs()
+            if requeued:
+                logger.info(f"Requeued {requeued} orphaned import jobs")
+        except Exception as e:
+            logger.warning(f"Import job heartbeat failed: {e}")
+
+
+def start_job_monitor():
+    """Start the thread that runs resume_import_jobs every IMPORT_JOB_HEARTBEAT_SECONDS"""
+    global _monitor
+
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = threading.Thread(target=_monitor_jobs, name="import-job-monitor", daemon=True)
+            _monitor.start()
@@ -0,0 +1,212 @@
+"""
+Управление секциями таблицы чтений ТС (PostgreSQL)
+
+Таблица чтений текущего режима хранения (vehicle_track_readings или
+vehicle_track_readings_compact) секционирована по диапазонам timestamp
+(день или неделя, см. TRACK_PARTITION_INTERVAL). Запросы с условием на
+временное окно читают только нужные секции, а удаление старых данных -
+это отсоединение секции вместо массового DELETE.
+
+- секции создаются заранее на TRACK_PARTITIONS_AHEAD интервалов вперед;
+- чтения вне созданных секций попадают в секцию по умолчанию, при создании
+  секции строки ее диапазона переносятся из секции по умолчанию;
+- секции старше TRACK_RETENTION_DAYS отсоединяются и переносятся в схему
+  TRACK_ARCHIVE_SCHEMA (или удаляются, если схема не задана).
+
+Для других СУБД (SQLite в разработке) все функции ничего не делают.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, time, timedelta, timezone
+import logging
+import re
+from app.config import settings
+from app.services.track_storage import get_track_storage
+
+logger = logging.getLogger(__name__)
+
+
+def _parent_table(table: Optional[str]) -> str:
+    """Секционируемая таблица - таблица чтений текущего режима хранения"""
+    return table or get_track_storage().table_name
+
+
+def partition_bounds(day: date, interval: Optional[str] = None) -> Tuple[date, date]:
+    """Границы [начало, конец) секции, содержащей день day"""
+    interval = interval or settings.TRACK_PARTITION_INTERVAL
+    if interval == "day":
+        return day, day + timedelta(days=1)
+    if interval == "week":
+        start = day - timedelta(days=day.weekday())  # Неделя с понедельника
+        return start, start + timedelta(days=7)
+    raise ValueError(f"Unsupported partition interval: {interval}")
+
+
+def partition_name(start: date, table: Optional[str] = None) -> str:
+    return f"{_parent_table(table)}_p{start:%Y%m%d}"
+
+
+def default_partition_name(table: Optional[str] = None) -> str:
+    return f"{_parent_table(table)}_default"
+
+
+def _bound_literal(day: date) -> str:
+    return f"'{day.isoformat()} 00:00:00+00'"
+
+
+def is_partitioned(db: Session, table: Optional[str] = None) -> bool:
+    """Секционирована ли таблица чтений (False для СУБД, отличных от PostgreSQL)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return bool(db.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name)"
+    ), {"name": _parent_table(table)}).scalar())
+
+
+_PARTITION_BOUND = re.compile(r"FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _parse_bound(value: str) -> datetime:
+    """Граница секции из pg_get_expr (timestamptz в часовом поясе сеанса) в UTC"""
+    if re.search(r"[+-]\d{2}$", value):
+        value += ":00"  # Смещение вида +03 без минут
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def list_partitions(db: Session, table: Optional[str] = None) -> List[Tuple[str, datetime, datetime]]:
+    """
+    Секции таблицы чтений (кроме секции по умолчанию): (имя, начало, конец)
+
+    Границы читаются из каталога (pg_partition_tree, relpartbound), а не
+    выводятся из имени и текущего TRACK_PARTITION_INTERVAL: интервал мог
+    меняться, и секции разной длины сосуществуют.
+    """
+    rows = db.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_partition_tree(CAST(:name AS regclass)) tree "
+        "JOIN pg_class c ON c.oid = tree.relid "
+        "WHERE tree.isleaf AND tree.level = 1"
+    ), {"name": _parent_table(table)}).all()
+
+    partitions = []
+    for name, bound in rows:
+        match = _PARTITION_BOUND.match(bound or "")
+        if match:  # Секция по умолчанию (DEFAULT) и MINVALUE/MAXVALUE пропускаются
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_default_partition(db: Session, table: Optional[str] = None):
+    table = _parent_table(table)
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"
+    ))
+
+
+def ensure_partitions(db: Session, start_day: date, end_day: date,
+                      table: Optional[str] = None) -> List[str]:
+    """
+    Создание недостающих секций, покрывающих дни [start_day, end_day]
+
+    Секция создается отдельной таблицей, в нее переносятся строки ее
+    диапазона из секции по умолчанию, после чего она присоединяется к
+    родительской таблице - так создание не падает, если данные уже есть.
+    """
+    table = _parent_table(table)
+    default_partition = default_partition_name(table)
+    existing = list_partitions(db, table)
+    created = []
+
+    day = start_day
+    while day <= end_day:
+        lower, upper = partition_bounds(day)
+        name = partition_name(lower, table)
+        day = upper
+
+        # Диапазон уже покрыт секцией (в том числе созданной при другом интервале)
+        lower_time = datetime.combine(lower, time.min, timezone.utc)
+        upper_time = datetime.combine(upper, time.min, timezone.utc)
+        if any(start < upper_time and lower_time < end for _, start, end in existing):
+            continue
+
+        db.execute(text(
+            f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ))
+        db.execute(text(
+            f"WITH moved AS (DELETE FROM {default_partition} "
+            f"WHERE timestamp >= {_bound_literal(lower)} AND timestamp < {_bound_literal(upper)} "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ))
+        db.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({_bound_literal(lower)}) TO ({_bound_literal(upper)})"
+        ))
+        created.append(name)
+
+    return created
+
+
+def detach_old_partitions(db: Session, retention_days: int,
+                          archive_schema: Optional[str] = None,
+                          table: Optional[str] = None) -> List[str]:
+    """
+    Отсоединение секций, целиком лежащих старше retention_days дней
+
+    Отсоединенная секция переносится в схему archive_schema, а если схема
+    не задана - удаляется.
+    """
+    table = _parent_table(table)
+    today = datetime.now(timezone.utc).date()
+    cutoff = datetime.combine(today - timedelta(days=retention_days), time.min, timezone.utc)
+    detached = []
+
+    for name, _, upper in list_partitions(db, table):
+        if upper > cutoff:
+            continue
+
+        db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if archive_schema:
+            db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+            db.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+        else:
+            db.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+
+    return detached
+
+
+def maintain_partitions(db: Session, retention_days: Optional[int] = None) -> Dict:
+    """
+    Плановое обслуживание секций: секции на будущее и отсоединение старых
+
+    Вызывается при старте приложения и из scripts/manage_partitions.py.
+    """
+    if not is_partitioned(db):
+        return {"partitioned": False, "created": [], "detached": []}
+
+    retention_days = settings.TRACK_RETENTION_DAYS if retention_days is None else retention_days
+
+    try:
+        ensure_default_partition(db)
+        today = datetime.now(timezone.utc).date()
+        _, horizon = partition_bounds(today)
+        for _ in range(settings.TRACK_PARTITIONS_AHEAD):
+            _, horizon = partition_bounds(horizon)
+        created = ensure_partitions(db, today, horizon - timedelta(days=1))
+
+        detached = []
+        if retention_days > 0:
+            detached = detach_old_partitions(db, retention_days, settings.TRACK_ARCHIVE_SCHEMA or None)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if created or detached:
+        logger.info(f"Track partitions: created {created}, detached {detached}")
+
+    return {"partitioned": True, "created": created, "detached": detached}
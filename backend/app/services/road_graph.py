@@ -0,0 +1,310 @@
+"""
+Скомпилированный граф дорожной сети в памяти процесса
+
+Граф строится из таблиц detectors и road_network_edges и хранится в виде
+CSR-массивов (indptr/indices/weights), индексированных целочисленными
+порядковыми номерами детекторов. Объект графа неизменяем и кэшируется на
+процесс; кэш перестраивается только при изменении таблицы ребер.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+import heapq
+import threading
+import time
+import numpy as np
+from app import models
+from app.services.geo import haversine_vectorized
+
+
+# Как часто (в секундах) сверять кэш с таблицей ребер
+GRAPH_FINGERPRINT_CHECK_SECONDS = 30.0
+
+
+class RoadGraph:
+    """Неизменяемый граф дорожной сети (неориентированный, веса - метры)"""
+
+    __slots__ = (
+        "detector_ids", "external_ids", "latitudes", "longitudes",
+        "indptr", "indices", "weights", "fingerprint",
+        "_ordinals", "_external_ordinals", "_adjacency", "_components", "_edge_keys"
+    )
+
+    def __init__(self, detector_ids: List, external_ids: List[str],
+                 latitudes: np.ndarray, longitudes: np.ndarray,
+                 indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                 fingerprint: Tuple = ()):
+        self.detector_ids = tuple(detector_ids)
+        self.external_ids = tuple(external_ids)
+        self.latitudes = _frozen(latitudes)
+        self.longitudes = _frozen(longitudes)
+        self.indptr = _frozen(indptr)
+        self.indices = _frozen(indices)
+        self.weights = _frozen(weights)
+        self.fingerprint = fingerprint
+
+        self._ordinals = {det_id: idx for idx, det_id in enumerate(self.detector_ids)}
+        self._external_ordinals = {ext_id: idx for idx, ext_id in enumerate(self.external_ids)}
+        # Списки Python для обходов - индексация numpy-скаляров в цикле медленнее
+        self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        self._components = None
+        # Ключи ребер (источник * число узлов + цель) - возрастают, т.к. CSR отсортирован
+        sources = np.repeat(np.arange(self.nodes_count, dtype=np.int64), np.diff(self.indptr))
+        self._edge_keys = _frozen(sources * self.nodes_count + self.indices)
+
+    @classmethod
+    def load(cls, db: Session, fingerprint: Tuple = ()) -> "RoadGraph":
+        """Загрузка графа из таблиц detectors и road_network_edges"""
+        detectors = db.query(
+            models.Detector.id,
+            models.Detector.detector_id,
+            models.Detector.latitude,
+            models.Detector.longitude
+        ).order_by(models.Detector.detector_id).all()
+
+        detector_ids = [det.id for det in detectors]
+        external_ids = [det.detector_id for det in detectors]
+        latitudes = np.array([float(det.latitude) for det in detectors], dtype=np.float64)
+        longitudes = np.array([float(det.longitude) for det in detectors], dtype=np.float64)
+        ordinals = {det_id: idx for idx, det_id in enumerate(detector_ids)}
+
+        sources = []
+        targets = []
+        distances = []
+        for from_id, to_id, distance in db.query(
+            models.RoadNetworkEdge.from_detector_id,
+            models.RoadNetworkEdge.to_detector_id,
+            models.RoadNetworkEdge.distance_meters
+        ).all():
+            if from_id not in ordinals or to_id not in ordinals:
+                continue
+            sources.append(ordinals[from_id])
+            targets.append(ordinals[to_id])
+            distances.append(float(distance) if distance is not None else np.nan)
+
+        sources = np.array(sources, dtype=np.int32)
+        targets = np.array(targets, dtype=np.int32)
+        distances = np.array(distances, dtype=np.float64)
+
+        # Для ребер без расстояния берем расстояние по прямой
+        missing = np.isnan(distances)
+        if missing.any():
+            distances[missing] = haversine_vectorized(
+                latitudes[sources[missing]], longitudes[sources[missing]],
+                latitudes[targets[missing]], longitudes[targets[missing]]
+            )
+
+        indptr, indices, weights = _build_csr(len(detector_ids), sources, targets, distances)
+
+        return cls(detector_ids, external_ids, latitudes, longitudes,
+                   indptr, indices, weights, fingerprint)
+
+    @property
+    def nodes_count(self) -> int:
+        return len(self.detector_ids)
+
+    @property
+    def edges_count(self) -> int:
+        # Каждое ребро хранится в обоих направлениях
+        return len(self.indices) // 2
+
+    def ordinal(self, detector_id) -> Optional[int]:
+        """Порядковый номер детектора по UUID или внешнему ID_детектора"""
+        if detector_id in self._ordinals:
+            return self._ordinals[detector_id]
+        return self._external_ordinals.get(str(detector_id))
+
+    def neighbours(self, ordinal: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Соседи узла и длины ребер до них"""
+        start, end = self.indptr[ordinal], self.indptr[ordinal + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    def edge_lengths(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """Длины ребер для пар узлов (NaN, если узлы не соединены ребром)"""
+        keys = np.asarray(sources, dtype=np.int64) * self.nodes_count + np.asarray(targets, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._edge_keys, keys), max(len(self._edge_keys) - 1, 0))
+
+        lengths = np.full(len(keys), np.nan)
+        if len(self._edge_keys):
+            found = self._edge_keys[positions] == keys
+            lengths[found] = self.weights[positions[found]]
+        return lengths
+
+    def shortest_path(self, source: int, target: int,
+                      algorithm: str = "dijkstra") -> Optional[Tuple[List[int], float]]:
+        """
+        Кратчайший путь между двумя узлами
+
+        Args:
+            source: Порядковый номер начального детектора
+            target: Порядковый номер конечного детектора
+            algorithm: "dijkstra" или "astar" (эвристика - расстояние по прямой)
+
+        Returns:
+            (последовательность порядковых номеров, длина в метрах) или None
+        """
+        if algorithm not in ("dijkstra", "astar"):
+            raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+        if source == target:
+            return [source], 0.0
+
+        if algorithm == "astar":
+            # Веса ребер - расстояния не короче прямой, поэтому эвристика допустима
+            heuristic = haversine_vectorized(
+                self.latitudes, self.longitudes,
+                self.latitudes[target], self.longitudes[target]
+            ).tolist()
+        else:
+            heuristic = None
+
+        indptr, indices, weights = self._adjacency
+        distances = {source: 0.0}
+        previous = {}
+        visited = set()
+        heap = [(heuristic[source] if heuristic is not None else 0.0, 0.0, source)]
+
+        while heap:
+            _, distance, node = heapq.heappop(heap)
+            if node in visited:
+                continue
+            if node == target:
+                return self._unwind_path(previous, source, target), distance
+            visited.add(node)
+
+            for pos in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[pos]
+                if neighbour in visited:
+                    continue
+                candidate = distance + weights[pos]
+                if candidate < distances.get(neighbour, float("inf")):
+                    distances[neighbour] = candidate
+                    previous[neighbour] = node
+                    priority = candidate + (heuristic[neighbour] if heuristic is not None else 0.0)
+                    heapq.heappush(heap, (priority, candidate, neighbour))
+
+        return None
+
+    def k_hop_neighbourhood(self, source: int, hops: int) -> Dict[int, int]:
+        """Узлы, достижимые не более чем за hops ребер: {порядковый номер: число ребер}"""
+        indptr, indices, _ = self._adjacency
+        reached = {source: 0}
+        queue = deque([source])
+
+        while queue:
+            node = queue.popleft()
+            depth = reached[node]
+            if depth >= hops:
+                continue
+            for pos in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[pos]
+                if neighbour not in reached:
+                    reached[neighbour] = depth + 1
+                    queue.append(neighbour)
+
+        return reached
+
+    def connected_components(self) -> np.ndarray:
+        """Метка компоненты связности для каждого узла (вычисляется один раз)"""
+        if self._components is not None:
+            return self._components
+
+        indptr, indices, _ = self._adjacency
+        labels = [-1] * self.nodes_count
+        label = 0
+
+        for start in range(self.nodes_count):
+            if labels[start] != -1:
+                continue
+            labels[start] = label
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                for pos in range(indptr[node], indptr[node + 1]):
+                    neighbour = indices[pos]
+                    if labels[neighbour] == -1:
+                        labels[neighbour] = label
+                        stack.append(neighbour)
+            label += 1
+
+        self._components = _frozen(np.array(labels, dtype=np.int32))
+        return self._components
+
+    def _unwind_path(self, previous: Dict[int, int], source: int, target: int) -> List[int]:
+        path = [target]
+        while path[-1] != source:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array = np.ascontiguousarray(array)
+    array.setflags(write=False)
+    return array
+
+
+def _build_csr(nodes_count: int, sources: np.ndarray, targets: np.ndarray,
+               distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Построение CSR-представления неориентированного графа"""
+    all_sources = np.concatenate([sources, targets])
+    all_targets = np.concatenate([targets, sources])
+    all_weights = np.concatenate([distances, distances])
+
+    order = np.lexsort((all_targets, all_sources))
+    all_sources = all_sources[order]
+
+    indptr = np.zeros(nodes_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_sources, minlength=nodes_count), out=indptr[1:])
+
+    return indptr, all_targets[order].astype(np.int32), all_weights[order]
+
+
+# ---- Кэш графа на процесс ----
+
+_cache_lock = threading.Lock()
+_cached_graph: Optional[RoadGraph] = None
+_last_checked_at = 0.0
+
+
+def _edge_table_fingerprint(db: Session) -> Tuple:
+    """Дешевый отпечаток таблиц графа для проверки актуальности кэша"""
+    edges_count, last_created = db.query(
+        func.count(models.RoadNetworkEdge.id),
+        func.max(models.RoadNetworkEdge.created_at)
+    ).one()
+    detectors_count = db.query(func.count(models.Detector.id)).scalar()
+    return (edges_count, last_created, detectors_count)
+
+
+def get_road_graph(db: Session) -> RoadGraph:
+    """
+    Граф дорожной сети из кэша процесса
+
+    Отпечаток таблицы ребер сверяется не чаще раза в
+    GRAPH_FINGERPRINT_CHECK_SECONDS, поэтому большинство запросов
+    обслуживается без обращения к БД.
+    """
+    global _cached_graph, _last_checked_at
+
+    with _cache_lock:
+        now = time.monotonic()
+        if _cached_graph is not None and now - _last_checked_at < GRAPH_FINGERPRINT_CHECK_SECONDS:
+            return _cached_graph
+
+        fingerprint = _edge_table_fingerprint(db)
+        if _cached_graph is None or _cached_graph.fingerprint != fingerprint:
+            _cached_graph = RoadGraph.load(db, fingerprint)
+        _last_checked_at = now
+        return _cached_graph
+
+
+def invalidate_road_graph():
+    """Сброс кэша графа (вызывается после изменения таблицы ребер)"""
+    global _cached_graph, _last_checked_at
+
+    with _cache_lock:
+        _cached_graph = None
+        _last_checked_at = 0.0
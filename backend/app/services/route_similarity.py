@@ -0,0 +1,202 @@
+"""
+Приближенная кластеризация маршрутов по сходству последовательностей детекторов
+
+Точная группировка по сигнатуре "A->B->C" разбивает популярный маршрут на
+множество одиночных при единственном пропуске детекции. Здесь похожие
+последовательности объединяются:
+
+1. MinHash по n-граммам (шинглам) последовательности детекторов;
+2. LSH по полосам MinHash-сигнатур - кандидаты в похожие за почти линейное время;
+3. проверка кандидатов по длине наибольшей общей подпоследовательности (LCS);
+4. объединение (union-find) и выбор медоиды - представительного маршрута кластера.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+from collections import defaultdict
+import numpy as np
+
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Параметры MinHash/LSH: NUM_PERMUTATIONS = LSH_BANDS * строк в полосе
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 2
+
+# Сколько шинглов хэшируется за один векторный шаг (ограничивает память)
+MINHASH_BATCH_SHINGLES = 200000
+
+# Ограничения на перебор при выборе медоиды крупного кластера
+MEDOID_CANDIDATES = 50
+MEDOID_REFERENCE_MEMBERS = 200
+
+
+def lcs_length(first: Sequence[int], second: Sequence[int]) -> int:
+    """Длина наибольшей общей подпоследовательности (бит-параллельный алгоритм Хюрё)"""
+    if not first or not second:
+        return 0
+
+    masks: Dict[int, int] = {}
+    for position, token in enumerate(first):
+        masks[token] = masks.get(token, 0) | (1 << position)
+
+    full = (1 << len(first)) - 1
+    row = full
+    for token in second:
+        matched = row & masks.get(token, 0)
+        row = ((row + matched) | (row - matched)) & full
+
+    return len(first) - bin(row).count("1")
+
+
+def sequence_similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Сходство последовательностей: LCS / длина более длинной"""
+    longest = max(len(first), len(second))
+    return lcs_length(first, second) / longest if longest else 1.0
+
+
+def _shingles(sequence: np.ndarray, vocabulary_size: int) -> np.ndarray:
+    """Числовые идентификаторы n-грамм последовательности"""
+    if len(sequence) < SHINGLE_SIZE:
+        return sequence.astype(np.int64) % MERSENNE_PRIME
+
+    ids = np.zeros(len(sequence) - SHINGLE_SIZE + 1, dtype=np.int64)
+    for offset in range(SHINGLE_SIZE):
+        ids = ids * vocabulary_size + sequence[offset:len(sequence) - SHINGLE_SIZE + 1 + offset]
+    return ids % MERSENNE_PRIME
+
+
+def minhash_signatures(sequences: List[np.ndarray], num_permutations: int = NUM_PERMUTATIONS,
+                       seed: int = 42) -> np.ndarray:
+    """MinHash-сигнатуры (n x num_permutations) для последовательностей детекторов"""
+    vocabulary_size = int(max((int(seq.max()) for seq in sequences if len(seq)), default=0)) + 1
+    rng = np.random.RandomState(seed)
+    coef_a = rng.randint(1, MERSENNE_PRIME, size=(num_permutations, 1)).astype(np.uint64)
+    coef_b = rng.randint(0, MERSENNE_PRIME, size=(num_permutations, 1)).astype(np.uint64)
+
+    signatures = np.empty((len(sequences), num_permutations), dtype=np.uint64)
+
+    start = 0
+    while start < len(sequences):
+        # Пачка последовательностей, суммарно не более MINHASH_BATCH_SHINGLES шинглов
+        batch, total, end = [], 0, start
+        while end < len(sequences) and (not batch or total < MINHASH_BATCH_SHINGLES):
+            shingles = _shingles(sequences[end], vocabulary_size)
+            batch.append(shingles)
+            total += len(shingles)
+            end += 1
+
+        lengths = np.array([len(shingles) for shingles in batch])
+        offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        hashed = (coef_a * np.concatenate(batch).astype(np.uint64)[None, :] + coef_b) % MERSENNE_PRIME
+        signatures[start:end] = np.minimum.reduceat(hashed, offsets, axis=1).T
+
+        start = end
+
+    return signatures
+
+
+def _lsh_candidate_pairs(signatures: np.ndarray, bands: int = LSH_BANDS) -> set:
+    """
+    Пары-кандидаты: последовательности, совпавшие хотя бы в одной полосе сигнатуры
+
+    Внутри корзины каждый элемент сравнивается с первым элементом корзины и
+    с предыдущим, чтобы популярные корзины не давали квадратичного числа пар.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    pairs = set()
+
+    for band in range(bands):
+        band_rows = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = band_rows.view(np.dtype((np.void, band_rows.dtype.itemsize * rows_per_band))).ravel()
+        _, bucket_ids = np.unique(keys, return_inverse=True)
+
+        order = np.argsort(bucket_ids, kind="stable")
+        sorted_buckets = bucket_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end - start < 2:
+                continue
+            members = order[start:end].tolist()
+            leader = members[0]
+            for previous, member in zip(members, members[1:]):
+                pairs.add((min(leader, member), max(leader, member)))
+                pairs.add((min(previous, member), max(previous, member)))
+
+    return pairs
+
+
+def _find(parent: List[int], node: int) -> int:
+    root = node
+    while parent[root] != root:
+        root = parent[root]
+    while parent[node] != root:
+        parent[node], node = root, parent[node]
+    return root
+
+
+def _medoid(members: List[int], sequences: List[List[int]], weights: Sequence[int]) -> int:
+    """Элемент кластера с максимальным взвешенным сходством с остальными"""
+    if len(members) == 1:
+        return members[0]
+
+    by_weight = sorted(members, key=lambda idx: weights[idx], reverse=True)
+    candidates = by_weight[:MEDOID_CANDIDATES]
+    references = by_weight[:MEDOID_REFERENCE_MEMBERS]
+
+    best, best_score = candidates[0], -1.0
+    for candidate in candidates:
+        score = sum(
+            weights[other] * sequence_similarity(sequences[candidate], sequences[other])
+            for other in references
+        )
+        if score > best_score:
+            best, best_score = candidate, score
+    return best
+
+
+def cluster_sequences(sequences: List[np.ndarray], weights: Sequence[int],
+                      similarity_threshold: float = 0.8) -> Tuple[np.ndarray, Dict[int, int]]:
+    """
+    Кластеризация последовательностей детекторов по сходству
+
+    Args:
+        sequences: Уникальные последовательности порядковых номеров детекторов
+        weights: Вес каждой последовательности (количество ТС)
+        similarity_threshold: Минимальное сходство LCS / max(длина) для объединения
+
+    Returns:
+        (метка кластера для каждой последовательности, {метка: индекс медоиды})
+    """
+    count = len(sequences)
+    if count == 0:
+        return np.empty(0, dtype=np.int64), {}
+
+    token_lists = [seq.tolist() for seq in sequences]
+    parent = list(range(count))
+
+    for first, second in _lsh_candidate_pairs(minhash_signatures(sequences)):
+        shorter, longer = sorted((len(token_lists[first]), len(token_lists[second])))
+        # LCS не длиннее более короткой последовательности
+        if longer == 0 or shorter / longer < similarity_threshold:
+            continue
+        if _find(parent, first) == _find(parent, second):
+            continue
+        if sequence_similarity(token_lists[first], token_lists[second]) >= similarity_threshold:
+            root_first, root_second = _find(parent, first), _find(parent, second)
+            parent[max(root_first, root_second)] = min(root_first, root_second)
+
+    roots = np.array([_find(parent, idx) for idx in range(count)], dtype=np.int64)
+    _, labels = np.unique(roots, return_inverse=True)
+
+    members = defaultdict(list)
+    for idx, label in enumerate(labels.tolist()):
+        members[label].append(idx)
+
+    medoids = {
+        label: _medoid(cluster_members, token_lists, weights)
+        for label, cluster_members in members.items()
+    }
+    return labels, medoids
@@ -0,0 +1,271 @@
+"""
+Материализованная почасовая статистика маршрутов
+
+Таблица route_stats хранит по каждому маршруту (последовательности
+детекторов поездки) и часу начала поездки количество прохождений, суммы
+скоростей и времени прохождения. Кластеризация за произвольный период
+сводится к суммированию часовых корзин вместо разбора сырых чтений.
+
+Статистика обновляется инкрементально: импорт чтений ставит период в
+очередь route_stats_refreshes, фоновый поток процесса разбирает ее
+(run_route_stats_refreshes) шагами по REFRESH_STEP: пересегментируются
+сеансы ТС с новыми чтениями (см. TripSegmentationService.segment) и
+пересчитываются часы, в которых поездки могли измениться. Прерванные
+перезапуском обновления возвращаются в очередь при старте приложения.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, delete, update, and_, func
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
+import uuid
+from app import models
+from app.database import SessionLocal
+from app.services.trip_service import TripSegmentationService
+from app.services.track_storage import get_track_storage
+from app.services.tracks import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки при потоковом чтении поездок
+TRIPS_YIELD_PER = 10000
+
+# Сколько строк статистики накапливается перед пакетной вставкой
+STATS_INSERT_BATCH_SIZE = 5000
+
+# Шаг фонового обновления после импорта (каждый шаг - отдельная транзакция)
+REFRESH_STEP = timedelta(hours=6)
+
+
+def hour_floor(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def hour_ceil(value: datetime) -> datetime:
+    floor = hour_floor(value)
+    return floor if floor == value else floor + timedelta(hours=1)
+
+
+def signature_hash(detector_sequence: str) -> str:
+    return hashlib.sha1(detector_sequence.encode("utf-8")).hexdigest()
+
+
+class RouteStatsService:
+    """Сервис почасовой статистики маршрутов"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def refresh(self, start_time: datetime, end_time: datetime) -> Dict:
+        """
+        Пересчет статистики часов [start_time, end_time) по сохраненным поездкам
+
+        Границы окна выравниваются по часам; корзины этих часов удаляются
+        и строятся заново из таблицы trips.
+        """
+        start_hour, end_hour = hour_floor(start_time), hour_ceil(end_time)
+
+        self.db.execute(delete(models.RouteStat).where(
+            and_(models.RouteStat.hour_bucket >= start_hour, models.RouteStat.hour_bucket < end_hour)
+        ))
+
+        statement = select(
+            models.Trip.detector_sequence,
+            models.Trip.start_time,
+            models.Trip.end_time,
+            models.Trip.average_speed_kmh,
+            models.Trip.speed_readings_count
+        ).where(
+            and_(models.Trip.start_time >= start_hour, models.Trip.start_time < end_hour)
+        ).execution_options(yield_per=TRIPS_YIELD_PER)
+
+        # (маршрут, час) -> [прохождения, сумма скоростей, число скоростей, сумма времени]
+        buckets: Dict[Tuple[str, datetime], List] = {}
+        for sequence, trip_start, trip_end, average_speed, speed_count in self.db.execute(statement):
+            bucket = buckets.get((sequence, hour_floor(trip_start)))
+            if bucket is None:
+                bucket = buckets[(sequence, hour_floor(trip_start))] = [0, 0.0, 0, 0.0]
+            speed_count = speed_count or 0
+            bucket[0] += 1
+            bucket[1] += (average_speed or 0.0) * speed_count
+            bucket[2] += speed_count
+            bucket[3] += (trip_end - trip_start).total_seconds()
+
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "signature_hash": signature_hash(sequence),
+                "detector_sequence": sequence,
+                "hour_bucket": hour,
+                "vehicles_count": count,
+                "speed_sum": speed_sum,
+                "speed_count": speed_count,
+                "passage_time_sum": passage_time_sum
+            }
+            for (sequence, hour), (count, speed_sum, speed_count, passage_time_sum) in buckets.items()
+        ]
+        for start in range(0, len(rows), STATS_INSERT_BATCH_SIZE):
+            self.db.execute(insert(models.RouteStat), rows[start:start + STATS_INSERT_BATCH_SIZE])
+
+        self.db.commit()
+
+        return {
+            "start_hour": start_hour,
+            "end_hour": end_hour,
+            "routes_count": len({sequence for sequence, _ in buckets}),
+            "buckets_count": len(rows)
+        }
+
+    def refresh_for_readings(self, first_timestamp: datetime, last_timestamp: datetime) -> Dict:
+        """
+        Инкрементальное обновление после добавления чтений за период
+
+        Сеансы ТС с чтениями периода пересегментируются целиком (окно
+        расширяется до поездок, которые его пересекают, с запасом на
+        стоянку), затем пересчитываются все часы, в которых начинались
+        удаленные или созданные поездки.
+        """
+        segmentation = TripSegmentationService(self.db).segment(first_timestamp, last_timestamp)
+        return self.refresh(
+            min(segmentation["window_start"], first_timestamp, key=to_epoch_ms),
+            max(segmentation["window_end"], last_timestamp, key=to_epoch_ms) + timedelta(microseconds=1)
+        )
+
+    def rebuild(self, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                step: timedelta = timedelta(days=1)) -> Iterator[Dict]:
+        """
+        Полное перестроение поездок и статистики (заполнение по истории)
+
+        Период (по умолчанию - весь диапазон чтений) обрабатывается шагами
+        по step, результат каждого шага отдается по мере готовности. Границы
+        шагов не разрезают поездки: сеанс, пересекающий границу, на следующем
+        шаге пересегментируется целиком, а его часы пересчитываются.
+        """
+        if start_time is None or end_time is None:
+            readings = get_track_storage()
+            first, last = self.db.execute(select(
+                func.min(readings.timestamp),
+                func.max(readings.timestamp)
+            )).one()
+            if first is None:
+                return
+            start_time = start_time or first
+            end_time = end_time or last
+
+        current = hour_floor(start_time)
+        while current <= end_time:
+            step_end = min(current + step, hour_floor(end_time) + timedelta(hours=1))
+            yield self.refresh_for_readings(current, step_end - timedelta(microseconds=1))
+            current = step_end
+
+    def enqueue_refresh(self, first_timestamp: datetime, last_timestamp: datetime) -> models.RouteStatsRefresh:
+        """Постановка периода импортированных чтений в очередь фонового обновления"""
+        refresh = models.RouteStatsRefresh(
+            start_time=first_timestamp,
+            end_time=last_timestamp,
+            status="pending"
+        )
+        self.db.add(refresh)
+        self.db.commit()
+        return refresh
+
+    def run_pending_refreshes(self) -> int:
+        """
+        Выполнение обновлений из очереди, пока она не опустеет
+
+        Обновление забирается из очереди (pending -> running) отдельной
+        транзакцией; в PostgreSQL строка блокируется с SKIP LOCKED, поэтому
+        несколько процессов не возьмут одно обновление. Период обрабатывается
+        шагами REFRESH_STEP, каждый шаг фиксируется отдельно.
+
+        Returns:
+            Количество выполненных обновлений
+        """
+        completed = 0
+        while True:
+            refresh = self.db.execute(
+                select(models.RouteStatsRefresh)
+                .where(models.RouteStatsRefresh.status == "pending")
+                .order_by(models.RouteStatsRefresh.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar_one_or_none()
+            if refresh is None:
+                self.db.commit()
+                return completed
+
+            refresh.status = "running"
+            refresh.started_at = datetime.now(timezone.utc)
+            self.db.commit()
+
+            try:
+                for _ in self.rebuild(refresh.start_time, refresh.end_time, REFRESH_STEP):
+                    pass
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Route stats refresh {refresh.id} failed: {e}")
+                refresh.status = "failed"
+                refresh.error = str(e)
+            else:
+                refresh.status = "completed"
+                completed += 1
+            refresh.finished_at = datetime.now(timezone.utc)
+            self.db.commit()
+
+    def requeue_interrupted_refreshes(self) -> int:
+        """Возврат в очередь обновлений, прерванных перезапуском (вызывается при старте)"""
+        result = self.db.execute(
+            update(models.RouteStatsRefresh)
+            .where(models.RouteStatsRefresh.status == "running")
+            .values(status="pending", started_at=None)
+        )
+        self.db.commit()
+        return result.rowcount
+
+    def iter_routes(self, start_time: datetime, end_time: datetime) -> Iterator[Tuple]:
+        """
+        Суммы по маршрутам за часовые корзины, пересекающие [start_time, end_time]
+
+        Returns:
+            (detector_sequence, прохождения, сумма скоростей, число скоростей, сумма времени)
+        """
+        statement = select(
+            models.RouteStat.detector_sequence,
+            func.sum(models.RouteStat.vehicles_count),
+            func.sum(models.RouteStat.speed_sum),
+            func.sum(models.RouteStat.speed_count),
+            func.sum(models.RouteStat.passage_time_sum)
+        ).where(
+            and_(
+                models.RouteStat.hour_bucket >= hour_floor(start_time),
+                models.RouteStat.hour_bucket <= end_time
+            )
+        ).group_by(
+            models.RouteStat.signature_hash,
+            models.RouteStat.detector_sequence
+        ).execution_options(yield_per=TRIPS_YIELD_PER)
+
+        return self.db.execute(statement)
+
+
+def run_route_stats_refreshes():
+    """Точка входа фонового потока - разбирает очередь в собственной сессии БД"""
+    db = SessionLocal()
+    try:
+        RouteStatsService(db).run_pending_refreshes()
+    except Exception as e:
+        logger.error(f"Route stats refresh queue failed: {e}")
+    finally:
+        db.close()
+
+
+# Один поток на процесс: обновления выполняются по очереди
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-stats-refresh")
+
+
+def schedule_route_stats_refresh() -> Future:
+    """Запуск разбора очереди в фоновом потоке (не блокирует импорт)"""
+    return _refresh_executor.submit(run_route_stats_refreshes)
@@ -0,0 +1,259 @@
+"""
+Схема хранения прохождений ТС
+
+TRACK_STORAGE_MODE выбирает таблицу чтений:
+
+- standard - vehicle_track_readings (UUID детектора, строковый ID ТС);
+- compact - vehicle_track_readings_compact (BIGINT identity, целочисленные
+  коды детектора и ТС из detector_codes / vehicles_dict, скорость REAL).
+
+Сервисы анализа строят запросы через TrackStorage и получают строки
+одинаковой формы (vehicle_identifier, detector_id, timestamp, speed)
+в обоих режимах; импорт пишет чтения через insert_readings или, при
+массовой загрузке, через COPY в колонки copy_columns (copy_frame).
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, Iterable, List, Optional
+import os
+import threading
+import numpy as np
+import pandas as pd
+from app import models
+from app.config import settings
+
+# Размер пачки значений в IN (...) при поиске кодов
+CODES_LOOKUP_BATCH_SIZE = 1000
+
+
+class TrackStorage:
+    """Колонки и запись чтений для выбранного режима хранения"""
+
+    def __init__(self, mode: str = "standard"):
+        if mode not in ("standard", "compact"):
+            raise ValueError(f"Unsupported track storage mode: {mode}")
+
+        self.mode = mode
+        self.compact = mode == "compact"
+
+        if self.compact:
+            self.model = models.CompactTrackReading
+            self.vehicle_identifier = models.VehicleDict.vehicle_identifier
+            self.detector_id = models.DetectorCode.detector_id
+        else:
+            self.model = models.VehicleTrackReading
+            self.vehicle_identifier = models.VehicleTrackReading.vehicle_identifier
+            self.detector_id = models.VehicleTrackReading.detector_id
+
+        self.timestamp = self.model.timestamp
+        self.speed = self.model.speed
+
+    @property
+    def table_name(self) -> str:
+        return self.model.__tablename__
+
+    def select(self, *columns):
+        """SELECT по таблице чтений (в компактном режиме - с расшифровкой кодов)"""
+        statement = select(*columns).select_from(self.model)
+        if self.compact:
+            statement = statement.join(
+                models.VehicleDict, models.VehicleDict.id == models.CompactTrackReading.vehicle_code
+            ).join(
+                models.DetectorCode, models.DetectorCode.code == models.CompactTrackReading.detector_code
+            )
+        return statement
+
+    def readings_select(self):
+        """Строки (vehicle_identifier, detector_id, timestamp, speed)"""
+        return self.select(self.vehicle_identifier, self.detector_id, self.timestamp, self.speed)
+
+    def detector_condition(self, detector_id, detector_code: Optional[int] = None):
+        """
+        Условие "чтение этого детектора"
+
+        В компактном режиме при известном коде фильтр накладывается прямо на
+        колонку таблицы чтений, чтобы использовался индекс (detector_code, timestamp).
+        """
+        if self.compact and detector_code is not None:
+            return models.CompactTrackReading.detector_code == detector_code
+        return self.detector_id == detector_id
+
+    def insert_readings(self, db: Session, readings: List[Dict]) -> int:
+        """
+        Пакетная вставка чтений; чтения с уже сохраненным естественным ключом
+        (или повторенные в пачке) пропускаются
+
+        Args:
+            readings: Словари с ключами detector_id (UUID), timestamp,
+                vehicle_identifier, speed
+
+        Returns:
+            Число добавленных чтений
+        """
+        if not readings:
+            return 0
+
+        if not self.compact:
+            return self._insert_new(db, models.VehicleTrackReading, readings)
+
+        vehicle_codes = self._get_or_create_codes(
+            db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id,
+            {reading["vehicle_identifier"] for reading in readings}
+        )
+        detector_codes = self._get_or_create_codes(
+            db, models.DetectorCode, models.DetectorCode.detector_id, models.DetectorCode.code,
+            {reading["detector_id"] for reading in readings}
+        )
+
+        return self._insert_new(db, models.CompactTrackReading, [
+            {
+                "timestamp": reading["timestamp"],
+                "detector_code": detector_codes[reading["detector_id"]],
+                "vehicle_code": vehicle_codes[reading["vehicle_identifier"]],
+                "speed": reading.get("speed")
+            }
+            for reading in readings
+        ])
+
+    def _insert_new(self, db: Session, model, rows: List[Dict]) -> int:
+        """INSERT ... ON CONFLICT (естественный ключ) DO NOTHING; число добавленных строк по RETURNING"""
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            statement = pg_insert(model)
+        elif dialect == "sqlite":
+            statement = sqlite_insert(model)
+        else:
+            raise ValueError(f"Unsupported database for track readings: {dialect}")
+
+        statement = statement.on_conflict_do_nothing(index_elements=self.natural_key_columns)
+        return len(db.execute(statement.returning(model.id), rows).all())
+
+    @property
+    def natural_key_columns(self) -> List[str]:
+        """Колонки уникального ключа чтения (детектор, ТС, метка времени) - для импорта с upsert"""
+        if self.compact:
+            return ["detector_code", "vehicle_code", "timestamp"]
+        return ["detector_id", "vehicle_identifier", "timestamp"]
+
+    @property
+    def copy_columns(self) -> List[str]:
+        """Колонки таблицы чтений, заполняемые при загрузке через COPY"""
+        if self.compact:
+            return ["timestamp", "detector_code", "vehicle_code", "speed"]
+        return ["id", "detector_id", "timestamp", "vehicle_identifier", "speed"]
+
+    def copy_frame(self, db: Session, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Пачка чтений в раскладке таблицы (колонки copy_columns)
+
+        Args:
+            frame: Колонки detector_id (UUID), timestamp, vehicle_identifier, speed
+        """
+        detector_positions, detector_ids = pd.factorize(frame["detector_id"])
+        vehicle_positions, vehicle_identifiers = pd.factorize(frame["vehicle_identifier"])
+
+        if not self.compact:
+            return pd.DataFrame({
+                "id": _random_uuids(len(frame)),
+                "detector_id": np.array([str(value) for value in detector_ids], dtype=object)[detector_positions],
+                "timestamp": _timestamp_literals(frame["timestamp"]),
+                "vehicle_identifier": frame["vehicle_identifier"].to_numpy(),
+                "speed": frame["speed"].round(2).to_numpy()  # NUMERIC(10, 2)
+            }, columns=self.copy_columns)
+
+        # Коды словарей получаем один раз на уникальное значение пачки
+        detector_codes = self._get_or_create_codes(
+            db, models.DetectorCode, models.DetectorCode.detector_id, models.DetectorCode.code, detector_ids
+        )
+        vehicle_codes = self._get_or_create_codes(
+            db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, vehicle_identifiers
+        )
+        return pd.DataFrame({
+            "timestamp": _timestamp_literals(frame["timestamp"]),
+            "detector_code": np.array([detector_codes[value] for value in detector_ids])[detector_positions],
+            "vehicle_code": np.array([vehicle_codes[value] for value in vehicle_identifiers])[vehicle_positions],
+            "speed": frame["speed"].to_numpy()
+        }, columns=self.copy_columns)
+
+    def _get_or_create_codes(self, db: Session, model, key_column, code_column,
+                             keys: Iterable) -> Dict:
+        """
+        Коды для значений словаря; недостающие значения добавляются
+
+        В PostgreSQL недостающие значения вставляются через INSERT ... ON
+        CONFLICT DO NOTHING RETURNING: значения, добавленные параллельным
+        импортом, не роняют вставку и находятся повторным поиском.
+        """
+        keys = list(keys)
+        codes = self._lookup_codes(db, key_column, code_column, keys)
+
+        missing = [key for key in keys if key not in codes]
+        if not missing:
+            return codes
+
+        rows = [{key_column.key: key} for key in missing]
+        if db.get_bind().dialect.name == "postgresql":
+            for offset in range(0, len(rows), CODES_LOOKUP_BATCH_SIZE):
+                statement = pg_insert(model).values(rows[offset:offset + CODES_LOOKUP_BATCH_SIZE])
+                codes.update(db.execute(
+                    statement.on_conflict_do_nothing(index_elements=[key_column.key])
+                    .returning(key_column, code_column)
+                ).tuples().all())
+
+            conflicting = [key for key in missing if key not in codes]
+            if conflicting:
+                codes.update(self._lookup_codes(db, key_column, code_column, conflicting))
+        else:
+            db.execute(insert(model), rows)
+            codes.update(self._lookup_codes(db, key_column, code_column, missing))
+
+        return codes
+
+    def _lookup_codes(self, db: Session, key_column, code_column, keys: List) -> Dict:
+        codes = {}
+        for offset in range(0, len(keys), CODES_LOOKUP_BATCH_SIZE):
+            codes.update(db.execute(
+                select(key_column, code_column).where(
+                    key_column.in_(keys[offset:offset + CODES_LOOKUP_BATCH_SIZE])
+                )
+            ).tuples().all())
+        return codes
+
+
+def _random_uuids(count: int) -> np.ndarray:
+    """count случайных UUID версии 4 в виде 32 шестнадцатеричных символов"""
+    raw = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40  # Версия 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80  # Вариант RFC 4122
+    return np.frombuffer(raw.tobytes().hex().encode("ascii"), dtype="S32").astype(str)
+
+
+def _timestamp_literals(timestamps: pd.Series) -> np.ndarray:
+    """
+    Временные метки в виде ISO-строк для COPY
+
+    Метки с часовым поясом записываются в UTC с суффиксом Z, метки без
+    пояса - как есть (их, как и при INSERT, трактует часовой пояс сессии).
+    """
+    if getattr(timestamps.dt, "tz", None) is not None:
+        return np.datetime_as_string(
+            timestamps.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(), unit="us", timezone="UTC"
+        )
+    return np.datetime_as_string(timestamps.to_numpy(), unit="us")
+
+
+_storage_lock = threading.Lock()
+_storage: Optional[TrackStorage] = None
+
+
+def get_track_storage() -> TrackStorage:
+    """Схема хранения чтений из настроек (TRACK_STORAGE_MODE)"""
+    global _storage
+
+    with _storage_lock:
+        if _storage is None:
+            _storage = TrackStorage(settings.TRACK_STORAGE_MODE)
+        return _storage
@@ -0,0 +1,440 @@
+"""
+Компактное колоночное представление треков ТС
+
+Вместо словаря на каждое прохождение детектора трек хранится как
+параллельные массивы NumPy: порядковый номер детектора (int32), время
+в миллисекундах эпохи (int64) и скорость (float32, NaN - нет данных).
+Преобразование в JSON-совместимые словари выполняется только на границе
+ответа API (Track.to_readings). Смещение от UTC каждого чтения, с которым
+его вернула сессия БД, сохраняется, чтобы время в ответах API выводилось
+так же, как до перехода на массивы.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import numpy as np
+from app import models
+
+
+# Как часто (в секундах) сверять кэш справочника детекторов с таблицей detectors
+DETECTOR_TABLE_CHECK_SECONDS = 30.0
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_ms(value: datetime) -> int:
+    """Время в миллисекундах эпохи (время без зоны считается UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(round(value.timestamp() * 1000))
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000.0, tz=timezone.utc)
+
+
+def utc_offset_seconds(value: datetime) -> Optional[int]:
+    """Смещение от UTC в секундах (None - время без зоны)"""
+    offset = value.utcoffset()
+    return int(offset.total_seconds()) if offset is not None else None
+
+
+def isoformat_ms(value: int, offset_seconds: Optional[int] = None) -> str:
+    """
+    Время в ISO 8601 в том виде, в каком его вернула сессия БД
+
+    offset_seconds - смещение от UTC исходного значения; None - исходное
+    время было без зоны (to_epoch_ms считает его UTC) и выводится без зоны.
+    """
+    moment = _EPOCH + timedelta(milliseconds=value)
+    if offset_seconds is None:
+        return moment.isoformat()
+    return (moment + timedelta(seconds=offset_seconds)).replace(
+        tzinfo=timezone(timedelta(seconds=offset_seconds))
+    ).isoformat()
+
+
+class DetectorTable:
+    """Справочник детекторов: UUID / внешний ID / координаты / код по порядковому номеру"""
+
+    __slots__ = ("ids", "external_ids", "str_ids", "latitudes", "longitudes", "codes", "fingerprint", "_ordinals")
+
+    def __init__(self, ids: List, external_ids: List[str],
+                 latitudes: np.ndarray, longitudes: np.ndarray,
+                 fingerprint: Tuple = (), codes: Optional[List[Optional[int]]] = None):
+        self.ids = tuple(ids)
+        self.external_ids = tuple(external_ids)
+        self.str_ids = tuple(str(det_id) for det_id in ids)
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        # Коды detector_codes (компактное хранение чтений), None - код не выдан
+        self.codes = tuple(codes) if codes is not None else (None,) * len(self.ids)
+        self.fingerprint = fingerprint
+        self._ordinals = {det_id: idx for idx, det_id in enumerate(self.ids)}
+
+    @classmethod
+    def load(cls, db: Session, fingerprint: Tuple = ()) -> "DetectorTable":
+        detectors = db.query(
+            models.Detector.id,
+            models.Detector.detector_id,
+            models.Detector.latitude,
+            models.Detector.longitude,
+            models.DetectorCode.code
+        ).outerjoin(
+            models.DetectorCode, models.DetectorCode.detector_id == models.Detector.id
+        ).order_by(models.Detector.detector_id).all()
+
+        return cls(
+            [det.id for det in detectors],
+            [det.detector_id for det in detectors],
+            np.array([float(det.latitude) for det in detectors], dtype=np.float64),
+            np.array([float(det.longitude) for det in detectors], dtype=np.float64),
+            fingerprint,
+            [det.code for det in detectors]
+        )
+
+    def extended(self, other: "DetectorTable") -> "DetectorTable":
+        """
+        Справочник с добавленными детекторами other, которых нет в этом
+
+        Порядковые номера имеющихся детекторов сохраняются (новые идут в
+        конец), поэтому уже построенные треки остаются верными.
+        """
+        added = [idx for idx, det_id in enumerate(other.ids) if det_id not in self._ordinals]
+        codes = [
+            other.codes[idx] if idx is not None else code
+            for idx, code in zip(map(other.ordinal, self.ids), self.codes)
+        ]
+        return DetectorTable(
+            self.ids + tuple(other.ids[idx] for idx in added),
+            self.external_ids + tuple(other.external_ids[idx] for idx in added),
+            np.concatenate((self.latitudes, other.latitudes[added])),
+            np.concatenate((self.longitudes, other.longitudes[added])),
+            other.fingerprint,
+            codes + [other.codes[idx] for idx in added]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def ordinal(self, detector_id) -> Optional[int]:
+        return self._ordinals.get(detector_id)
+
+    def reading_info(self, ordinal: int) -> Dict:
+        """Поля детектора для ответа API"""
+        return {
+            "detector_id": self.str_ids[ordinal],
+            "detector_external_id": self.external_ids[ordinal],
+            "latitude": float(self.latitudes[ordinal]),
+            "longitude": float(self.longitudes[ordinal])
+        }
+
+
+class Track:
+    """Трек одного ТС в колоночном виде, отсортированный по времени"""
+
+    __slots__ = ("vehicle_id", "detectors", "timestamps", "speeds", "offsets")
+
+    def __init__(self, vehicle_id: str, detectors: np.ndarray,
+                 timestamps: np.ndarray, speeds: np.ndarray,
+                 offsets: Optional[np.ndarray] = None):
+        self.vehicle_id = vehicle_id
+        self.detectors = detectors
+        self.timestamps = timestamps
+        self.speeds = speeds
+        # Смещения от UTC (int32, секунды), с которыми сессия БД вернула время; None - время без зоны
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def start_ms(self) -> int:
+        return int(self.timestamps[0])
+
+    @property
+    def end_ms(self) -> int:
+        return int(self.timestamps[-1])
+
+    def isoformat(self, idx: int) -> str:
+        """Время прохождения idx для ответа API"""
+        offset = int(self.offsets[idx]) if self.offsets is not None else None
+        return isoformat_ms(int(self.timestamps[idx]), offset)
+
+    def to_readings(self, detectors: DetectorTable) -> List[Dict]:
+        """Преобразование в список словарей (только на границе ответа API)"""
+        readings = []
+        for idx, (ordinal, speed) in enumerate(zip(self.detectors.tolist(), self.speeds.tolist())):
+            reading = detectors.reading_info(ordinal)
+            reading["timestamp"] = self.isoformat(idx)
+            reading["speed"] = round(speed, 2) if speed == speed and speed else None
+            readings.append(reading)
+        return readings
+
+
+def build_tracks(rows: Iterable[Tuple], detectors: DetectorTable,
+                 unknown_detectors: Optional[set] = None,
+                 reload: Optional[Callable[[], DetectorTable]] = None) -> Dict[str, Track]:
+    """
+    Построение треков из строк (vehicle_identifier, detector_id, timestamp, speed)
+
+    Все чтения собираются в общие массивы, сортируются по (ТС, время), а треки
+    отдельных ТС являются срезами этих массивов - без объекта на каждое чтение.
+    При первом детекторе, которого нет в справочнике, справочник один раз
+    перечитывается через reload (если передан). Чтения детекторов, неизвестных
+    и после этого, пропускаются, их ID добавляются в unknown_detectors.
+    """
+    vehicle_codes: Dict[str, int] = {}
+    vehicle_column, detector_column, timestamp_column, speed_column, offset_column = [], [], [], [], []
+
+    for vehicle_identifier, detector_id, timestamp, speed in rows:
+        ordinal = detectors.ordinal(detector_id)
+        if ordinal is None and reload is not None:
+            detectors, reload = reload(), None
+            ordinal = detectors.ordinal(detector_id)
+        if ordinal is None:
+            if unknown_detectors is not None:
+                unknown_detectors.add(detector_id)
+            continue
+        vehicle_column.append(vehicle_codes.setdefault(vehicle_identifier, len(vehicle_codes)))
+        detector_column.append(ordinal)
+        timestamp_column.append(to_epoch_ms(timestamp))
+        speed_column.append(float(speed) if speed is not None else np.nan)
+        offset_column.append(utc_offset_seconds(timestamp))
+
+    if not vehicle_column:
+        return {}
+
+    vehicle_array = np.array(vehicle_column, dtype=np.int32)
+    timestamp_array = np.array(timestamp_column, dtype=np.int64)
+    order = np.lexsort((timestamp_array, vehicle_array))
+
+    vehicle_array = vehicle_array[order]
+    detector_array = np.array(detector_column, dtype=np.int32)[order]
+    timestamp_array = timestamp_array[order]
+    speed_array = np.array(speed_column, dtype=np.float32)[order]
+    offset_array = _offsets_array(offset_column)
+    if offset_array is not None:
+        offset_array = offset_array[order]
+
+    starts = np.flatnonzero(np.r_[True, vehicle_array[1:] != vehicle_array[:-1]])
+    ends = np.r_[starts[1:], len(vehicle_array)]
+    vehicle_names = list(vehicle_codes)
+
+    return {
+        vehicle_names[vehicle_array[start]]: Track(
+            vehicle_names[vehicle_array[start]],
+            detector_array[start:end],
+            timestamp_array[start:end],
+            speed_array[start:end],
+            offset_array[start:end] if offset_array is not None else None
+        )
+        for start, end in zip(starts.tolist(), ends.tolist())
+    }
+
+
+def iter_vehicle_tracks(rows: Iterable[Tuple], detectors: DetectorTable,
+                        unknown_detectors: Optional[set] = None,
+                        reload: Optional[Callable[[], DetectorTable]] = None) -> Iterator[Track]:
+    """
+    Потоковое построение треков из строк, упорядоченных по (ТС, время)
+
+    В памяти держится только трек текущего ТС: как только во входном потоке
+    появляется следующее ТС, готовый трек отдается потребителю. Неизвестные
+    детекторы обрабатываются как в build_tracks.
+    """
+    current_vehicle = None
+    detector_column, timestamp_column, speed_column, offset_column = [], [], [], []
+
+    for vehicle_identifier, detector_id, timestamp, speed in rows:
+        if vehicle_identifier != current_vehicle:
+            if timestamp_column:
+                yield _make_track(current_vehicle, detector_column, timestamp_column, speed_column, offset_column)
+            current_vehicle = vehicle_identifier
+            detector_column, timestamp_column, speed_column, offset_column = [], [], [], []
+
+        ordinal = detectors.ordinal(detector_id)
+        if ordinal is None and reload is not None:
+            detectors, reload = reload(), None
+            ordinal = detectors.ordinal(detector_id)
+        if ordinal is None:
+            if unknown_detectors is not None:
+                unknown_detectors.add(detector_id)
+            continue
+        detector_column.append(ordinal)
+        timestamp_column.append(to_epoch_ms(timestamp))
+        speed_column.append(float(speed) if speed is not None else np.nan)
+        offset_column.append(utc_offset_seconds(timestamp))
+
+    if timestamp_column:
+        yield _make_track(current_vehicle, detector_column, timestamp_column, speed_column, offset_column)
+
+
+def _make_track(vehicle_id: str, detector_column: List[int], timestamp_column: List[int],
+                speed_column: List[float], offset_column: List[Optional[int]]) -> Track:
+    return Track(
+        vehicle_id,
+        np.array(detector_column, dtype=np.int32),
+        np.array(timestamp_column, dtype=np.int64),
+        np.array(speed_column, dtype=np.float32),
+        _offsets_array(offset_column)
+    )
+
+
+def _offsets_array(offset_column: List[Optional[int]]) -> Optional[np.ndarray]:
+    """Смещения от UTC; None, если время без зоны (колонка либо вся с зоной, либо вся без)"""
+    if not offset_column or offset_column[0] is None:
+        return None
+    return np.array(offset_column, dtype=np.int32)
+
+
+# ---- Критерий совместного движения ----
+
+def match_visits(target_detectors: List[int], target_times: List[int],
+                 other_detectors: List[int], other_times: List[int],
+                 max_gap_ms: int) -> List[Tuple[int, int]]:
+    """
+    Совпадения прохождений другого ТС с целевым треком
+
+    Оба трека отсортированы по времени и проходятся одновременно: прохождение
+    другого ТС сопоставляется с ближайшим следующим прохождением того же
+    детектора целевым ТС, если разница во времени не больше max_gap_ms.
+
+    Returns:
+        [(индекс в целевом треке, время прохождения другим ТС)]
+    """
+    matches = []
+    target_idx = 0
+
+    for other_detector, other_time in zip(other_detectors, other_times):
+        # Ищем совпадение с целевым треком
+        while target_idx < len(target_times):
+            # Проверяем совпадение детектора
+            if target_detectors[target_idx] == other_detector:
+                if abs(other_time - target_times[target_idx]) <= max_gap_ms:
+                    matches.append((target_idx, other_time))
+
+                target_idx += 1
+                break
+
+            # Проверяем, не слишком ли далеко мы ушли по времени
+            if other_time > target_times[target_idx] + max_gap_ms:
+                break
+
+            target_idx += 1
+
+        if target_idx >= len(target_times):
+            break
+
+    return matches
+
+
+def is_joint_movement(matches: List[Tuple[int, int]], target_detectors: List[int],
+                      target_times: List[int], min_common_nodes: int,
+                      max_lead_seconds: int) -> bool:
+    """
+    Проверка критериев совместного движения по найденным совпадениям
+
+    Совпадений не меньше min_common_nodes, опережение не больше
+    max_lead_seconds и совпадения идут последовательно.
+    """
+    # Проверяем, достаточно ли совпадений и нет ли значительного опережения
+    if len(matches) < min_common_nodes:
+        return False
+
+    # Проверяем критерий опережения
+    time_leads = [(other_time - target_times[idx]) / 1000.0 for idx, other_time in matches]
+    max_lead = max(time_leads)
+    min_lead = min(time_leads)
+
+    # Если один ТС постоянно опережает другой более чем на max_lead_seconds, это не совместное движение
+    if abs(max_lead) > max_lead_seconds and abs(min_lead) > max_lead_seconds:
+        return False
+
+    # Проверяем, что совпадения идут последовательно (не разрозненно)
+    return consecutive_matches(matches, target_detectors)
+
+
+def consecutive_matches(matches: List[Tuple[int, int]], target_detectors: List[int]) -> bool:
+    """Проверяет, что совпадения идут последовательно в треке"""
+    if len(matches) < 2:
+        return True
+
+    # Создаем словарь позиций детекторов в целевом треке
+    detector_positions = {}
+    for idx, ordinal in enumerate(target_detectors):
+        detector_positions[ordinal] = idx
+
+    # Проверяем, что совпадающие детекторы идут последовательно (или почти последовательно)
+    match_positions = [detector_positions[target_detectors[idx]] for idx, _ in matches]
+    match_positions.sort()
+
+    # Разрешаем небольшие пропуски (не более 2 узлов между совпадениями)
+    for i in range(len(match_positions) - 1):
+        gap = match_positions[i + 1] - match_positions[i]
+        if gap > 3:  # Более 3 узлов пропуска - не считается последовательным
+            return False
+
+    return True
+
+
+# ---- Кэш справочника детекторов на процесс ----
+
+_cache_lock = threading.Lock()
+_cached_detectors: Optional[DetectorTable] = None
+_last_checked_at = 0.0
+
+
+def _detectors_fingerprint(db: Session) -> Tuple:
+    detectors_count, last_created = db.query(
+        func.count(models.Detector.id),
+        func.max(models.Detector.created_at)
+    ).one()
+    codes_count = db.query(func.count(models.DetectorCode.code)).scalar()
+    return (detectors_count, last_created, codes_count)
+
+
+def get_detector_table(db: Session) -> DetectorTable:
+    """
+    Справочник детекторов из кэша процесса
+
+    Отпечаток таблицы detectors сверяется не чаще раза в
+    DETECTOR_TABLE_CHECK_SECONDS, справочник перечитывается только при
+    его изменении.
+    """
+    global _cached_detectors, _last_checked_at
+
+    with _cache_lock:
+        now = time.monotonic()
+        if _cached_detectors is not None and now - _last_checked_at < DETECTOR_TABLE_CHECK_SECONDS:
+            return _cached_detectors
+
+        fingerprint = _detectors_fingerprint(db)
+        if _cached_detectors is None or _cached_detectors.fingerprint != fingerprint:
+            _cached_detectors = DetectorTable.load(db, fingerprint)
+        _last_checked_at = now
+        return _cached_detectors
+
+
+def invalidate_detector_table():
+    """Сброс кэша справочника (вызывается после добавления детекторов)"""
+    global _cached_detectors, _last_checked_at
+
+    with _cache_lock:
+        _cached_detectors = None
+        _last_checked_at = 0.0
+
+
+def reload_detector_table(db: Session, detectors: DetectorTable) -> DetectorTable:
+    """
+    Перечитывание справочника после промаха кэша
+
+    Кэш процесса сбрасывается и загружается заново; результат - detectors,
+    дополненный новыми детекторами, с прежними порядковыми номерами.
+    """
+    invalidate_detector_table()
+    return detectors.extended(get_detector_table(db))
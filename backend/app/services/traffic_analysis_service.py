@@ -6,12 +6,33 @@
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, distinct
-from typing import List, Dict, Optional, Tuple
+from sqlalchemy import and_, or_, func, distinct, insert, select
+from typing import List, Dict, Iterator, Optional, Tuple
 from datetime import datetime, timedelta
 from collections import defaultdict, deque
 import math
+import uuid
+import logging
+import numpy as np
 from app import models
+from app.services.geo import EARTH_RADIUS_METERS, haversine_vectorized, grid_candidate_pairs
+from app.services.road_graph import invalidate_road_graph
+from app.services.route_similarity import cluster_sequences
+from app.services.trip_service import TripSegmentationService, trip_detector_ordinals
+from app.services.route_stats_service import RouteStatsService
+from app.services.track_storage import get_track_storage
+from app.services.tracks import (
+    DetectorTable, Track, build_tracks, iter_vehicle_tracks, get_detector_table, reload_detector_table,
+    to_epoch_ms, from_epoch_ms, match_visits, is_joint_movement
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки условий/идентификаторов в одном запросе при поиске совместного движения
+CANDIDATE_BATCH_SIZE = 500
+
+# Размер пачки при потоковом чтении прохождений из БД
+READINGS_YIELD_PER = 10000
 
 
 class TrafficAnalysisService:
@@ -19,65 +40,75 @@ class TrafficAnalysisService:
     
     def __init__(self, db: Session):
         self.db = db
+        self._detectors: Optional[DetectorTable] = None
+        self.readings = get_track_storage()
     
     def build_road_graph(self, max_distance_meters: float = 1000.0) -> Dict:
         """
         Построение графа дорожной сети из расположений детекторов
         Создает ребра между детекторами, если они находятся близко друг к другу
+
+        Кандидаты в соседи ищутся через сеточный пространственный индекс
+        (ячейка = max_distance_meters), точное расстояние считается векторно
+        по пачкам кандидатов, существующие ребра загружаются одним запросом.
         """
-        detectors = self.db.query(models.Detector).all()
-        
-        # Вычисляем расстояние между всеми парами детекторов
-        edges = []
-        detector_coords = {}
-        
-        for det in detectors:
-            detector_coords[det.id] = (float(det.latitude), float(det.longitude))
-        
-        for i, det1 in enumerate(detectors):
-            for det2 in detectors[i+1:]:
-                lat1, lon1 = detector_coords[det1.id]
-                lat2, lon2 = detector_coords[det2.id]
-                
-                distance = self._haversine_distance(lat1, lon1, lat2, lon2)
-                
-                if distance <= max_distance_meters:
-                    # Проверяем, существует ли уже такое ребро
-                    existing = self.db.query(models.RoadNetworkEdge).filter(
-                        and_(
-                            models.RoadNetworkEdge.from_detector_id == det1.id,
-                            models.RoadNetworkEdge.to_detector_id == det2.id
-                        )
-                    ).first()
-                    
-                    if not existing:
-                        reverse_existing = self.db.query(models.RoadNetworkEdge).filter(
-                            and_(
-                                models.RoadNetworkEdge.from_detector_id == det2.id,
-                                models.RoadNetworkEdge.to_detector_id == det1.id
-                            )
-                        ).first()
-                        
-                        if not reverse_existing:
-                            edge = models.RoadNetworkEdge(
-                                from_detector_id=det1.id,
-                                to_detector_id=det2.id,
-                                distance_meters=distance
-                            )
-                            edges.append(edge)
-        
-        if edges:
-            self.db.add_all(edges)
+        detectors = self.db.query(
+            models.Detector.id,
+            models.Detector.latitude,
+            models.Detector.longitude
+        ).all()
+        
+        if len(detectors) < 2:
+            return {
+                "detectors_count": len(detectors),
+                "edges_created": 0
+            }
+        
+        detector_ids = [det.id for det in detectors]
+        lats = np.array([float(det.latitude) for det in detectors], dtype=np.float64)
+        lons = np.array([float(det.longitude) for det in detectors], dtype=np.float64)
+        
+        # Все существующие ребра (в обоих направлениях) - один запрос вместо двух на пару
+        existing_pairs = set()
+        for from_id, to_id in self.db.query(
+            models.RoadNetworkEdge.from_detector_id,
+            models.RoadNetworkEdge.to_detector_id
+        ).all():
+            existing_pairs.add((from_id, to_id))
+            existing_pairs.add((to_id, from_id))
+        
+        new_edges = []
+        for idx1, idx2 in grid_candidate_pairs(lats, lons, max_distance_meters):
+            distances = haversine_vectorized(lats[idx1], lons[idx1], lats[idx2], lons[idx2])
+            close = distances <= max_distance_meters
+            
+            for i, j, distance in zip(idx1[close], idx2[close], distances[close]):
+                pair = (detector_ids[i], detector_ids[j])
+                if pair in existing_pairs:
+                    continue
+                existing_pairs.add(pair)
+                existing_pairs.add((pair[1], pair[0]))
+                new_edges.append({
+                    "id": uuid.uuid4(),
+                    "from_detector_id": pair[0],
+                    "to_detector_id": pair[1],
+                    "distance_meters": round(float(distance), 2)
+                })
+        
+        if new_edges:
+            # Одна bulk-вставка вместо ORM-объекта на каждое ребро
+            self.db.execute(insert(models.RoadNetworkEdge), new_edges)
             self.db.commit()
+            invalidate_road_graph()
         
         return {
             "detectors_count": len(detectors),
-            "edges_created": len(edges)
+            "edges_created": len(new_edges)
         }
     
     def _haversine_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Вычисление расстояния между двумя точками на Земле (в метрах)"""
-        R = 6371000  # Радиус Земли в метрах
+        R = EARTH_RADIUS_METERS
         
         phi1 = math.radians(lat1)
         phi2 = math.radians(lat2)
@@ -90,35 +121,73 @@ class TrafficAnalysisService:
         
         return R * c
     
+    @property
+    def detectors(self) -> DetectorTable:
+        """Справочник детекторов (кэш процесса, фиксируется на время жизни сервиса)"""
+        if self._detectors is None:
+            self._detectors = get_detector_table(self.db)
+        return self._detectors
+    
+    def _readings_select(self):
+        """Выборка только нужных колонок прохождений - без ORM-объектов и связей"""
+        return self.readings.readings_select()
+    
+    def _reload_detectors(self) -> DetectorTable:
+        """Перечитывание справочника при встрече детектора, которого нет в кэше"""
+        logger.warning("detector missing from cached detector table, reloading")
+        self._detectors = reload_detector_table(self.db, self.detectors)
+        return self._detectors
+    
+    def _build_tracks(self, rows) -> Dict[str, Track]:
+        """Построение треков; при встрече детектора, которого нет в кэше, справочник перечитывается"""
+        unknown_detectors = set()
+        tracks = build_tracks(rows, self.detectors, unknown_detectors, self._reload_detectors)
+        
+        if unknown_detectors:
+            logger.warning(f"{len(unknown_detectors)} unknown detectors, their readings are skipped")
+        
+        return tracks
+    
+    def _iter_tracks(self, rows) -> Iterator[Track]:
+        """Потоковое построение треков из строк, упорядоченных по (ТС, время)"""
+        unknown_detectors = set()
+        yield from iter_vehicle_tracks(rows, self.detectors, unknown_detectors, self._reload_detectors)
+        
+        if unknown_detectors:
+            logger.warning(f"{len(unknown_detectors)} unknown detectors, their readings are skipped")
+    
+    def _stream(self, statement):
+        """Потоковое выполнение запроса пачками по READINGS_YIELD_PER строк"""
+        return self.db.execute(statement.execution_options(yield_per=READINGS_YIELD_PER))
+    
     def get_vehicle_track(self, vehicle_identifier: str, 
                          start_time: Optional[datetime] = None,
                          end_time: Optional[datetime] = None) -> List[Dict]:
         """
         Получение трека транспортного средства (последовательности прохождений детекторов)
         """
-        query = self.db.query(models.VehicleTrackReading).filter(
-            models.VehicleTrackReading.vehicle_identifier == vehicle_identifier
+        track = self.load_vehicle_track(vehicle_identifier, start_time, end_time)
+        
+        return track.to_readings(self.detectors) if track else []
+    
+    def load_vehicle_track(self, vehicle_identifier: str,
+                           start_time: Optional[datetime] = None,
+                           end_time: Optional[datetime] = None) -> Optional[Track]:
+        """Трек ТС в колоночном виде (None, если прохождений нет)"""
+        statement = self._readings_select().where(
+            self.readings.vehicle_identifier == vehicle_identifier
         )
         
         if start_time:
-            query = query.filter(models.VehicleTrackReading.timestamp >= start_time)
+            statement = statement.where(self.readings.timestamp >= start_time)
         if end_time:
-            query = query.filter(models.VehicleTrackReading.timestamp <= end_time)
-        
-        readings = query.order_by(models.VehicleTrackReading.timestamp).all()
-        
-        track = []
-        for reading in readings:
-            track.append({
-                "detector_id": str(reading.detector.id),
-                "detector_external_id": reading.detector.detector_id,
-                "latitude": float(reading.detector.latitude),
-                "longitude": float(reading.detector.longitude),
-                "timestamp": reading.timestamp.isoformat(),
-                "speed": float(reading.speed) if reading.speed else None
-            })
+            statement = statement.where(self.readings.timestamp <= end_time)
+        
+        tracks = self._build_tracks(
+            self._stream(statement.order_by(self.readings.timestamp))
+        )
         
-        return track
+        return tracks.get(vehicle_identifier)
     
     def find_joint_movements(self, target_vehicle_id: str,
                            min_common_nodes: int = 3,
@@ -143,149 +212,151 @@ class TrafficAnalysisService:
             end_time: Конец временного диапазона
         """
         # Получаем трек целевого ТС
-        target_track = self.get_vehicle_track(target_vehicle_id, start_time, end_time)
+        target_track = self.load_vehicle_track(target_vehicle_id, start_time, end_time)
         
-        if len(target_track) < min_common_nodes:
+        if target_track is None or len(target_track) < min_common_nodes:
             return []
         
-        # Получаем все треки других ТС в том же временном диапазоне
+        # Временное окно для треков других ТС
         if start_time and end_time:
-            all_readings = self.db.query(models.VehicleTrackReading).filter(
-                and_(
-                    models.VehicleTrackReading.vehicle_identifier != target_vehicle_id,
-                    models.VehicleTrackReading.timestamp >= start_time,
-                    models.VehicleTrackReading.timestamp <= end_time
-                )
-            ).all()
+            window_start, window_end = start_time, end_time
         else:
             # Используем временной диапазон целевого трека
-            if target_track:
-                min_time = datetime.fromisoformat(target_track[0]["timestamp"].replace('Z', '+00:00'))
-                max_time = datetime.fromisoformat(target_track[-1]["timestamp"].replace('Z', '+00:00'))
-                all_readings = self.db.query(models.VehicleTrackReading).filter(
-                    and_(
-                        models.VehicleTrackReading.vehicle_identifier != target_vehicle_id,
-                        models.VehicleTrackReading.timestamp >= min_time - timedelta(seconds=max_time_gap_seconds),
-                        models.VehicleTrackReading.timestamp <= max_time + timedelta(seconds=max_time_gap_seconds)
-                    )
-            ).all()
-            else:
-                return []
-        
-        # Группируем чтения по идентификаторам ТС
-        vehicle_tracks = defaultdict(list)
-        for reading in all_readings:
-            vehicle_tracks[reading.vehicle_identifier].append({
-                "detector_id": str(reading.detector.id),
-                "detector_external_id": reading.detector.detector_id,
-                "timestamp": reading.timestamp,
-                "speed": float(reading.speed) if reading.speed else None,
-                "latitude": float(reading.detector.latitude),
-                "longitude": float(reading.detector.longitude)
-            })
+            window_start = from_epoch_ms(target_track.start_ms - max_time_gap_seconds * 1000)
+            window_end = from_epoch_ms(target_track.end_ms + max_time_gap_seconds * 1000)
+        
+        # Этап генерации кандидатов: только ТС, замеченные на тех же детекторах
+        # в пределах max_time_gap_seconds, и только те, что могут набрать
+        # min_common_nodes совпадений
+        co_occurrences = self._count_co_occurrences(
+            target_track, max_time_gap_seconds, window_start, window_end
+        )
+        candidates = [
+            vehicle_id for vehicle_id, count in co_occurrences.items()
+            if count >= min_common_nodes
+        ]
+        
+        if not candidates:
+            return []
+        
+        # Полные треки загружаются только для кандидатов
+        all_readings = []
+        for offset in range(0, len(candidates), CANDIDATE_BATCH_SIZE):
+            all_readings.extend(self._stream(self._readings_select().where(
+                and_(
+                    self.readings.vehicle_identifier.in_(
+                        candidates[offset:offset + CANDIDATE_BATCH_SIZE]
+                    ),
+                    self.readings.timestamp >= window_start,
+                    self.readings.timestamp <= window_end
+                )
+            )))
         
-        # Сортируем треки каждого ТС по времени
-        for vehicle_id in vehicle_tracks:
-            vehicle_tracks[vehicle_id].sort(key=lambda x: x["timestamp"])
+        vehicle_tracks = self._build_tracks(all_readings)
+        
+        target_detectors = target_track.detectors.tolist()
+        target_times = target_track.timestamps.tolist()
+        max_gap_ms = max_time_gap_seconds * 1000
         
         joint_movements = []
         
         # Для каждого потенциального ТС проверяем критерии совместного движения
         for vehicle_id, other_track in vehicle_tracks.items():
-            matches = []
-            target_idx = 0
-            
-            for other_reading in other_track:
-                # Ищем совпадение с целевым треком
-                while target_idx < len(target_track):
-                    target_reading = target_track[target_idx]
-                    
-                    # Проверяем совпадение детектора
-                    if target_reading["detector_id"] == other_reading["detector_id"]:
-                        time_diff = abs((other_reading["timestamp"] - 
-                                        datetime.fromisoformat(target_reading["timestamp"].replace('Z', '+00:00'))).total_seconds())
-                        
-                        if time_diff <= max_time_gap_seconds:
-                            matches.append({
-                                "detector_id": target_reading["detector_id"],
-                                "detector_external_id": target_reading["detector_external_id"],
-                                "target_timestamp": target_reading["timestamp"],
-                                "other_timestamp": other_reading["timestamp"].isoformat(),
-                                "time_diff_seconds": time_diff,
-                                "latitude": target_reading["latitude"],
-                                "longitude": target_reading["longitude"]
-                            })
-                        
-                        target_idx += 1
-                        break
-                    
-                    # Проверяем, не слишком ли далеко мы ушли по времени
-                    target_time = datetime.fromisoformat(target_reading["timestamp"].replace('Z', '+00:00'))
-                    if other_reading["timestamp"] > target_time + timedelta(seconds=max_time_gap_seconds):
-                        break
-                    
-                    target_idx += 1
-                
-                if target_idx >= len(target_track):
-                    break
+            matches = match_visits(
+                target_detectors, target_times,
+                other_track.detectors.tolist(), other_track.timestamps.tolist(),
+                max_gap_ms
+            )
             
-            # Проверяем, достаточно ли совпадений и нет ли значительного опережения
-            if len(matches) >= min_common_nodes:
-                # Проверяем критерий опережения
-                time_leads = []
-                for match in matches:
-                    target_time = datetime.fromisoformat(match["target_timestamp"].replace('Z', '+00:00'))
-                    other_time = datetime.fromisoformat(match["other_timestamp"].replace('Z', '+00:00'))
-                    lead = (other_time - target_time).total_seconds()
-                    time_leads.append(lead)
-                
-                max_lead = max(time_leads) if time_leads else 0
-                min_lead = min(time_leads) if time_leads else 0
-                
-                # Если один ТС постоянно опережает другой более чем на max_lead_seconds, это не совместное движение
-                if abs(max_lead) <= max_lead_seconds or abs(min_lead) <= max_lead_seconds:
-                    # Проверяем, что совпадения идут последовательно (не разрозненно)
-                    consecutive_matches = self._check_consecutive_matches(matches, target_track)
-                    
-                    if consecutive_matches:
-                        joint_movements.append({
-                            "vehicle_id": vehicle_id,
-                            "common_nodes_count": len(matches),
-                            "matches": matches,
-                            "start_time": matches[0]["target_timestamp"],
-                            "end_time": matches[-1]["target_timestamp"],
-                            "duration_seconds": (
-                                datetime.fromisoformat(matches[-1]["target_timestamp"].replace('Z', '+00:00')) -
-                                datetime.fromisoformat(matches[0]["target_timestamp"].replace('Z', '+00:00'))
-                            ).total_seconds() if len(matches) > 1 else 0
-                        })
+            if is_joint_movement(matches, target_detectors, target_times,
+                                 min_common_nodes, max_lead_seconds):
+                joint_movements.append(
+                    self._joint_movement_response(vehicle_id, matches, target_track, other_track)
+                )
         
         return joint_movements
     
-    def _check_consecutive_matches(self, matches: List[Dict], target_track: List[Dict]) -> bool:
-        """Проверяет, что совпадения идут последовательно в треке"""
-        if len(matches) < 2:
-            return True
-        
-        # Создаем словарь позиций детекторов в целевом треке
-        detector_positions = {}
-        for idx, reading in enumerate(target_track):
-            detector_positions[reading["detector_id"]] = idx
-        
-        # Проверяем, что совпадающие детекторы идут последовательно (или почти последовательно)
-        match_positions = [detector_positions[m["detector_id"]] for m in matches]
-        match_positions.sort()
-        
-        # Разрешаем небольшие пропуски (не более 2 узлов между совпадениями)
-        for i in range(len(match_positions) - 1):
-            gap = match_positions[i + 1] - match_positions[i]
-            if gap > 3:  # Более 3 узлов пропуска - не считается последовательным
-                return False
-        
-        return True
+    def _joint_movement_response(self, vehicle_id: str, matches: List[Tuple[int, int]],
+                                 target_track: Track, other_track: Track) -> Dict:
+        """Преобразование найденных совпадений в формат ответа API"""
+        match_dicts = []
+        for idx, other_time in matches:
+            target_time = int(target_track.timestamps[idx])
+            # Прохождение другого ТС в тот же момент (для смещения от UTC, с которым его вернула БД)
+            other_idx = int(np.searchsorted(other_track.timestamps, other_time))
+            info = self.detectors.reading_info(int(target_track.detectors[idx]))
+            match_dicts.append({
+                "detector_id": info["detector_id"],
+                "detector_external_id": info["detector_external_id"],
+                "target_timestamp": target_track.isoformat(idx),
+                "other_timestamp": other_track.isoformat(other_idx),
+                "time_diff_seconds": abs(other_time - target_time) / 1000.0,
+                "latitude": info["latitude"],
+                "longitude": info["longitude"]
+            })
+        
+        first_time = int(target_track.timestamps[matches[0][0]])
+        last_time = int(target_track.timestamps[matches[-1][0]])
+        
+        return {
+            "vehicle_id": vehicle_id,
+            "common_nodes_count": len(matches),
+            "matches": match_dicts,
+            "start_time": match_dicts[0]["target_timestamp"],
+            "end_time": match_dicts[-1]["target_timestamp"],
+            "duration_seconds": (last_time - first_time) / 1000.0 if len(matches) > 1 else 0
+        }
+    
+    def _count_co_occurrences(self, target_track: Track, max_time_gap_seconds: int,
+                              window_start: datetime, window_end: datetime) -> Dict[str, int]:
+        """
+        Подсчет совпадений других ТС с прохождениями целевого ТС
+        
+        Для каждого прохождения целевого трека ищутся только чтения того же
+        детектора в интервале ±max_time_gap_seconds (индекс detector_id, timestamp).
+        Возвращает {ТС: количество прохождений целевого трека, рядом с которыми
+        это ТС было замечено} - верхнюю оценку числа совпадающих узлов.
+        """
+        max_gap_ms = max_time_gap_seconds * 1000
+        window_start_ms = to_epoch_ms(window_start)
+        window_end_ms = to_epoch_ms(window_end)
+        
+        # Моменты прохождения целевого ТС по каждому детектору
+        target_visits = defaultdict(list)  # порядковый номер детектора -> [(время, индекс в треке)]
+        for idx, (ordinal, timestamp) in enumerate(zip(target_track.detectors.tolist(),
+                                                       target_track.timestamps.tolist())):
+            target_visits[ordinal].append((timestamp, idx))
+        
+        visit_conditions = [
+            and_(
+                self.readings.detector_condition(self.detectors.ids[ordinal], self.detectors.codes[ordinal]),
+                self.readings.timestamp >= from_epoch_ms(max(timestamp - max_gap_ms, window_start_ms)),
+                self.readings.timestamp <= from_epoch_ms(min(timestamp + max_gap_ms, window_end_ms))
+            )
+            for ordinal, visits in target_visits.items()
+            for timestamp, _ in visits
+        ]
+        
+        matched_visits = defaultdict(set)  # ТС -> индексы совпавших прохождений целевого трека
+        for offset in range(0, len(visit_conditions), CANDIDATE_BATCH_SIZE):
+            rows = self._stream(self._readings_select().where(
+                self.readings.vehicle_identifier != target_track.vehicle_id,
+                or_(*visit_conditions[offset:offset + CANDIDATE_BATCH_SIZE])
+            ))
+            
+            for vehicle_id, detector_id, timestamp, _ in rows:
+                timestamp_ms = to_epoch_ms(timestamp)
+                for target_time, idx in target_visits[self.detectors.ordinal(detector_id)]:
+                    if abs(timestamp_ms - target_time) <= max_gap_ms:
+                        matched_visits[vehicle_id].add(idx)
+        
+        return {vehicle_id: len(visits) for vehicle_id, visits in matched_visits.items()}
     
     def cluster_routes(self, start_time: datetime, end_time: datetime, 
-                      top_n: int = 10, min_vehicles_per_route: int = 2) -> List[Dict]:
+                      top_n: int = 10, min_vehicles_per_route: int = 2,
+                      clustering_mode: str = "exact",
+                      similarity_threshold: float = 0.8,
+                      source: str = "readings") -> List[Dict]:
         """
         Кластеризация маршрутов за заданный период времени
         
@@ -297,97 +368,58 @@ class TrafficAnalysisService:
             end_time: Конец периода анализа
             top_n: Количество топовых маршрутов для возврата
             min_vehicles_per_route: Минимальное количество ТС для формирования маршрута
+            clustering_mode: "exact" - группировка по точной сигнатуре маршрута,
+                "similarity" - объединение похожих маршрутов (MinHash/LSH + LCS)
+            similarity_threshold: Минимальное сходство маршрутов в режиме "similarity"
+            source: "readings" - все чтения ТС за период считаются одним треком,
+                "trips" - поездки, сохраненные сегментацией (таблица trips),
+                "stats" - почасовая статистика маршрутов (таблица route_stats;
+                период округляется до часов, список ТС не возвращается)
         """
-        # Получаем все чтения в указанном периоде
-        readings = self.db.query(models.VehicleTrackReading).filter(
-            and_(
-                models.VehicleTrackReading.timestamp >= start_time,
-                models.VehicleTrackReading.timestamp <= end_time
-            )
-        ).order_by(models.VehicleTrackReading.vehicle_identifier, 
-                  models.VehicleTrackReading.timestamp).all()
-        
-        # Группируем чтения по ТС и строим треки
-        vehicle_tracks = defaultdict(list)
-        for reading in readings:
-            vehicle_tracks[reading.vehicle_identifier].append({
-                "detector_id": str(reading.detector.id),
-                "detector_external_id": reading.detector.detector_id,
-                "timestamp": reading.timestamp,
-                "speed": float(reading.speed) if reading.speed else None,
-                "latitude": float(reading.detector.latitude),
-                "longitude": float(reading.detector.longitude)
-            })
-        
-        # Сортируем каждую траекторию по времени
-        for vehicle_id in vehicle_tracks:
-            vehicle_tracks[vehicle_id].sort(key=lambda x: x["timestamp"])
-        
-        # Преобразуем треки в маршруты (последовательности детекторов)
-        routes = defaultdict(list)  # route_signature -> list of vehicle_ids
-        
-        for vehicle_id, track in vehicle_tracks.items():
-            if len(track) < 2:  # Маршрут должен содержать минимум 2 узла
-                continue
-            
-            # Создаем сигнатуру маршрута (последовательность ID детекторов)
-            route_signature = "->".join([r["detector_external_id"] for r in track])
-            routes[route_signature].append({
-                "vehicle_id": vehicle_id,
-                "track": track,
-                "start_time": track[0]["timestamp"],
-                "end_time": track[-1]["timestamp"]
-            })
+        if source == "trips":
+            routes = self._trip_routes(start_time, end_time)
+        elif source == "stats":
+            routes = self._stats_routes(start_time, end_time)
+        else:
+            routes = self._reading_routes(start_time, end_time)
+        external_ids = self.detectors.external_ids
+
+        if clustering_mode == "similarity":
+            routes = self._merge_similar_routes(routes, similarity_threshold)
         
         # Фильтруем маршруты по минимальному количеству ТС
         filtered_routes = {
-            sig: vehicles for sig, vehicles in routes.items() 
-            if len(vehicles) >= min_vehicles_per_route
+            sig: aggregate for sig, aggregate in routes.items() 
+            if aggregate.passages_count >= min_vehicles_per_route
         }
         
         # Вычисляем статистику для каждого маршрута
         route_stats = []
         time_range_hours = (end_time - start_time).total_seconds() / 3600.0
         
-        for route_signature, vehicles in filtered_routes.items():
+        for route_signature, aggregate in filtered_routes.items():
             # Парсим сигнатуру маршрута для получения последовательности детекторов
             detector_ids = route_signature.split("->")
             
             # Вычисляем статистику
-            total_vehicles = len(vehicles)
+            total_vehicles = aggregate.passages_count
             intensity = total_vehicles / time_range_hours if time_range_hours > 0 else 0
             
             # Средняя скорость (если доступна)
-            speeds = []
-            for vehicle_data in vehicles:
-                for reading in vehicle_data["track"]:
-                    if reading["speed"]:
-                        speeds.append(reading["speed"])
-            
-            avg_speed = sum(speeds) / len(speeds) if speeds else None
+            avg_speed = aggregate.speed_sum / aggregate.speed_count if aggregate.speed_count else None
             
             # Среднее время прохождения маршрута
-            passage_times = []
-            for vehicle_data in vehicles:
-                if vehicle_data["track"]:
-                    start = vehicle_data["start_time"]
-                    end = vehicle_data["end_time"]
-                    passage_time = (end - start).total_seconds()
-                    passage_times.append(passage_time)
-            
-            avg_passage_time = sum(passage_times) / len(passage_times) if passage_times else None
+            avg_passage_time = aggregate.passage_time_sum / total_vehicles if total_vehicles else None
             
-            # Получаем координаты детекторов для визуализации
-            route_coordinates = []
-            for vehicle_data in vehicles:
-                if vehicle_data["track"]:
-                    for reading in vehicle_data["track"]:
-                        route_coordinates.append({
-                            "latitude": reading["latitude"],
-                            "longitude": reading["longitude"],
-                            "detector_id": reading["detector_external_id"]
-                        })
-                    break  # Берем координаты из первого трека
+            # Получаем координаты детекторов для визуализации (из первого трека)
+            route_coordinates = [
+                {
+                    "latitude": float(self.detectors.latitudes[ordinal]),
+                    "longitude": float(self.detectors.longitudes[ordinal]),
+                    "detector_id": external_ids[ordinal]
+                }
+                for ordinal in aggregate.detectors.tolist()
+            ]
             
             route_stats.append({
                 "route_signature": route_signature,
@@ -397,10 +429,148 @@ class TrafficAnalysisService:
                 "average_speed_kmh": round(avg_speed, 2) if avg_speed else None,
                 "average_passage_time_seconds": round(avg_passage_time, 2) if avg_passage_time else None,
                 "coordinates": route_coordinates,
-                "vehicles": [v["vehicle_id"] for v in vehicles]
+                "vehicles": aggregate.vehicles,
+                "variants_count": aggregate.variants_count
             })
         
         # Сортируем по интенсивности и возвращаем топ-N
         route_stats.sort(key=lambda x: x["intensity_per_hour"], reverse=True)
         
         return route_stats[:top_n]
+
+    def _reading_routes(self, start_time: datetime, end_time: datetime) -> Dict[str, "_RouteAggregate"]:
+        """Маршруты по сырым чтениям: трек ТС за весь период - один маршрут"""
+        # Чтения периода читаются серверным курсором в порядке (ТС, время):
+        # трек каждого ТС собирается по мере чтения, а в памяти остаются
+        # только агрегаты по маршрутам
+        readings = self._stream(self._readings_select().where(
+            and_(
+                self.readings.timestamp >= start_time,
+                self.readings.timestamp <= end_time
+            )
+        ).order_by(self.readings.vehicle_identifier,
+                  self.readings.timestamp))
+
+        # Преобразуем треки в маршруты (последовательности детекторов)
+        routes: Dict[str, _RouteAggregate] = {}
+
+        for track in self._iter_tracks(readings):
+            if len(track) < 2:  # Маршрут должен содержать минимум 2 узла
+                continue
+            self._route_aggregate(routes, track.detectors).add(track)
+
+        return routes
+
+    def _trip_routes(self, start_time: datetime, end_time: datetime) -> Dict[str, "_RouteAggregate"]:
+        """Маршруты по сохраненным поездкам (см. TripSegmentationService)"""
+        routes: Dict[str, _RouteAggregate] = {}
+
+        for trip in TripSegmentationService(self.db).iter_trips(start_time, end_time):
+            ordinals = trip_detector_ordinals(trip.detector_sequence, self.detectors)
+            if ordinals is None or len(ordinals) < 2:
+                continue
+            speed_count = trip.speed_readings_count or 0
+            self._route_aggregate(routes, ordinals).add_summary(
+                trip.vehicle_identifier,
+                (trip.average_speed_kmh or 0.0) * speed_count,
+                speed_count,
+                (trip.end_time - trip.start_time).total_seconds()
+            )
+
+        return routes
+
+    def _stats_routes(self, start_time: datetime, end_time: datetime) -> Dict[str, "_RouteAggregate"]:
+        """Маршруты по материализованной почасовой статистике (см. RouteStatsService)"""
+        routes: Dict[str, _RouteAggregate] = {}
+        
+        for sequence, count, speed_sum, speed_count, passage_time_sum in \
+                RouteStatsService(self.db).iter_routes(start_time, end_time):
+            ordinals = trip_detector_ordinals(sequence, self.detectors)
+            if ordinals is None or len(ordinals) < 2:
+                continue
+            self._route_aggregate(routes, ordinals).add_totals(
+                int(count), float(speed_sum or 0.0), int(speed_count or 0), float(passage_time_sum or 0.0)
+            )
+        
+        return routes
+
+    def _route_aggregate(self, routes: Dict[str, "_RouteAggregate"],
+                         detectors: np.ndarray) -> "_RouteAggregate":
+        """Агрегат маршрута по сигнатуре (последовательность ID детекторов)"""
+        external_ids = self.detectors.external_ids
+        route_signature = "->".join([external_ids[ordinal] for ordinal in detectors.tolist()])
+        aggregate = routes.get(route_signature)
+        if aggregate is None:
+            aggregate = routes[route_signature] = _RouteAggregate(detectors)
+        return aggregate
+
+    def _merge_similar_routes(self, routes: Dict[str, "_RouteAggregate"],
+                              similarity_threshold: float) -> Dict[str, "_RouteAggregate"]:
+        """
+        Объединение похожих маршрутов в кластеры
+        
+        Кластеризуются уникальные сигнатуры (а не отдельные треки), кластер
+        получает сигнатуру своей медоиды.
+        """
+        signatures = list(routes)
+        aggregates = [routes[signature] for signature in signatures]
+        labels, medoids = cluster_sequences(
+            [aggregate.detectors for aggregate in aggregates],
+            [aggregate.passages_count for aggregate in aggregates],
+            similarity_threshold
+        )
+        
+        merged: Dict[str, _RouteAggregate] = {}
+        for label, medoid in medoids.items():
+            cluster = merged[signatures[medoid]] = _RouteAggregate(aggregates[medoid].detectors)
+            cluster.variants_count = 0
+        
+        for idx, label in enumerate(labels.tolist()):
+            merged[signatures[medoids[label]]].merge(aggregates[idx])
+        
+        return merged
+
+
+class _RouteAggregate:
+    """Накопленная статистика маршрута - без хранения самих треков"""
+    
+    __slots__ = (
+        "detectors", "vehicles", "passages_count", "speed_sum", "speed_count",
+        "passage_time_sum", "variants_count"
+    )
+    
+    def __init__(self, detectors: np.ndarray):
+        self.detectors = detectors  # Последовательность детекторов первого трека
+        self.vehicles: List[str] = []
+        self.passages_count = 0  # Число прохождений маршрута (ТС или поездок)
+        self.speed_sum = 0.0
+        self.speed_count = 0
+        self.passage_time_sum = 0.0
+        self.variants_count = 1  # Число различных сигнатур, объединенных в маршрут
+    
+    def add(self, track: Track):
+        speeds = track.speeds[~np.isnan(track.speeds) & (track.speeds != 0)]
+        self.add_summary(
+            track.vehicle_id,
+            float(speeds.sum(dtype=np.float64)),
+            len(speeds),
+            (track.end_ms - track.start_ms) / 1000.0
+        )
+
+    def add_summary(self, vehicle_id: str, speed_sum: float, speed_count: int, passage_time: float):
+        """Добавление прохождения маршрута по готовым итогам (например, сохраненной поездки)"""
+        self.vehicles.append(vehicle_id)
+        self.add_totals(1, speed_sum, speed_count, passage_time)
+
+    def add_totals(self, passages_count: int, speed_sum: float, speed_count: int, passage_time_sum: float):
+        """Добавление суммарной статистики нескольких прохождений (без списка ТС)"""
+        self.passages_count += passages_count
+        self.speed_sum += speed_sum
+        self.speed_count += speed_count
+        self.passage_time_sum += passage_time_sum
+    
+    def merge(self, other: "_RouteAggregate"):
+        """Добавление статистики другого варианта маршрута"""
+        self.variants_count += other.variants_count
+        self.vehicles.extend(other.vehicles)
+        self.add_totals(other.passages_count, other.speed_sum, other.speed_count, other.passage_time_sum)
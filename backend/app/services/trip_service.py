@@ -0,0 +1,383 @@
+"""
+Сегментация треков ТС на поездки
+
+Все чтения ТС за окно анализа - это не один маршрут: утренняя и вечерняя
+поездки, стоянки и повторные проезды дают одну длинную уникальную
+сигнатуру. Поток чтений, упорядоченных по (ТС, время), разбивается на
+поездки по трем признакам:
+
+- dwell - перерыв между соседними чтениями больше dwell_gap_seconds;
+- revisit - повторное прохождение детектора, уже пройденного в поездке;
+- speed - физически невозможная скорость между соседними детекторами
+  (длина ребра road_network_edges или расстояние по прямой).
+
+Перерыв dwell - жесткая граница: после него поездка начинается заново
+независимо от предыстории. Поэтому трек ТС делится на сеансы - цепочки
+чтений с перерывами не больше dwell_gap_seconds, - и сегментация окна
+всегда обрабатывает сеансы целиком, даже если они выходят за границы
+окна. Повторная сегментация того же, пересекающегося или соседнего окна
+дает те же поездки, что и сегментация всего периода сразу.
+
+Поездки сохраняются в таблицу trips, откуда их читают кластеризация
+маршрутов и другие виды анализа без повторной сегментации.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, delete, and_, func, bindparam
+from typing import Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta
+import logging
+import uuid
+import numpy as np
+from app import models
+from app.config import settings
+from app.services.geo import haversine_vectorized
+from app.services.road_graph import RoadGraph, get_road_graph
+from app.services.track_storage import get_track_storage
+from app.services.tracks import (
+    DetectorTable, Track, iter_vehicle_tracks, get_detector_table, reload_detector_table, to_epoch_ms, from_epoch_ms
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки при потоковом чтении строк из БД
+READINGS_YIELD_PER = 10000
+
+# Сколько поездок накапливается перед пакетной вставкой
+TRIP_INSERT_BATCH_SIZE = 5000
+
+# Поездка должна содержать минимум 2 прохождения детекторов
+MIN_TRIP_READINGS = 2
+
+# Шаг, которым просматриваются чтения за границами окна при поиске концов сеансов
+SESSION_SCAN_STEP = timedelta(hours=2)
+
+
+class TripSegmenter:
+    """Разбиение колоночного трека ТС на поездки"""
+
+    def __init__(self, detectors: DetectorTable, graph: RoadGraph,
+                 dwell_gap_seconds: float, max_speed_kmh: float):
+        self.detectors = detectors
+        self.graph = graph
+        self.dwell_gap_ms = dwell_gap_seconds * 1000.0
+        self.max_speed_ms = max_speed_kmh / 3.6 / 1000.0  # метров в миллисекунду
+        # Порядковые номера справочника детекторов -> номера узлов графа (-1 - нет в графе)
+        self._graph_ordinals = np.array([
+            -1 if graph.ordinal(det_id) is None else graph.ordinal(det_id)
+            for det_id in detectors.ids
+        ], dtype=np.int64)
+
+    def split(self, track: Track) -> List[Tuple[int, int, str]]:
+        """
+        Границы поездок трека
+
+        Returns:
+            Список (начало, конец, причина завершения) - срезы массивов трека
+        """
+        count = len(track)
+        if count == 0:
+            return []
+
+        reasons = np.full(count, "", dtype=object)  # reasons[i] - причина разрыва перед i-м чтением
+        if count > 1:
+            intervals = np.diff(track.timestamps).astype(np.float64)
+            distances = self._distances(track.detectors[:-1], track.detectors[1:])
+            implausible = (distances > 0) & (distances > intervals * self.max_speed_ms)
+            reasons[1:][implausible] = "speed"
+            reasons[1:][intervals > self.dwell_gap_ms] = "dwell"
+
+        # Повторные прохождения детекторов внутри поездки (повтор подряд - дубль чтения)
+        bounds = []
+        trip_start = 0
+        visited = set()
+        previous = None
+        for idx, ordinal in enumerate(track.detectors.tolist()):
+            reason = reasons[idx]
+            if not reason and ordinal != previous and ordinal in visited:
+                reason = "revisit"
+            if reason:
+                bounds.append((trip_start, idx, reason))
+                trip_start = idx
+                visited = set()
+            visited.add(ordinal)
+            previous = ordinal
+        # Трек - целые сеансы: последняя поездка заканчивается стоянкой (или концом данных)
+        bounds.append((trip_start, count, "dwell"))
+
+        return bounds
+
+    def _distances(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """Длина ребра графа между соседними детекторами, при отсутствии ребра - расстояние по прямой"""
+        distances = haversine_vectorized(
+            self.detectors.latitudes[sources], self.detectors.longitudes[sources],
+            self.detectors.latitudes[targets], self.detectors.longitudes[targets]
+        )
+        graph_sources = self._graph_ordinals[sources]
+        graph_targets = self._graph_ordinals[targets]
+        in_graph = (graph_sources >= 0) & (graph_targets >= 0)
+        if in_graph.any():
+            edge_lengths = self.graph.edge_lengths(graph_sources[in_graph], graph_targets[in_graph])
+            distances[in_graph] = np.where(np.isnan(edge_lengths), distances[in_graph], edge_lengths)
+        return distances
+
+
+class TripSegmentationService:
+    """Сервис сегментации треков на поездки и чтения сохраненных поездок"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def segment(self, start_time: datetime, end_time: datetime,
+                dwell_gap_seconds: Optional[float] = None,
+                max_speed_kmh: Optional[float] = None) -> Dict:
+        """
+        Сегментация всех треков окна и сохранение поездок
+
+        Для каждого ТС с чтениями в окне пересегментируются сеансы, которые
+        пересекают окно, целиком (см. _session_bounds): поездки ТС в этих
+        сеансах удаляются и строятся заново. Повторный запуск для того же,
+        пересекающегося или соседнего окна не дублирует и не обрезает поездки.
+
+        Returns:
+            Счетчики сегментации и window_start / window_end - период, в котором
+            поездки могли измениться (объединение сеансов всех ТС)
+        """
+        dwell_gap_seconds = dwell_gap_seconds if dwell_gap_seconds is not None else settings.TRIP_DWELL_GAP_SECONDS
+        max_speed_kmh = max_speed_kmh if max_speed_kmh is not None else settings.TRIP_MAX_SPEED_KMH
+
+        detectors = get_detector_table(self.db)
+        graph = get_road_graph(self.db)
+        segmenter = TripSegmenter(detectors, graph, dwell_gap_seconds, max_speed_kmh)
+
+        def reload_detectors() -> DetectorTable:
+            # Детектор добавлен после загрузки кэша: справочник перечитывается один раз
+            nonlocal detectors, segmenter
+            logger.warning("detector missing from cached detector table, reloading")
+            detectors = reload_detector_table(self.db, detectors)
+            segmenter = TripSegmenter(detectors, graph, dwell_gap_seconds, max_speed_kmh)
+            return detectors
+
+        readings = get_track_storage()
+        sessions = self._session_bounds(readings, start_time, end_time, timedelta(seconds=dwell_gap_seconds))
+        if not sessions:
+            return self._result(0, 0, 0, {}, dwell_gap_seconds, max_speed_kmh, start_time, end_time)
+
+        window_start = from_epoch_ms(min(first for first, _ in sessions.values()))
+        window_end = from_epoch_ms(max(last for _, last in sessions.values()))
+
+        # Запас в 1 мс: границы сеансов округлены до миллисекунд
+        statement = readings.readings_select().where(
+            and_(
+                readings.timestamp >= window_start - timedelta(milliseconds=1),
+                readings.timestamp <= window_end + timedelta(milliseconds=1)
+            )
+        ).order_by(
+            readings.vehicle_identifier,
+            readings.timestamp
+        ).execution_options(yield_per=READINGS_YIELD_PER)
+
+        # Поездки лежат внутри сеансов: удаляются все поездки, пересекающие сеансы ТС
+        # (executemany на уровне Core - ORM не поддерживает пакетный DELETE с параметрами)
+        trips = models.Trip.__table__
+        self.db.connection().execute(
+            delete(trips).where(
+                and_(
+                    trips.c.vehicle_identifier == bindparam("vehicle"),
+                    trips.c.start_time <= bindparam("last"),
+                    trips.c.end_time >= bindparam("first")
+                )
+            ),
+            [
+                {"vehicle": vehicle, "first": from_epoch_ms(first), "last": from_epoch_ms(last)}
+                for vehicle, (first, last) in sessions.items()
+            ]
+        )
+
+        vehicles_count = 0
+        trips_count = 0
+        skipped_count = 0
+        end_reasons: Dict[str, int] = {}
+        batch: List[Dict] = []
+
+        unknown_detectors = set()
+        for track in iter_vehicle_tracks(self.db.execute(statement), detectors, unknown_detectors, reload_detectors):
+            bounds = sessions.get(track.vehicle_id)
+            if bounds is None:
+                continue
+            track = self._slice(track, *bounds)
+            vehicles_count += 1
+            for start, end, reason in segmenter.split(track):
+                if end - start < MIN_TRIP_READINGS:
+                    skipped_count += 1
+                    continue
+                batch.append(self._trip_row(track, detectors, start, end, reason))
+                end_reasons[reason] = end_reasons.get(reason, 0) + 1
+
+            if len(batch) >= TRIP_INSERT_BATCH_SIZE:
+                self.db.execute(insert(models.Trip), batch)
+                trips_count += len(batch)
+                batch = []
+
+        if batch:
+            self.db.execute(insert(models.Trip), batch)
+            trips_count += len(batch)
+
+        if unknown_detectors:
+            logger.warning(f"{len(unknown_detectors)} unknown detectors, their readings are skipped")
+
+        self.db.commit()
+        logger.info(f"Segmented {vehicles_count} vehicle tracks into {trips_count} trips")
+
+        return self._result(vehicles_count, trips_count, skipped_count, end_reasons,
+                            dwell_gap_seconds, max_speed_kmh, window_start, window_end)
+
+    @staticmethod
+    def _result(vehicles_count: int, trips_count: int, skipped_count: int, end_reasons: Dict[str, int],
+                dwell_gap_seconds: float, max_speed_kmh: float,
+                window_start: datetime, window_end: datetime) -> Dict:
+        return {
+            "vehicles_count": vehicles_count,
+            "trips_count": trips_count,
+            "skipped_short_segments": skipped_count,
+            "end_reasons": end_reasons,
+            "dwell_gap_seconds": dwell_gap_seconds,
+            "max_speed_kmh": max_speed_kmh,
+            "window_start": window_start,
+            "window_end": window_end
+        }
+
+    def _session_bounds(self, readings, start_time: datetime, end_time: datetime,
+                        dwell_gap: timedelta) -> Dict[str, Tuple[int, int]]:
+        """
+        Границы сеансов каждого ТС, пересекающих окно (мс эпохи)
+
+        Начало - первое и последнее чтение ТС в окне; затем за пределами окна
+        шагами SESSION_SCAN_STEP ищутся чтения, отстоящие от текущей границы
+        сеанса не больше чем на dwell_gap. Граница ТС зафиксирована, когда
+        просмотренный участок покрывает dwell_gap за ней.
+
+        Returns:
+            {ТС: (первое чтение сеансов, последнее чтение сеансов)}
+        """
+        statement = readings.select(
+            readings.vehicle_identifier,
+            func.min(readings.timestamp),
+            func.max(readings.timestamp)
+        ).where(
+            and_(readings.timestamp >= start_time, readings.timestamp <= end_time)
+        ).group_by(readings.vehicle_identifier)
+
+        firsts, lasts = {}, {}
+        for vehicle, first, last in self.db.execute(statement):
+            firsts[vehicle] = to_epoch_ms(first)
+            lasts[vehicle] = to_epoch_ms(last)
+
+        gap_ms = int(dwell_gap.total_seconds() * 1000)
+        step_ms = max(gap_ms, int(SESSION_SCAN_STEP.total_seconds() * 1000))
+        self._extend_sessions(readings, firsts, to_epoch_ms(start_time), -step_ms, gap_ms)
+        self._extend_sessions(readings, lasts, to_epoch_ms(end_time), step_ms, gap_ms)
+
+        return {vehicle: (firsts[vehicle], lasts[vehicle]) for vehicle in firsts}
+
+    def _extend_sessions(self, readings, edges: Dict[str, int], scanned_to: int,
+                         step_ms: int, gap_ms: int):
+        """
+        Сдвиг границ сеансов edges за пределы окна (step_ms < 0 - назад во времени)
+
+        scanned_to - граница уже просмотренного участка (граница окна).
+        """
+        direction = 1 if step_ms > 0 else -1
+        # ТС, у которых в пределах dwell_gap за границей сеанса есть непросмотренное время
+        open_vehicles = {
+            vehicle for vehicle, edge in edges.items()
+            if (edge + direction * gap_ms - scanned_to) * direction > 0
+        }
+
+        while open_vehicles:
+            scan_from, scanned_to = scanned_to, scanned_to + step_ms
+            if direction < 0:
+                condition = and_(readings.timestamp >= from_epoch_ms(scanned_to),
+                                 readings.timestamp < from_epoch_ms(scan_from))
+            else:
+                condition = and_(readings.timestamp > from_epoch_ms(scan_from),
+                                 readings.timestamp <= from_epoch_ms(scanned_to))
+            statement = readings.select(
+                readings.vehicle_identifier, readings.timestamp
+            ).where(condition).execution_options(yield_per=READINGS_YIELD_PER)
+
+            found: Dict[str, List[int]] = {}
+            for vehicle, timestamp in self.db.execute(statement):
+                if vehicle in open_vehicles:
+                    found.setdefault(vehicle, []).append(to_epoch_ms(timestamp))
+
+            for vehicle in list(open_vehicles):
+                edge = edges[vehicle]
+                # Чтения по удалению от границы сеанса: цепочка рвется на перерыве больше dwell_gap
+                for timestamp in sorted(found.get(vehicle, ()), reverse=direction < 0):
+                    if (timestamp - edge) * direction > gap_ms:
+                        break
+                    if (timestamp - edge) * direction > 0:
+                        edge = timestamp
+                edges[vehicle] = edge
+                if (edge + direction * gap_ms - scanned_to) * direction <= 0:
+                    open_vehicles.discard(vehicle)
+
+    @staticmethod
+    def _slice(track: Track, first: int, last: int) -> Track:
+        """Часть трека между first и last (мс эпохи) включительно"""
+        start, end = np.searchsorted(track.timestamps, [first, last + 1])
+        if start == 0 and end == len(track):
+            return track
+        return Track(
+            track.vehicle_id,
+            track.detectors[start:end],
+            track.timestamps[start:end],
+            track.speeds[start:end],
+            track.offsets[start:end] if track.offsets is not None else None
+        )
+
+    def _trip_row(self, track: Track, detectors: DetectorTable,
+                  start: int, end: int, reason: str) -> Dict:
+        ordinals = track.detectors[start:end].tolist()
+        speeds = track.speeds[start:end]
+        speeds = speeds[~np.isnan(speeds) & (speeds != 0)]
+
+        return {
+            "id": uuid.uuid4(),
+            "vehicle_identifier": track.vehicle_id,
+            "start_time": from_epoch_ms(int(track.timestamps[start])),
+            "end_time": from_epoch_ms(int(track.timestamps[end - 1])),
+            "start_detector_id": detectors.ids[ordinals[0]],
+            "end_detector_id": detectors.ids[ordinals[-1]],
+            "detector_sequence": ",".join(detectors.str_ids[ordinal] for ordinal in ordinals),
+            "readings_count": end - start,
+            "average_speed_kmh": float(speeds.mean(dtype=np.float64)) if len(speeds) else None,
+            "speed_readings_count": len(speeds),
+            "end_reason": reason
+        }
+
+    def iter_trips(self, start_time: datetime, end_time: datetime,
+                   vehicle_identifier: Optional[str] = None) -> Iterator[models.Trip]:
+        """Потоковое чтение сохраненных поездок, целиком лежащих внутри окна"""
+        statement = select(models.Trip).where(
+            and_(
+                models.Trip.start_time >= start_time,
+                models.Trip.end_time <= end_time
+            )
+        )
+        if vehicle_identifier is not None:
+            statement = statement.where(models.Trip.vehicle_identifier == vehicle_identifier)
+        statement = statement.order_by(
+            models.Trip.vehicle_identifier, models.Trip.start_time
+        ).execution_options(yield_per=READINGS_YIELD_PER)
+
+        return self.db.execute(statement).scalars()
+
+
+def trip_detector_ordinals(detector_sequence: str, detectors: DetectorTable) -> Optional[np.ndarray]:
+    """Порядковые номера детекторов из сохраненной последовательности (None - детектор удален)"""
+    ordinals = [detectors.ordinal(uuid.UUID(det_id)) for det_id in detector_sequence.split(",")]
+    if any(ordinal is None for ordinal in ordinals):
+        return None
+    return np.array(ordinals, dtype=np.int32)
@@ -0,0 +1,179 @@
+"""
+Массовая загрузка чтений детекторов
+
+Чтения приходят уже проверенным DataFrame (колонки detector_id (UUID),
+timestamp, vehicle_identifier, speed) и пишутся пачками по
+TRACK_IMPORT_BATCH_SIZE строк: в PostgreSQL - через COPY ... FROM STDIN
+(CSV), в остальных СУБД - пакетным INSERT через TrackStorage.insert_readings.
+
+Каждая пачка - отдельная транзакция: ошибка пачки откатывает только ее,
+попадает в список ошибок и не останавливает загрузку остальных.
+
+В PostgreSQL пачка копируется во временную таблицу и сливается с таблицей
+чтений через INSERT ... ON CONFLICT по естественному ключу
+(TrackStorage.natural_key_columns). В режиме append чтения с уже
+сохраненным ключом пропускаются (DO NOTHING, в итогах - skipped), в режиме
+upsert (только PostgreSQL) у существующих чтений обновляется скорость, если
+она изменилась. Пакетный INSERT в других СУБД тоже пропускает сохраненные
+ключи.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import Dict, List, Optional, Tuple
+import io
+import logging
+import pandas as pd
+from app.config import settings
+from app.services.track_storage import TrackStorage, get_track_storage
+
+logger = logging.getLogger(__name__)
+
+
+def copy_from_csv(connection, statement: str, payload: str):
+    """COPY ... FROM STDIN с данными CSV через DB-API соединение (psycopg2 или psycopg 3)"""
+    with connection.cursor() as cursor:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(statement, io.StringIO(payload))
+        else:  # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(payload)
+
+
+class TrackReadingBulkLoader:
+    """Загрузка чтений пачками через COPY (PostgreSQL) или пакетный INSERT"""
+
+    def __init__(self, db: Session, storage: Optional[TrackStorage] = None,
+                 batch_size: Optional[int] = None, mode: str = "append"):
+        self.db = db
+        self.storage = storage or get_track_storage()
+        self.batch_size = batch_size or settings.TRACK_IMPORT_BATCH_SIZE
+        self.use_copy = db.get_bind().dialect.name == "postgresql"
+
+        if mode not in ("append", "upsert"):
+            raise ValueError(f"Unsupported import mode: {mode}")
+        if mode == "upsert" and not self.use_copy:
+            raise ValueError("Upsert imports require PostgreSQL")
+        self.upsert = mode == "upsert"
+
+    def load(self, frame: pd.DataFrame) -> Dict:
+        """
+        Запись чтений пачками
+
+        Индекс frame - номера строк исходного файла, по ним в ошибках
+        указывается диапазон строк неудавшейся пачки.
+
+        Returns:
+            loaded (добавлено и обновлено), failed, errors (по одной ошибке
+            на пачку) и inserted / updated / skipped (без изменений)
+        """
+        loaded = 0
+        failed = 0
+        errors: List[str] = []
+        merged = {"inserted": 0, "updated": 0, "skipped": 0}
+
+        for offset in range(0, len(frame), self.batch_size):
+            batch = frame.iloc[offset:offset + self.batch_size]
+            try:
+                if self.upsert:
+                    inserted, updated = self._upsert_batch(batch)
+                elif self.use_copy:
+                    inserted, updated = self._append_batch(batch), 0
+                else:
+                    inserted, updated = self._insert_batch(batch), 0
+                self.db.commit()
+                loaded += inserted + updated
+                merged["inserted"] += inserted
+                merged["updated"] += updated
+                merged["skipped"] += len(batch) - inserted - updated
+            except Exception as e:
+                self.db.rollback()
+                failed += len(batch)
+                errors.append(f"Rows {batch.index[0]}-{batch.index[-1]}: {e}")
+                logger.warning(f"Track readings batch {batch.index[0]}-{batch.index[-1]} failed: {e}")
+
+        return {"loaded": loaded, "failed": failed, "errors": errors, **merged}
+
+    def _stage_batch(self, batch: pd.DataFrame) -> str:
+        """
+        COPY пачки во временную таблицу сессии; возвращает ее имя
+
+        Временная таблица очищается при фиксации транзакции, колонки -
+        copy_columns с типами таблицы чтений, без ее ограничений.
+        """
+        storage = self.storage
+        staging = f"{storage.table_name}_staging"
+        columns = ", ".join(storage.copy_columns)
+
+        self.db.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS "
+            f"SELECT 0::bigint AS row_num, {columns} FROM {storage.table_name} WITH NO DATA"
+        ))
+
+        rows = storage.copy_frame(self.db, batch)
+        rows.index = batch.index
+        # COPY идет через DB-API соединение сессии - в ее текущей транзакции
+        copy_from_csv(
+            self.db.connection().connection,
+            f"COPY {staging} (row_num, {columns}) FROM STDIN WITH (FORMAT csv)",
+            rows.to_csv(header=False)
+        )
+        return staging
+
+    def _append_batch(self, batch: pd.DataFrame) -> int:
+        """Добавление пачки без уже сохраненных чтений; возвращает число добавленных"""
+        storage = self.storage
+        staging = self._stage_batch(batch)
+        columns = ", ".join(storage.copy_columns)
+        key = ", ".join(storage.natural_key_columns)
+
+        return self.db.execute(text(
+            f"INSERT INTO {storage.table_name} ({columns}) "
+            f"SELECT {columns} FROM {staging} ORDER BY row_num "
+            f"ON CONFLICT ({key}) DO NOTHING"
+        )).rowcount
+
+    def _upsert_batch(self, batch: pd.DataFrame) -> Tuple[int, int]:
+        """
+        Слияние пачки с таблицей чтений; возвращает (добавлено, обновлено)
+
+        Из чтений с одинаковым ключом берется последнее в файле;
+        существующее чтение обновляется, только если скорость отличается,
+        поэтому повторная загрузка ничего не пишет. Обновление и вставка -
+        два запроса: в секционированной таблице RETURNING не может вернуть
+        xmax, по которому INSERT ... ON CONFLICT DO UPDATE отличил бы
+        добавленные строки от обновленных.
+        """
+        storage = self.storage
+        staging = self._stage_batch(batch)
+        columns = ", ".join(storage.copy_columns)
+        key = ", ".join(storage.natural_key_columns)
+        latest = f"SELECT DISTINCT ON ({key}) {columns} FROM {staging} ORDER BY {key}, row_num DESC"
+        same_key = " AND ".join(f"t.{column} = l.{column}" for column in storage.natural_key_columns)
+
+        updated = self.db.execute(text(f"""
+            UPDATE {storage.table_name} t SET speed = l.speed
+            FROM ({latest}) l
+            WHERE {same_key} AND t.speed IS DISTINCT FROM l.speed
+        """)).rowcount
+        inserted = self.db.execute(text(
+            f"INSERT INTO {storage.table_name} ({columns}) {latest} ON CONFLICT ({key}) DO NOTHING"
+        )).rowcount
+        return inserted, updated
+
+    def _insert_batch(self, batch: pd.DataFrame) -> int:
+        speed = batch["speed"].astype(object)
+        return self.storage.insert_readings(self.db, [
+            {
+                "detector_id": detector_id,
+                "timestamp": timestamp,
+                "vehicle_identifier": vehicle_identifier,
+                "speed": speed_value
+            }
+            for detector_id, timestamp, vehicle_identifier, speed_value in zip(
+                batch["detector_id"],
+                batch["timestamp"].dt.to_pydatetime(),
+                batch["vehicle_identifier"],
+                speed.where(speed.notna(), None)
+            )
+        ])
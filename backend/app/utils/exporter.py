@@ -1,77 +1,444 @@
+"""
+Streaming exports
+
+Query results are read from a server-side cursor (stream_results) in
+batches of EXPORT_FETCH_SIZE rows and written out as they arrive: CSV as
+one encoded chunk per batch, Excel through an openpyxl write-only
+workbook. Exporters return iterators of bytes for StreamingResponse, so
+memory stays bounded whatever the table size.
+
+The cursor runs on its own connection, not the request session: the
+response body is produced after the endpoint (and its session) returned.
+
+With EXPORT_CSV_COPY (PostgreSQL), CSV exports of queries without
+parameters skip Python rows altogether: the query runs as COPY (...) TO
+STDOUT WITH CSV HEADER and the server's bytes are passed through
+(copy_to_csv). The server renders values in its own text format
+(timestamps end in "+00", booleans are t/f), so the option is off by
+default and the Python writer keeps the usual format.
+
+Parquet and Arrow IPC stream exports (pyarrow, optional) are written a
+batch at a time as well: each fetched batch becomes a Parquet row group or
+an Arrow record batch, sent as soon as it is written.
+"""
+
 import pandas as pd
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List, Dict, Any
+from sqlalchemy import select, text, types as sa_types
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from decimal import Decimal
+import datetime as dt
 import io
-from datetime import datetime
-import json
+import itertools
+import queue
+import tempfile
+import threading
+import uuid
+from app import models
+from app.config import settings
+from app.services.track_storage import get_track_storage
+
+# Rows fetched from the server-side cursor per step
+EXPORT_FETCH_SIZE = 10000
+
+# Rows per Parquet row group (and per fetch for Parquet / Arrow exports)
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# Bytes per chunk when a finished file is streamed
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+# Bytes per chunk of COPY output (the driver hands it over row by row)
+COPY_CHUNK_BYTES = 64 * 1024
+
+# COPY output chunks buffered between the database and the response (psycopg2)
+COPY_QUEUE_SIZE = 16
+
+
+def copy_to_csv(connection, statement: str) -> Iterator[bytes]:
+    """
+    Output of COPY ... TO STDOUT through a DB-API connection (psycopg2 or psycopg 3), as it arrives
+
+    psycopg 3 reads COPY data chunk by chunk. psycopg2 can only write it
+    into a file object, so copy_expert runs in a thread that writes into a
+    bounded queue read here; closing the iterator early stops the COPY.
+    """
+    cursor = connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            yield from _copy_in_thread(cursor, statement)
+        else:  # psycopg 3
+            with cursor.copy(statement) as copy:
+                yield from _rechunk(bytes(data) for data in copy)
+    finally:
+        cursor.close()
+
+
+def _rechunk(chunks: Iterable[bytes], size: int = COPY_CHUNK_BYTES) -> Iterator[bytes]:
+    """Row-sized pieces joined into chunks of at least size bytes"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+class _QueueWriter:
+    """File object for copy_expert: puts what is written into a bounded queue, COPY_CHUNK_BYTES at a time"""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Export cancelled")
+
+    def write(self, data) -> int:
+        self.buffer += data.encode("utf-8") if isinstance(data, str) else data
+        if len(self.buffer) >= COPY_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def _copy_in_thread(cursor, statement: str) -> Iterator[bytes]:
+    chunks = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+    cancelled = threading.Event()
+    writer = _QueueWriter(chunks, cancelled)
+    end = object()
+
+    def produce():
+        try:
+            cursor.copy_expert(statement, writer)
+            writer.flush()
+            writer.put(end)
+        except Exception as e:
+            if not cancelled.is_set():
+                writer.put(e)
+
+    thread = threading.Thread(target=produce, name="export-copy", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        thread.join()
+
 
 class DataExporter:
     def __init__(self, db: Session):
         self.db = db
     
-    def export_to_csv(self, query: str, params: Dict[str, Any] = None) -> bytes:
-        """Export query results to CSV"""
-        df = self._execute_query(query, params)
-        return self._dataframe_to_bytes(df, 'csv')
+    def export_to_csv(self, query, params: Dict[str, Any] = None) -> Iterator[bytes]:
+        """
+        Export query results to CSV, one chunk per fetched batch
+
+        With EXPORT_CSV_COPY, in PostgreSQL a query without parameters
+        (COPY takes none) is exported by COPY TO STDOUT instead; a SQLAlchemy
+        select is compiled with its values inlined.
+        """
+        dialect = self.db.get_bind().dialect
+        if settings.EXPORT_CSV_COPY and not params and dialect.name == "postgresql":
+            if not isinstance(query, str):
+                query = str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            chunks = self._copy_chunks(query)
+            # The first chunk (the header at least) is read now: errors surface before a response is started
+            return itertools.chain([next(chunks)], chunks)
+        
+        batches = self._query_batches(query, params)
+        return self._csv_chunks(next(batches), batches)
+    
+    def export_to_excel(self, query, params: Dict[str, Any] = None, sheet_name: str = "Data") -> Iterator[bytes]:
+        """Export query results to Excel (rows are spooled by a write-only workbook)"""
+        batches = self._query_batches(query, params)
+        return self._excel_chunks(next(batches), batches, sheet_name)
+    
+    def export_to_parquet(self, query, params: Dict[str, Any] = None,
+                          compression: Optional[str] = None) -> Iterator[bytes]:
+        """
+        Export query results to Parquet, a row group per PARQUET_ROW_GROUP_SIZE rows (requires pyarrow)
+
+        Args:
+            compression: Column chunk codec, EXPORT_PARQUET_COMPRESSION by default
+        """
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow")
+        
+        compression = compression or settings.EXPORT_PARQUET_COMPRESSION
+        batches = self._query_batches(query, params, PARQUET_ROW_GROUP_SIZE, arrow_types=True)
+        return self._arrow_chunks(
+            *next(batches), batches,
+            lambda sink, schema: pq.ParquetWriter(sink, schema, compression=compression)
+        )
     
-    def export_to_excel(self, query: str, params: Dict[str, Any] = None, sheet_name: str = "Data") -> bytes:
-        """Export query results to Excel"""
-        df = self._execute_query(query, params)
-        return self._dataframe_to_bytes(df, 'excel', sheet_name)
+    def export_to_arrow(self, query, params: Dict[str, Any] = None) -> Iterator[bytes]:
+        """Export query results as an Arrow IPC stream, a record batch per fetch (requires pyarrow)"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Arrow export requires pyarrow")
+        
+        batches = self._query_batches(query, params, PARQUET_ROW_GROUP_SIZE, arrow_types=True)
+        return self._arrow_chunks(*next(batches), batches, pa.ipc.new_stream)
     
-    def export_model_to_csv(self, model_class, filters: Dict[str, Any] = None) -> bytes:
+    def export_model_to_csv(self, model_class, filters: Dict[str, Any] = None) -> Iterator[bytes]:
         """Export entire model to CSV"""
-        query = self.db.query(model_class)
+        query = select(model_class.__table__)
         
         if filters:
             for key, value in filters.items():
                 if hasattr(model_class, key):
-                    query = query.filter(getattr(model_class, key) == value)
-        
-        results = query.all()
+                    query = query.where(getattr(model_class, key) == value)
         
-        # Convert to DataFrame
-        data = []
-        for obj in results:
-            row = {}
-            for column in obj.__table__.columns:
-                value = getattr(obj, column.name)
-                # Convert UUID and datetime to string
-                if hasattr(value, 'hex'):  # UUID
-                    row[column.name] = str(value)
-                elif isinstance(value, datetime):
-                    row[column.name] = value.isoformat()
-                else:
-                    row[column.name] = value
-            data.append(row)
+        return self.export_to_csv(query)
+    
+    def _query_batches(self, query, params: Optional[Dict[str, Any]] = None,
+                       fetch_size: int = EXPORT_FETCH_SIZE, arrow_types: bool = False) -> Iterator:
+        """
+        Column names, then lists of rows from a server-side cursor
         
-        df = pd.DataFrame(data)
-        return self._dataframe_to_bytes(df, 'csv')
+        The caller takes the column names right away: the query runs then,
+        so its errors surface before a response is started. With arrow_types
+        the first item is (column names, their Arrow types - see _arrow_types).
+        """
+        statement = text(query) if isinstance(query, str) else query
+        with self.db.get_bind().connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=fetch_size
+            ).execute(statement, params or {})
+            columns = list(result.keys())
+            yield (columns, _arrow_types(result, statement)) if arrow_types else columns
+            for rows in result.partitions(fetch_size):
+                yield rows
+    
+    def _copy_chunks(self, query: str) -> Iterator[bytes]:
+        """CSV with a header row written by the server, on a connection of its own"""
+        statement = f"COPY ({query.strip().rstrip(';')}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')"
+        connection = self.db.get_bind().raw_connection()
+        finished = False
+        try:
+            yield from copy_to_csv(connection, statement)
+            finished = True
+        finally:
+            if finished:
+                connection.close()
+            else:
+                connection.invalidate()  # A COPY stopped half way leaves the connection unusable
+    
+    @staticmethod
+    def _csv_chunks(columns: List[str], batches) -> Iterator[bytes]:
+        yield pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8')
+        for rows in batches:
+            yield pd.DataFrame.from_records(rows, columns=columns).to_csv(index=False, header=False).encode('utf-8')
     
-    def _execute_query(self, query: str, params: Dict[str, Any] = None) -> pd.DataFrame:
-        """Execute SQL query and return DataFrame"""
-        if params is None:
-            params = {}
+    @staticmethod
+    def _excel_chunks(columns: List[str], batches, sheet_name: str) -> Iterator[bytes]:
+        import openpyxl
         
-        result = self.db.execute(text(query), params)
-        columns = [col for col in result.keys()]
-        data = [dict(zip(columns, row)) for row in result.fetchall()]
+        # Write-only worksheets keep appended rows in a temporary file, not in memory
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = wb.create_sheet(sheet_name)
+        sheet.append(columns)
+        for rows in batches:
+            for row in rows:
+                sheet.append([_excel_value(value) for value in row])
         
-        return pd.DataFrame(data)
+        # An xlsx file is a zip archive: it can only be sent once it is complete
+        with tempfile.TemporaryFile() as file:
+            wb.save(file)
+            file.seek(0)
+            while chunk := file.read(EXPORT_CHUNK_BYTES):
+                yield chunk
     
-    def _dataframe_to_bytes(self, df: pd.DataFrame, format: str, sheet_name: str = "Data") -> bytes:
-        """Convert DataFrame to bytes in specified format"""
-        buffer = io.BytesIO()
+    @staticmethod
+    def _arrow_chunks(columns: List[str], types: List, batches, open_writer: Callable) -> Iterator[bytes]:
+        """
+        Batches written by a pyarrow writer (open_writer(sink, schema)), the bytes of each as it is written
+
+        The schema comes from the query's column types (types, None where
+        unknown); an unknown type is taken from the first batch, a column
+        without values there becomes strings. Every batch is cast to it.
+        """
+        import pyarrow as pa
         
-        if format == 'csv':
-            df.to_csv(buffer, index=False, encoding='utf-8')
-        elif format == 'excel':
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        sink = _ChunkSink()
+        writer = None
+        for rows in batches:
+            table = _arrow_table(rows, columns)
+            if writer is None:
+                schema = pa.schema([
+                    field.with_type(column_type) if column_type is not None
+                    else field.with_type(pa.string()) if pa.types.is_null(field.type)
+                    else field
+                    for field, column_type in zip(table.schema, types)
+                ], metadata=table.schema.metadata)
+                writer = open_writer(sink, schema)
+            writer.write_table(table.cast(schema))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
         
-        buffer.seek(0)
-        return buffer.getvalue()
+        if writer is None:  # No rows: only the schema, unknown types as strings
+            writer = open_writer(sink, pa.schema([
+                (column, column_type or pa.string()) for column, column_type in zip(columns, types)
+            ]))
+        writer.close()
+        yield sink.take()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object for pyarrow writers: keeps written bytes until they are taken"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position  # Parquet offsets count from the start of the file
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_table(rows, columns: List[str]):
+    """
+    Rows as a pyarrow Table
+
+    UUIDs become strings, NUMERIC values floats and timestamps with a time
+    zone UTC timestamps, so that every batch converts to the same types.
+    """
+    import pyarrow as pa
+
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    for column in frame.columns:
+        values = frame[column]
+        present = values.dropna()
+        if values.dtype != object or present.empty:
+            continue
+        first = present.iloc[0]
+        if isinstance(first, uuid.UUID):
+            frame[column] = values.map(str).where(values.notna(), None)
+        elif isinstance(first, Decimal):
+            frame[column] = values.astype(float)
+        elif isinstance(first, dt.datetime) and first.tzinfo is not None:
+            frame[column] = pd.to_datetime(values, utc=True)
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+# PostgreSQL type OIDs (cursor.description type codes) -> Arrow type names
+_PG_ARROW_TYPES = {
+    16: "bool",
+    20: "int64",
+    21: "int16",
+    23: "int32",
+    700: "float32",
+    701: "float64",
+    1700: "float64",  # NUMERIC is exported as floats
+    25: "string",
+    1042: "string",
+    1043: "string",
+    2950: "string",  # UUID is exported as text
+    1082: "date32",
+    1114: "timestamp",
+    1184: "timestamptz",
+}
+
+
+def _arrow_type(name: str):
+    import pyarrow as pa
+
+    if name == "timestamp":
+        return pa.timestamp("us")
+    if name == "timestamptz":
+        return pa.timestamp("us", tz="UTC")  # _arrow_table converts aware timestamps to UTC
+    return getattr(pa, name)()
+
+
+def _sqlalchemy_arrow_type(column_type) -> Optional[str]:
+    """Arrow type name for a SQLAlchemy column type, None if it has no fixed mapping"""
+    if isinstance(column_type, sa_types.Boolean):
+        return "bool"
+    if isinstance(column_type, sa_types.SmallInteger):
+        return "int16"
+    if isinstance(column_type, sa_types.BigInteger):
+        return "int64"
+    if isinstance(column_type, sa_types.Integer):
+        return "int32"
+    if isinstance(column_type, sa_types.Numeric):  # Float included
+        return "float64"
+    if isinstance(column_type, sa_types.DateTime):
+        return "timestamptz" if column_type.timezone else "timestamp"
+    if isinstance(column_type, sa_types.Date):
+        return "date32"
+    if isinstance(column_type, (sa_types.Uuid, sa_types.String)):
+        return "string"
+    return None
+
+
+def _arrow_types(result, statement) -> List:
+    """
+    Arrow types of the query columns, known before any row is read
+
+    In PostgreSQL the type OIDs of the cursor description are used (text
+    queries included); otherwise the column types of a SQLAlchemy select.
+    None - unknown, taken from the data.
+    """
+    columns = len(result.keys())
+    names: List[Optional[str]] = [None] * columns
+
+    description = result.cursor.description if result.cursor is not None else None
+    if description and result.context.dialect.name == "postgresql":
+        names = [_PG_ARROW_TYPES.get(column[1]) for column in description]
+
+    selected = getattr(statement, "selected_columns", None)
+    if selected is not None and len(selected) == columns:
+        names = [
+            name or _sqlalchemy_arrow_type(column.type)
+            for name, column in zip(names, selected)
+        ]
+
+    return [_arrow_type(name) if name else None for name in names]
+
+
+def _excel_value(value):
+    """Cell value Excel can store: timestamps without a time zone (in UTC), UUIDs as text"""
+    if isinstance(value, dt.datetime) and value.tzinfo is not None:
+        return value.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
 
 # Predefined queries for common exports
 class PredefinedExports:
@@ -79,7 +446,7 @@ class PredefinedExports:
         self.exporter = DataExporter(db)
     
 
-    def export_fines(self, format: str = 'csv') -> bytes:
+    def export_fines(self, format: str = 'csv') -> Iterator[bytes]:
         """Export fines data"""
         query = """
         SELECT 
@@ -97,7 +464,7 @@ class PredefinedExports:
         """
         return self._export_query(query, format, "Штрафы")
 
-    def export_accidents(self, format: str = 'csv') -> bytes:
+    def export_accidents(self, format: str = 'csv') -> Iterator[bytes]:
         """Export accident data"""
         query = """
         SELECT 
@@ -114,7 +481,7 @@ class PredefinedExports:
         """
         return self._export_query(query, format, "ДТП")
 
-    def export_traffic_lights(self, format: str = 'csv') -> bytes:
+    def export_traffic_lights(self, format: str = 'csv') -> Iterator[bytes]:
         """Export traffic lights data"""
         query = """
         SELECT 
@@ -130,7 +497,7 @@ class PredefinedExports:
         """
         return self._export_query(query, format, "Светофоры")
 
-    def export_evacuations(self, format: str = 'csv') -> bytes:
+    def export_evacuations(self, format: str = 'csv') -> Iterator[bytes]:
         """Export evacuations data"""
         query = """
         SELECT 
@@ -148,11 +515,38 @@ class PredefinedExports:
         """
         return self._export_query(query, format, "Эвакуации")
     
-    def _export_query(self, query: str, format: str, filename: str) -> bytes:
+    def export_track_readings(self, format: str = 'csv', start_time: Optional[dt.datetime] = None,
+                              end_time: Optional[dt.datetime] = None) -> Iterator[bytes]:
+        """
+        Export detector readings in [start_time, end_time), ordered by time
+
+        Columns are named as the readings importer expects them (detector_id
+        is the detector's source ID), so an export can be imported again.
+        """
+        storage = get_track_storage()
+        query = storage.select(
+            models.Detector.detector_id.label("detector_id"),
+            storage.timestamp.label("timestamp"),
+            storage.vehicle_identifier.label("vehicle_identifier"),
+            storage.speed.label("speed")
+        ).join(models.Detector, models.Detector.id == storage.detector_id)
+        
+        if start_time is not None:
+            query = query.where(storage.timestamp >= start_time)
+        if end_time is not None:
+            query = query.where(storage.timestamp < end_time)
+        
+        return self._export_query(query.order_by(storage.timestamp), format, "Прохождения ТС")
+    
+    def _export_query(self, query, format: str, filename: str) -> Iterator[bytes]:
         """Helper method to export query results"""
         if format == 'csv':
             return self.exporter.export_to_csv(query)
         elif format == 'excel':
             return self.exporter.export_to_excel(query, sheet_name=filename)
+        elif format == 'parquet':
+            return self.exporter.export_to_parquet(query)
+        elif format == 'arrow':
+            return self.exporter.export_to_arrow(query)
         else:
             raise ValueError("Unsupported format")
\ No newline at end of file
@@ -0,0 +1,682 @@
+"""
+Declarative import pipeline
+
+Fines, accidents, traffic lights and evacuations are imported by one
+engine, configured per model with an ImportSpec:
+
+    reader -> header resolver -> column converters -> FK resolvers -> bulk writer
+
+The reader streams the file (Excel sheets in read-only mode, CSV through
+pandas) in chunks of IMPORT_CHUNK_SIZE rows; each chunk is a DataFrame
+indexed by file row number. Values are converted a column at a time,
+foreign keys are resolved for the distinct keys of a chunk with a
+set-based get-or-create, and rows are bulk-inserted. A new entity type
+needs a spec, not another importer loop.
+
+Imports run in one of IMPORT_MODES: "append" inserts every row; "upsert"
+(PostgreSQL, specs with a natural_key) merges rows into the table by the
+natural key, so importing the same file again changes nothing. The natural
+key is not unique in the tables (two fines may share it), it is only
+enforced by upserts.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import itertools
+import logging
+import uuid
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+from app.database import engine
+from app.utils.bulk_loader import copy_from_csv
+from app.utils.parallel_import import map_chunks, parallel_chunks
+
+logger = logging.getLogger(__name__)
+
+# Rows read, converted and written per step
+IMPORT_CHUNK_SIZE = 10000
+
+# Top rows (and columns) of a sheet searched for the header row
+HEADER_SEARCH_ROWS = 9
+
+# Errors returned per import (failed still counts every row)
+MAX_IMPORT_ERRORS = 100
+
+# append: insert every row; upsert: insert new rows, update changed ones by the natural key
+IMPORT_MODES = ("append", "upsert")
+
+# Date formats recognised in files; on a tie in detection the earlier one wins
+DATE_FORMATS = [
+    "ISO8601",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+]
+
+# Day/month order twins: a column is never parsed with both (a date like 01/02 would be ambiguous)
+AMBIGUOUS_DATE_FORMATS = {"%m/%d/%Y": "%d/%m/%Y", "%d/%m/%Y": "%m/%d/%Y"}
+
+# Values of a column used to detect its date format
+FORMAT_SAMPLE_SIZE = 200
+
+
+def _to_str(values: pd.Series) -> pd.Series:
+    return values.astype(str).str.strip()
+
+
+def _to_float(values: pd.Series) -> pd.Series:
+    if not pd.api.types.is_numeric_dtype(values):
+        # "1 234,50" -> "1234.50": spaces (incl. non-breaking) and decimal comma; the
+        # non-breaking space is a literal character - RE2 (Arrow-backed strings) has no \u escape
+        values = values.astype(str).str.replace("[\\s\u00a0]", "", regex=True).str.replace(",", ".", regex=False)
+    return pd.to_numeric(values, errors="coerce").astype(float)
+
+
+def _to_int(values: pd.Series) -> pd.Series:
+    # Fractions are truncated, as int() does
+    return np.trunc(_to_float(values)).astype("Int64")
+
+
+def _parse_dates(values: pd.Series, date_format: str) -> pd.Series:
+    """One pd.to_datetime call; unparsed values are dropped, values with an offset converted to naive UTC"""
+    try:
+        parsed = pd.to_datetime(values, errors="coerce", format=date_format)
+    except ValueError:
+        # Different UTC offsets in one column
+        parsed = pd.to_datetime(values, errors="coerce", format=date_format, utc=True)
+    parsed = parsed.dropna()
+    if getattr(parsed.dt, "tz", None) is not None:
+        parsed = parsed.dt.tz_convert(None)
+    return parsed
+
+
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """Format from DATE_FORMATS parsing most of a sample of the column's text values"""
+    values = values.dropna()
+    # Spread over the column: the first rows are often all from one day
+    sample = values.iloc[::max(1, len(values) // FORMAT_SAMPLE_SIZE)].head(FORMAT_SAMPLE_SIZE)
+    sample = sample[sample.map(lambda value: isinstance(value, str))]
+    if sample.empty:
+        return None
+
+    best_format, best_count = None, 0
+    for date_format in DATE_FORMATS:
+        count = len(_parse_dates(sample, date_format))
+        if count > best_count:
+            best_format, best_count = date_format, count
+            if count == len(sample):
+                break
+    return best_format
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    # The detected format parses the whole column in one call; values in other
+    # formats (and date cells among text) are retried with the remaining formats
+    detected = detect_date_format(values)
+    if detected:
+        excluded = {detected, AMBIGUOUS_DATE_FORMATS.get(detected)}
+        formats = [detected] + [f for f in DATE_FORMATS if f not in excluded]
+    else:
+        formats = DATE_FORMATS
+
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[us]")
+    pending = values.notna()
+    for date_format in formats:
+        if not pending.any():
+            break
+        attempt = _parse_dates(values[pending], date_format)
+        parsed.loc[attempt.index] = attempt
+        pending.loc[attempt.index] = False
+    return parsed
+
+
+def _to_date(values: pd.Series) -> pd.Series:
+    return _to_datetime(values).dt.normalize()
+
+
+# Column kind -> column type in the staging table of parallel imports
+STAGING_TYPES = {
+    "str": "text",
+    "float": "double precision",
+    "int": "bigint",
+    "datetime": "timestamp",
+    "date": "date",
+}
+
+# Column kind -> converter of raw file values; unconvertible values become NA
+CONVERTERS: Dict[str, Callable[[pd.Series], pd.Series]] = {
+    "str": _to_str,
+    "float": _to_float,
+    "int": _to_int,
+    "datetime": _to_datetime,
+    "date": _to_date,
+}
+
+
+class Column:
+    """
+    Field read from the file and how its values are converted
+
+    A missing (empty) value takes the default; without a default it fails
+    the row when the field is required and is stored as NULL otherwise.
+    A value that cannot be converted always fails the row.
+    """
+
+    def __init__(self, field: str, kind: str = "str", required: bool = False, default: Any = None):
+        if kind not in CONVERTERS:
+            raise ValueError(f"Unknown column kind: {kind}")
+        self.field = field
+        self.kind = kind
+        self.required = required
+        self.default = default
+
+
+class ForeignKey:
+    """
+    Foreign key filled by get-or-create of the referenced row by a natural key
+
+    The key is taken from the source field; rows are created with
+    defaults(key) as extra column values.
+    """
+
+    def __init__(self, field: str, model, key_column: str, source: str,
+                 defaults: Optional[Callable[[Any], Dict[str, Any]]] = None):
+        self.field = field
+        self.model = model
+        self.key_column = key_column
+        self.source = source
+        self.defaults = defaults
+
+
+class ImportSpec:
+    """
+    Import configuration of one model
+
+    Args:
+        name: Model type the spec is registered under ("traffic_lights")
+        constants: Values set on every row; a callable is called once per
+            import with the importer (for values looked up in the database)
+        sheet_terms: Sheet name fragments used to pick the sheet
+        sheet_exclude_terms: Sheets skipped when no sheet matches sheet_terms
+        natural_key: Model columns identifying a row in upsert imports (an
+            index of the table, not a unique one); without one only append
+            is supported
+    """
+
+    def __init__(self, name: str, model, columns: Sequence[Column],
+                 foreign_keys: Sequence[ForeignKey] = (), constants: Optional[Dict[str, Any]] = None,
+                 sheet_terms: Sequence[str] = (), sheet_exclude_terms: Sequence[str] = (),
+                 natural_key: Sequence[str] = ()):
+        self.name = name
+        self.label = name.replace("_", " ")  # in messages
+        self.model = model
+        self.columns = list(columns)
+        self.foreign_keys = list(foreign_keys)
+        self.constants = dict(constants or {})
+        self.sheet_terms = list(sheet_terms)
+        self.sheet_exclude_terms = list(sheet_exclude_terms)
+        self.natural_key = list(natural_key)
+
+    @property
+    def fields(self) -> List[str]:
+        return [column.field for column in self.columns]
+
+    @property
+    def model_fields(self) -> List[str]:
+        """Converted fields stored on the model (others only feed foreign keys)"""
+        table_columns = self.model.__table__.columns
+        return [field for field in self.fields if field in table_columns]
+
+
+def pick_sheet(sheet_names: List[str], terms: Sequence[str], exclude_terms: Sequence[str]) -> str:
+    """First sheet matching terms, else the first sheet not matching exclude_terms, else the first"""
+    for sheet in sheet_names:
+        if any(term in sheet.lower() for term in terms):
+            return sheet
+    for sheet in sheet_names:
+        if not any(term in sheet.lower() for term in exclude_terms):
+            return sheet
+    return sheet_names[0]
+
+
+def iter_excel_chunks(source, sheet_name: Optional[str], header_keywords: Sequence[str],
+                      terms: Sequence[str] = (), exclude_terms: Sequence[str] = (),
+                      chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Rows of an Excel sheet as DataFrames named by the header row
+
+    The workbook is streamed in read-only mode as value tuples. The header
+    is the first of the top rows containing at least two header_keywords
+    (the first row if none does); the index is the sheet row number.
+    Empty rows are included, so every row after the header is counted.
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        if sheet_name is None:
+            sheet_name = pick_sheet(wb.sheetnames, terms, exclude_terms)
+        sheet = wb[sheet_name]
+        logger.info(f"Reading sheet: {sheet.title}")
+
+        # Header row is searched among the top rows (kept, they may hold data)
+        row_values = sheet.iter_rows(values_only=True)
+        top_rows = list(itertools.islice(row_values, HEADER_SEARCH_ROWS))
+        if not top_rows:
+            return
+
+        header = 0
+        for index, values in enumerate(top_rows):
+            header_match_count = sum(
+                1 for value in values[:HEADER_SEARCH_ROWS]
+                if value and isinstance(value, str)
+                and any(keyword in value.lower() for keyword in header_keywords)
+            )
+            if header_match_count >= 2:
+                header = index
+                break
+
+        names = [
+            str(value).strip() if value is not None else f"col_{position}"
+            for position, value in enumerate(top_rows[header], 1)
+        ]
+        width = len(names)
+
+        data_rows = itertools.chain(top_rows[header + 1:], row_values)
+        row_num = header + 2
+        while True:
+            batch = [values[:width] for values in itertools.islice(data_rows, chunk_size)]
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=names, index=pd.RangeIndex(row_num, row_num + len(batch)))
+            row_num += len(batch)
+    finally:
+        wb.close()
+
+
+def iter_csv_chunks(source, chunk_size: int = IMPORT_CHUNK_SIZE, **read_options) -> Iterator[pd.DataFrame]:
+    """Rows of a CSV file as string DataFrames; the index is the file line number"""
+    chunks = pd.read_csv(
+        source, dtype=str, chunksize=chunk_size,
+        encoding="utf-8", encoding_errors="replace", **read_options
+    )
+    row_num = 2  # line 1 is the header
+    for chunk in chunks:
+        chunk.columns = [str(name).strip() for name in chunk.columns]
+        chunk.index = pd.RangeIndex(row_num, row_num + len(chunk))
+        row_num += len(chunk)
+        yield chunk
+
+
+def convert_chunk(spec: ImportSpec, chunk: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Converted spec fields of the rows to import and errors of the failed rows
+
+    Each column is converted in one call; rows with a value that cannot
+    be converted or without a required value are reported by row number.
+    """
+    converted = {}
+    row_errors: Dict[int, str] = {}
+
+    for column in spec.columns:
+        if column.field in chunk.columns:
+            raw = chunk[column.field]
+        else:
+            raw = pd.Series(None, index=chunk.index, dtype=object)
+
+        missing = raw.isna()
+        if not pd.api.types.is_numeric_dtype(raw) and not pd.api.types.is_datetime64_any_dtype(raw):
+            missing |= raw.map(lambda value: isinstance(value, str) and not value.strip()).astype(bool)
+        values = CONVERTERS[column.kind](raw.where(~missing))
+
+        invalid = values.isna() & ~missing
+        for row, value in raw[invalid].items():
+            row_errors.setdefault(row, f"Row {row}: Invalid {column.field}: {value}")
+
+        if missing.any():
+            if column.default is not None:
+                default = column.default() if callable(column.default) else column.default
+                values = values.where(~missing, default)
+            elif column.required:
+                for row in missing[missing].index:
+                    row_errors.setdefault(row, f"Row {row}: Missing {column.field}")
+
+        converted[column.field] = values
+
+    frame = pd.DataFrame(converted, index=chunk.index)
+    if row_errors:
+        frame = frame.loc[~frame.index.isin(list(row_errors))]
+    return frame, [row_errors[row] for row in sorted(row_errors)]
+
+
+def _stage_chunk(chunk: pd.DataFrame, spec_name: str, table: str) -> Dict[str, Any]:
+    """Worker process: convert a chunk and COPY its valid rows into the staging table"""
+    from app.utils.importer import IMPORT_SPECS  # the specs live with the importers
+
+    spec = IMPORT_SPECS[spec_name]
+    frame, errors = convert_chunk(spec, chunk.dropna(how="all"))
+
+    if not frame.empty:
+        payload = frame[spec.fields].to_csv(header=False, na_rep="\\N")
+        statement = (
+            f"COPY {table} (row_num, {', '.join(spec.fields)}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        )
+        connection = engine.raw_connection()
+        try:
+            copy_from_csv(connection, statement, payload)
+            connection.commit()
+        finally:
+            connection.close()
+
+    return {"staged": len(frame), "failed": len(errors), "errors": errors[:MAX_IMPORT_ERRORS]}
+
+
+class ImportPipeline:
+    """
+    Runs an ImportSpec over a file with a DataImporter
+
+    The importer provides the session, set-based get-or-create
+    (_get_or_create_ids), batched inserts (_insert_rows) and progress
+    reporting.
+    """
+
+    def __init__(self, importer, spec: ImportSpec):
+        self.importer = importer
+        self.db = importer.db
+        self.spec = spec
+
+    def run(self, source, file_type: str, column_mapping: Dict[str, str],
+            sheet_name: Optional[str] = None, mode: str = "append") -> Dict[str, Any]:
+        self._check_mode(mode)
+        to_field = self._header_mapping(column_mapping or {})
+
+        if file_type == "excel":
+            keywords = {name.lower() for name in list(to_field) + self.spec.fields}
+            chunks = iter_excel_chunks(
+                source, sheet_name, sorted(keywords),
+                self.spec.sheet_terms, self.spec.sheet_exclude_terms
+            )
+        elif file_type == "csv":
+            chunks = iter_csv_chunks(source)
+        else:
+            raise ValueError(f"Unsupported file type for {self.spec.label}: {file_type}")
+
+        chunks = (self._resolve_header(chunk, to_field) for chunk in chunks)
+
+        constants = {
+            field: value(self.importer) if callable(value) else value
+            for field, value in self.spec.constants.items()
+        }
+
+        parallel, chunks = parallel_chunks(self.db, chunks)
+        if parallel or mode == "upsert":
+            return self._run_staged(chunks, constants, mode, parallel)
+
+        key_ids: Dict[str, Dict[Any, Any]] = {fk.field: {} for fk in self.spec.foreign_keys}
+
+        total_processed = 0
+        successful = 0
+        failed = 0
+        errors: List[str] = []
+
+        for chunk in chunks:
+            total_processed += len(chunk)
+            frame, chunk_errors = convert_chunk(self.spec, chunk.dropna(how="all"))
+            failed += len(chunk_errors)
+            errors.extend(chunk_errors[:max(0, MAX_IMPORT_ERRORS - len(errors))])
+
+            if not frame.empty:
+                self._resolve_foreign_keys(frame, key_ids)
+                inserted, insert_failed, insert_errors = self.importer._insert_rows(
+                    self.spec.model, self._records(frame, constants)
+                )
+                successful += inserted
+                failed += insert_failed
+                errors.extend(insert_errors[:max(0, MAX_IMPORT_ERRORS - len(errors))])
+
+            self.importer._report_progress(total_processed)
+
+        logger.info(f"{self.spec.label.capitalize()} import: {successful} imported, {failed} failed")
+        return {
+            "total_processed": total_processed,
+            "successful": successful,
+            "failed": failed,
+            "errors": errors,
+            "inserted": successful,
+            "updated": 0,
+            "skipped": 0
+        }
+
+    def _check_mode(self, mode: str):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Unsupported import mode: {mode}")
+        if mode == "upsert":
+            if not self.spec.natural_key:
+                raise ValueError(f"Upsert is not supported for {self.spec.label}")
+            if self.db.get_bind().dialect.name != "postgresql":
+                raise ValueError("Upsert imports require PostgreSQL")
+
+    def _run_staged(self, chunks, constants: Dict[str, Any], mode: str = "append",
+                    parallel: bool = True) -> Dict[str, Any]:
+        """
+        Import through a staging table (PostgreSQL)
+
+        Chunks are converted and COPied into an UNLOGGED staging table -
+        by worker processes, each through its own connection, when parallel.
+        Referenced rows are then created for the distinct keys of the whole
+        file and a single statement merges staging into the target table,
+        resolving foreign keys by joins on the natural keys: INSERT ... SELECT
+        in append mode, UPDATE and INSERT ... WHERE NOT EXISTS by the spec's
+        natural key in upsert mode.
+        """
+        table = f"import_staging_{uuid.uuid4().hex[:12]}"
+        columns = ", ".join(f"{column.field} {STAGING_TYPES[column.kind]}" for column in self.spec.columns)
+        self.db.execute(text(f"CREATE UNLOGGED TABLE {table} (row_num bigint, {columns})"))
+        self.db.commit()
+
+        if parallel:
+            results = map_chunks(_stage_chunk, chunks, self.spec.name, table)
+        else:
+            results = ((len(chunk), _stage_chunk(chunk, self.spec.name, table)) for chunk in chunks)
+
+        total_processed = 0
+        staged = 0
+        failed = 0
+        errors: List[str] = []
+        merged = {"matched": 0, "inserted": 0, "updated": 0}
+        try:
+            for rows, result in results:
+                total_processed += rows
+                staged += result["staged"]
+                failed += result["failed"]
+                errors.extend(result["errors"][:max(0, MAX_IMPORT_ERRORS - len(errors))])
+                self.importer._report_progress(total_processed)
+
+            if staged:
+                merge = self._upsert_staging if mode == "upsert" else self._merge_staging
+                merged = merge(table, constants)
+        finally:
+            self.db.rollback()
+            self.db.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            self.db.commit()
+
+        # Staged rows the merge did not take (a key that could not be resolved)
+        failed += staged - merged["matched"]
+        # Rows equal to the stored ones, or superseded by a later row of the file
+        skipped = merged["matched"] - merged["inserted"] - merged["updated"]
+        successful = merged["inserted"] + merged["updated"]
+
+        logger.info(
+            f"{self.spec.label.capitalize()} import ({mode}{', parallel' if parallel else ''}): "
+            f"{merged['inserted']} inserted, {merged['updated']} updated, {skipped} skipped, {failed} failed"
+        )
+        return {
+            "total_processed": total_processed,
+            "successful": successful,
+            "failed": failed,
+            "errors": errors,
+            "inserted": merged["inserted"],
+            "updated": merged["updated"],
+            "skipped": skipped
+        }
+
+    def _merge_staging(self, table: str, constants: Dict[str, Any]) -> Dict[str, int]:
+        """Append staged rows to the target table"""
+        columns, values, source, params = self._staged_rows(table, constants)
+        statement = text(
+            f"INSERT INTO {self.spec.model.__table__.name} ({', '.join(columns)}) "
+            f"SELECT {', '.join(values)} FROM {source}"
+        ).bindparams(*params)
+        inserted = self.db.execute(statement).rowcount
+        self.db.commit()
+        return {"matched": inserted, "inserted": inserted, "updated": 0}
+
+    def _upsert_staging(self, table: str, constants: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Merge staged rows into the target table by the natural key
+
+        Of rows with the same key the last one in the file is taken. Stored
+        rows with its key are updated only when an imported field differs
+        (constants and defaults are not overwritten), other keys are inserted,
+        so re-importing a file changes nothing. The key has no unique index:
+        concurrent upserts into the table are serialized with a
+        transaction-level advisory lock instead.
+        """
+        columns, values, source, params = self._staged_rows(table, constants)
+        key = self.spec.natural_key
+        updated = [column for column in columns if column not in key and column in self._imported_columns]
+        listed = ", ".join(columns)
+        target = self.spec.model.__table__.name
+        same_key = " AND ".join(f"t.{column} = l.{column}" for column in key)
+
+        if updated:
+            update = f"""
+                UPDATE {target} t SET {', '.join(f'{column} = l.{column}' for column in updated)}
+                FROM latest l
+                WHERE {same_key}
+                  AND ({', '.join(f't.{column}' for column in updated)})
+                      IS DISTINCT FROM ({', '.join(f'l.{column}' for column in updated)})
+                RETURNING {', '.join(f'l.{column}' for column in key)}
+            """
+        else:
+            update = f"SELECT {', '.join(key)} FROM latest WHERE false"
+
+        statement = text(f"""
+            WITH joined AS (
+                SELECT {', '.join(f'{value} AS {column}' for column, value in zip(columns, values))}, s.row_num
+                FROM {source}
+            ), latest AS (
+                SELECT DISTINCT ON ({', '.join(key)}) {listed}
+                FROM joined
+                ORDER BY {', '.join(key)}, row_num DESC
+            ), updated AS ({update}
+            ), inserted AS (
+                INSERT INTO {target} ({listed})
+                SELECT {listed} FROM latest l
+                WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE {same_key})
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM joined) AS matched,
+                   (SELECT count(*) FROM inserted) AS inserted,
+                   (SELECT count(*) FROM (SELECT DISTINCT * FROM updated) keys) AS updated
+        """).bindparams(*params)
+        self.db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": f"{target}:upsert"})
+        merged = dict(self.db.execute(statement).mappings().one())
+        self.db.commit()
+        return merged
+
+    @property
+    def _imported_columns(self) -> List[str]:
+        """Target columns filled from the file: model fields and foreign keys"""
+        return self.spec.model_fields + [fk.field for fk in self.spec.foreign_keys]
+
+    def _staged_rows(self, table: str, constants: Dict[str, Any]) -> Tuple[List[str], List[str], str, list]:
+        """
+        Target columns, their values and the FROM clause over staged rows, and bind parameters
+
+        Referenced rows are created first for the distinct keys of the staging
+        table; foreign keys are then resolved by joins on the natural keys. A
+        key stored more than once (locations.address) resolves to its oldest
+        row, as in _get_or_create_ids, so a staged row is never taken twice.
+        """
+        spec = self.spec
+        for fk in spec.foreign_keys:
+            keys = self.db.execute(text(f"SELECT DISTINCT {fk.source} FROM {table} WHERE {fk.source} IS NOT NULL")).scalars().all()
+            self.importer._get_or_create_ids(fk.model, fk.key_column, keys, fk.defaults)
+            self.db.commit()
+
+        target = spec.model.__table__
+        columns = ["id"] + spec.model_fields
+        values = ["gen_random_uuid()"] + [f"s.{field}" for field in spec.model_fields]
+        joins = []
+        for number, fk in enumerate(spec.foreign_keys):
+            alias = f"fk{number}"
+            referenced = fk.model.__table__
+            order = "created_at, id" if "created_at" in referenced.columns else "id"
+            joins.append(
+                f"JOIN LATERAL (SELECT id FROM {referenced.name} WHERE {fk.key_column} = s.{fk.source} "
+                f"ORDER BY {order} LIMIT 1) {alias} ON true"
+            )
+            columns.append(fk.field)
+            values.append(f"{alias}.id")
+
+        # Constants and Python-side column defaults (the ORM would fill them) become
+        # parameters, cast to the column type (in a CTE an untyped parameter is text)
+        params = dict(constants)
+        for column in target.columns:
+            if column.name in columns or column.name in params:
+                continue
+            if column.default is not None and column.server_default is None:
+                default = column.default
+                params[column.name] = default.arg(None) if default.is_callable else default.arg
+        columns.extend(params)
+        dialect = self.db.get_bind().dialect
+        values.extend(f"CAST(:{name} AS {target.columns[name].type.compile(dialect=dialect)})" for name in params)
+
+        source = f"{table} s {' '.join(joins)}"
+        bindparams = [bindparam(name, value, type_=target.columns[name].type) for name, value in params.items()]
+        return columns, values, source, bindparams
+
+    def _header_mapping(self, column_mapping: Dict[str, str]) -> Dict[str, str]:
+        """File column -> field; the mapping may be given either way round (file -> field or field -> file)"""
+        fields = set(self.spec.fields)
+        to_field = {name: field for field, name in column_mapping.items() if field in fields}
+        to_field.update({name: field for name, field in column_mapping.items() if field in fields})
+        return to_field
+
+    @staticmethod
+    def _resolve_header(chunk: pd.DataFrame, to_field: Dict[str, str]) -> pd.DataFrame:
+        chunk = chunk.rename(columns=lambda name: to_field.get(name, name))
+        # A field given by two file columns is taken from the first one
+        return chunk.loc[:, ~chunk.columns.duplicated()]
+
+    def _resolve_foreign_keys(self, frame: pd.DataFrame, key_ids: Dict[str, Dict[Any, Any]]):
+        """Fill foreign key columns; only keys not seen in earlier chunks hit the database"""
+        for fk in self.spec.foreign_keys:
+            ids = key_ids[fk.field]
+            unknown = set(frame[fk.source].unique()) - ids.keys()
+            if unknown:
+                ids.update(self.importer._get_or_create_ids(fk.model, fk.key_column, unknown, fk.defaults))
+            frame[fk.field] = frame[fk.source].map(ids)
+        self.db.commit()
+
+    def _records(self, frame: pd.DataFrame, constants: Dict[str, Any]) -> List[Tuple[int, Dict[str, Any]]]:
+        """(row number, column values) of the model for the bulk writer"""
+        columns = self.spec.model_fields + [fk.field for fk in self.spec.foreign_keys]
+        values = frame[columns].copy()
+        for column in self.spec.columns:
+            if column.kind == "date" and column.field in values.columns:
+                values[column.field] = values[column.field].dt.date
+        values = values.astype(object).where(values.notna(), None)
+
+        return [
+            (row, {**record, **constants})
+            for row, record in zip(values.index, values.to_dict("records"))
+        ]
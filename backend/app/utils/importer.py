@@ -1,36 +1,77 @@
 import pandas as pd
 import logging
-from typing import Dict, List, Any, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, List, Any, Optional, Tuple, Union
 from sqlalchemy.orm import Session
-from sqlalchemy import inspect
+from sqlalchemy import inspect, insert, select, any_, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 import uuid
 from datetime import datetime
 import io
+import os
 from io import BytesIO
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services.tracks import invalidate_detector_table
+from app.services.route_stats_service import RouteStatsService
+from app.utils.bulk_loader import TrackReadingBulkLoader
+from app.utils.import_pipeline import (
+    AMBIGUOUS_DATE_FORMATS, DATE_FORMATS, Column, ForeignKey, ImportPipeline, ImportSpec, detect_date_format
+)
+from app.utils.parallel_import import map_chunks, parallel_chunks
 
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT / key lookup batch
+INSERT_BATCH_SIZE = 1000
+
+# Import source: path to a spooled upload, binary file object or raw bytes
+ImportSource = Union[str, os.PathLike, BinaryIO, bytes]
+
+
+def _open_source(source: ImportSource):
+    """Path or file object that pandas/openpyxl can read from"""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    return source
+
+
+def _is_unique_key(model, key_column: str) -> bool:
+    """Whether a column alone is a unique key of the model's table (ON CONFLICT target)"""
+    column = model.__table__.c[key_column]
+    if column.unique or column.primary_key:
+        return True
+    return any(
+        index.unique and [indexed.name for indexed in index.columns] == [key_column]
+        for index in model.__table__.indexes
+    )
+
 
 class DataImporter:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, progress_callback: Optional[Callable[[int], None]] = None):
         self.db = db
+        # Called with the number of rows processed so far (import jobs report it as progress)
+        self.progress_callback = progress_callback
 
-    def import_csv(self, file_content: bytes, model_class, column_mapping: Dict[str, str]) -> Dict[str, Any]:
+    def _report_progress(self, rows_processed: int):
+        if self.progress_callback is not None:
+            self.progress_callback(rows_processed)
+
+    def import_csv(self, source: ImportSource, model_class, column_mapping: Dict[str, str]) -> Dict[str, Any]:
         """Import data from CSV file"""
         try:
-            text = file_content.decode("utf-8", errors="replace")  # safer than BytesIO
-            df = pd.read_csv(io.StringIO(text))
+            df = pd.read_csv(_open_source(source), encoding="utf-8", encoding_errors="replace")
             return self._import_dataframe(df, model_class, column_mapping)
         except Exception as e:
             logger.error(f"CSV import error: {e}")
             raise ValueError(f"CSV import failed: {str(e)}")
 
     def import_excel(
-        self, file_content: bytes, model_class, column_mapping: Dict[str, str], sheet_name: Optional[str] = 0
+        self, source: ImportSource, model_class, column_mapping: Dict[str, str], sheet_name: Optional[str] = 0
     ) -> Dict[str, Any]:
         """Import data from Excel file"""
         try:
-            df = pd.read_excel(io.BytesIO(file_content), sheet_name=sheet_name)
+            df = pd.read_excel(_open_source(source), sheet_name=sheet_name)
             return self._import_dataframe(df, model_class, column_mapping)
         except Exception as e:
             logger.error(f"Excel import error: {e}")
@@ -62,10 +103,11 @@ class DataImporter:
         successful = 0
         failed = 0
         errors = []
+        columns = inspect(model_class).columns  # once per import, not per record
 
         for i, record in enumerate(records, 1):
             try:
-                cleaned = self._clean_record(record, model_class)
+                cleaned = self._clean_record(record, columns)
                 if not cleaned:
                     continue
                 obj = model_class(**cleaned)
@@ -86,18 +128,17 @@ class DataImporter:
             "errors": errors,
         }
 
-    def _clean_record(self, record: Dict[str, Any], model_class) -> Dict[str, Any]:
+    def _clean_record(self, record: Dict[str, Any], columns) -> Dict[str, Any]:
         cleaned = {}
-        mapper = inspect(model_class)
 
         for key, value in record.items():
             if pd.isna(value) or value == "":
                 continue
 
-            if key not in mapper.columns:
+            if key not in columns:
                 continue
 
-            column = mapper.columns[key]
+            column = columns[key]
             cleaned[key] = self._convert_value(value, column.type)
 
         return cleaned
@@ -122,676 +163,258 @@ class DataImporter:
             logger.warning(f"Conversion error for '{value}': {e}")
             return value
 
+    def import_spec(
+        self, spec: ImportSpec, source: ImportSource, file_type: str,
+        column_mapping: Dict[str, str], sheet_name: Optional[str] = None, mode: str = "append"
+    ) -> Dict[str, Any]:
+        """Import an Excel or CSV file with the declarative pipeline (see app.utils.import_pipeline)"""
+        try:
+            return ImportPipeline(self, spec).run(_open_source(source), file_type, column_mapping, sheet_name, mode)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"{spec.label.capitalize()} import error: {e}")
+            raise Exception(f"{spec.label.capitalize()} import failed: {str(e)}")
+
+    def _get_or_create_ids(
+        self, model, key_column: str, keys, defaults: Optional[Callable[[Any], Dict[str, Any]]] = None
+    ) -> Dict[Any, uuid.UUID]:
+        """
+        Primary keys of model rows by a key column; missing rows are inserted
+
+        Existing keys are resolved in one lookup (`= ANY(...)` in PostgreSQL),
+        missing ones are inserted in bulk. For a unique key column the insert
+        is INSERT ... ON CONFLICT DO NOTHING RETURNING, and keys inserted
+        concurrently by another import are picked up by a second lookup. A
+        non-unique key (locations.address: the API may store the same address
+        twice) resolves to its oldest row, and concurrent imports are
+        serialized with a transaction-level advisory lock on the table. The
+        caller commits.
+
+        Args:
+            defaults: Extra column values for a new row, by key
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        postgresql = self.db.get_bind().dialect.name == "postgresql"
+        unique = _is_unique_key(model, key_column)
+        if postgresql and not unique:
+            self.db.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": model.__tablename__}
+            )
+
+        ids = self._lookup_ids(model, key_column, keys)
+        missing = [key for key in keys if key not in ids]
+        if not missing:
+            return ids
+
+        rows = [
+            {"id": uuid.uuid4(), key_column: key, **(defaults(key) if defaults else {})}
+            for key in missing
+        ]
+        column = getattr(model, key_column)
+
+        if postgresql and unique:
+            for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+                statement = pg_insert(model).values(rows[offset:offset + INSERT_BATCH_SIZE])
+                ids.update(self.db.execute(
+                    statement.on_conflict_do_nothing(index_elements=[key_column]).returning(column, model.id)
+                ).tuples().all())
+
+            conflicting = [key for key in missing if key not in ids]
+            if conflicting:
+                ids.update(self._lookup_ids(model, key_column, conflicting))
+        else:
+            self.db.execute(insert(model), rows)
+            ids.update({row[key_column]: row["id"] for row in rows})
+
+        return ids
+
+    def _lookup_ids(self, model, key_column: str, keys: List[Any]) -> Dict[Any, uuid.UUID]:
+        """Ids by key; for a key stored more than once, the oldest row"""
+        column = getattr(model, key_column)
+        order = [model.created_at, model.id] if hasattr(model, "created_at") else [model.id]
+
+        if self.db.get_bind().dialect.name == "postgresql":
+            statements = [
+                select(column, model.id)
+                .where(column == any_(bindparam("keys", keys, type_=ARRAY(column.type))))
+                .order_by(*order)
+            ]
+        else:
+            statements = [
+                select(column, model.id).where(column.in_(keys[offset:offset + INSERT_BATCH_SIZE])).order_by(*order)
+                for offset in range(0, len(keys), INSERT_BATCH_SIZE)
+            ]
+
+        ids = {}
+        for statement in statements:
+            for key, id_ in self.db.execute(statement).tuples():
+                ids.setdefault(key, id_)
+        return ids
+
+    def _insert_rows(self, model, rows: List[Tuple[int, Dict[str, Any]]]) -> Tuple[int, int, List[str]]:
+        """
+        Bulk insert of (row number, values) in batches, one commit per batch
+
+        A failing batch is rolled back and reported as one error for its rows.
+        Returns (inserted, failed, errors).
+        """
+        inserted = 0
+        failed = 0
+        errors = []
+
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[offset:offset + INSERT_BATCH_SIZE]
+            try:
+                self.db.execute(insert(model), [values for _, values in batch])
+                self.db.commit()
+                inserted += len(batch)
+            except Exception as e:
+                self.db.rollback()
+                failed += len(batch)
+                errors.append(f"Rows {batch[0][0]}-{batch[-1][0]}: {str(e)}")
+                logger.warning(f"Rows {batch[0][0]}-{batch[-1][0]} failed: {e}")
+
+        return inserted, failed, errors
+
 
 # ---- Model-specific importers ----
 
+def _default_evacuation_location(importer: DataImporter) -> uuid.UUID:
+    """Evacuation data is city-wide: rows go to the first location (created if there is none)"""
+    location_id = importer.db.query(models.Location.id).limit(1).scalar()
+    if location_id is None:
+        address = "City-wide evacuation data"
+        location_id = importer._get_or_create_ids(models.Location, "address", [address])[address]
+        importer.db.commit()
+    return location_id
+
+
+FINE_SPEC = ImportSpec(
+    name="fines",
+    model=models.Fine,
+    columns=[
+        Column("plate_number", required=True),
+        Column("address", required=True),
+        Column("issued_at", "datetime", required=True),
+        Column("amount", "float", default=0.0),
+        Column("violation_code", default=""),
+        Column("status", default="issued"),
+    ],
+    foreign_keys=[
+        ForeignKey("vehicle_id", models.Vehicle, "plate_number", source="plate_number",
+                   defaults=lambda plate_number: {"type": "car"}),  # default type
+        ForeignKey("location_id", models.Location, "address", source="address"),
+    ],
+    constants={"visibility": "private"},
+    sheet_terms=["штраф", "fine", "нарушен"],
+    natural_key=["vehicle_id", "issued_at", "violation_code"],
+)
+
+ACCIDENT_SPEC = ImportSpec(
+    name="accidents",
+    model=models.Accident,
+    columns=[
+        Column("address", required=True),
+        Column("occurred_at", "datetime", required=True),
+        Column("accident_type", default=""),
+        Column("severity", default="minor"),
+        Column("casualties", "int", default=0),
+    ],
+    foreign_keys=[ForeignKey("location_id", models.Location, "address", source="address")],
+    constants={"visibility": "private"},
+    sheet_terms=["дтп", "accident", "incident"],
+    natural_key=["location_id", "occurred_at", "accident_type"],
+)
+
+TRAFFIC_LIGHT_SPEC = ImportSpec(
+    name="traffic_lights",
+    model=models.TrafficLight,
+    columns=[
+        Column("address", required=True),
+        Column("type", default=""),
+        Column("status", default="working"),
+        Column("install_date", "date"),
+    ],
+    foreign_keys=[ForeignKey("location_id", models.Location, "address", source="address")],
+    sheet_terms=["светофор", "traffic", "light"],
+)
+
+EVACUATION_SPEC = ImportSpec(
+    name="evacuations",
+    model=models.Evacuation,
+    columns=[
+        Column("evacuated_at", "datetime", required=True),
+        Column("towing_vehicles_count", "int", default=0),
+        Column("dispatches_count", "int", default=0),
+        Column("evacuations_count", "int", default=0),
+        Column("revenue", "float", default=0.0),
+    ],
+    constants={"location_id": _default_evacuation_location, "visibility": "private"},
+    sheet_terms=["эвакуация", "evacuation", "эвакуации", "evacuations"],
+    sheet_exclude_terms=["маршрут", "route", "map", "аналитик", "пример"],
+    natural_key=["location_id", "evacuated_at"],
+)
+
+# model_type -> import spec
+IMPORT_SPECS = {
+    spec.name: spec for spec in (FINE_SPEC, ACCIDENT_SPEC, TRAFFIC_LIGHT_SPEC, EVACUATION_SPEC)
+}
+
+
 class FineImporter(DataImporter):
     def import_fines(
-        self, file_content: bytes, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None
+        self, source: ImportSource, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None,
+        mode: str = "append"
     ) -> Dict[str, Any]:
-        from app.models import Fine, Location, Vehicle
-        import openpyxl
-        
-        try:
-            if file_type == "excel":
-                wb = openpyxl.load_workbook(io.BytesIO(file_content), data_only=True)
-                
-                # Use provided sheet name or auto-detect
-                if sheet_name is None:
-                    # Look for fines-related sheets
-                    for sheet in wb.sheetnames:
-                        sheet_lower = sheet.lower()
-                        if any(term in sheet_lower for term in ['штраф', 'fine', 'нарушен']):
-                            sheet_name = sheet
-                            break
-                    else:
-                        sheet_name = wb.sheetnames[0]
-                
-                sheet = wb[sheet_name]
-                print(f"Processing fines from sheet: {sheet.title}")
-                
-                # Find header row
-                header_row = None
-                header_keywords = ['issued_at', 'plate_number', 'violation_code', 'amount', 'address', 'status']
-                
-                for row_num in range(1, min(10, sheet.max_row + 1)):
-                    header_match_count = 0
-                    for col in range(1, min(10, sheet.max_column + 1)):
-                        cell_value = sheet.cell(row=row_num, column=col).value
-                        if cell_value and isinstance(cell_value, str):
-                            cell_lower = cell_value.lower()
-                            if any(keyword in cell_lower for keyword in header_keywords):
-                                header_match_count += 1
-                    
-                    if header_match_count >= 2:
-                        header_row = row_num
-                        break
-                
-                first_data_row = header_row + 1 if header_row else 2
-                
-                success_count = 0
-                error_count = 0
-                errors = []
-                
-                # Cache for vehicles and locations to avoid duplicate lookups
-                vehicle_cache = {}  # plate_number -> vehicle_id
-                location_cache = {}  # address -> location_id
-                
-                for row_num in range(first_data_row, sheet.max_row + 1):
-                    try:
-                        # Skip empty rows
-                        if sheet.cell(row=row_num, column=1).value is None:
-                            continue
-                            
-                        # Extract row data
-                        row_data = {}
-                        for col in range(1, sheet.max_column + 1):
-                            header_cell = sheet.cell(row=header_row, column=col).value if header_row else f"col_{col}"
-                            value_cell = sheet.cell(row=row_num, column=col).value
-                            
-                            if value_cell is not None:
-                                # Apply column mapping
-                                mapped_key = column_mapping.get(str(header_cell).strip(), str(header_cell).strip())
-                                row_data[mapped_key] = value_cell
-                        
-                        # Skip if no valid data
-                        if not row_data:
-                            continue
-                            
-                        # Process vehicle (get or create)
-                        plate_number = str(row_data.get('plate_number', '')).strip()
-                        if not plate_number:
-                            continue
-                            
-                        if plate_number in vehicle_cache:
-                            vehicle_id = vehicle_cache[plate_number]
-                        else:
-                            # Look for existing vehicle
-                            vehicle = self.db.query(Vehicle).filter(Vehicle.plate_number == plate_number).first()
-                            if vehicle:
-                                vehicle_id = vehicle.id
-                            else:
-                                # Create new vehicle
-                                vehicle = Vehicle(
-                                    id=uuid.uuid4(),
-                                    plate_number=plate_number,
-                                    type="car"  # default type
-                                )
-                                self.db.add(vehicle)
-                                self.db.flush()  # Get the ID without committing
-                                vehicle_id = vehicle.id
-                            vehicle_cache[plate_number] = vehicle_id
-                        
-                        # Process location (get or create)
-                        address = str(row_data.get('address', '')).strip()
-                        if not address:
-                            continue
-                            
-                        if address in location_cache:
-                            location_id = location_cache[address]
-                        else:
-                            # Look for existing location
-                            location = self.db.query(Location).filter(Location.address == address).first()
-                            if location:
-                                location_id = location.id
-                            else:
-                                # Create new location
-                                location = Location(
-                                    id=uuid.uuid4(),
-                                    address=address
-                                )
-                                self.db.add(location)
-                                self.db.flush()
-                                location_id = location.id
-                            location_cache[address] = location_id
-                        
-                        # Process date
-                        issued_at = row_data.get('issued_at')
-                        if isinstance(issued_at, datetime):
-                            issued_at_date = issued_at
-                        elif isinstance(issued_at, str):
-                            try:
-                                issued_at_date = datetime.strptime(issued_at, '%Y-%m-%d')
-                            except:
-                                # Try other formats
-                                try:
-                                    issued_at_date = datetime.strptime(issued_at, '%d.%m.%Y')
-                                except:
-                                    issued_at_date = datetime.now()
-                        else:
-                            issued_at_date = datetime.now()
-                        
-                        # Create fine record
-                        fine_data = {
-                            'vehicle_id': vehicle_id,
-                            'location_id': location_id,
-                            'amount': float(row_data.get('amount', 0)),
-                            'issued_at': issued_at_date,
-                            'violation_code': str(row_data.get('violation_code', '')),
-                            'status': str(row_data.get('status', 'issued')),
-                            'visibility': 'private'
-                        }
-                        
-                        fine = Fine(**fine_data)
-                        self.db.add(fine)
-                        success_count += 1
-                        
-                        if success_count % 50 == 0:
-                            self.db.commit()
-                            
-                    except Exception as e:
-                        error_count += 1
-                        errors.append(f"Row {row_num}: {str(e)}")
-                        continue
-                
-                self.db.commit()
-                
-                return {
-                    "total_processed": sheet.max_row - first_data_row + 1,
-                    "successful": success_count,
-                    "failed": error_count,
-                    "errors": errors
-                }
-                
-            else:
-                # Fall back to generic CSV import (will need similar modifications)
-                raise Exception("CSV import not yet implemented for fines with relationships")
-                
-        except Exception as e:
-            self.db.rollback()
-            raise Exception(f"Fines import failed: {str(e)}")
+        return self.import_spec(FINE_SPEC, source, file_type, column_mapping, sheet_name, mode)
 
 
 class AccidentImporter(DataImporter):
     def import_accidents(
-        self, file_content: bytes, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None
+        self, source: ImportSource, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None,
+        mode: str = "append"
     ) -> Dict[str, Any]:
-        from app.models import Accident, Location
-        import openpyxl
-        
-        try:
-            if file_type == "excel":
-                wb = openpyxl.load_workbook(io.BytesIO(file_content), data_only=True)
-                
-                # Use provided sheet name or auto-detect
-                if sheet_name is None:
-                    for sheet in wb.sheetnames:
-                        sheet_lower = sheet.lower()
-                        if any(term in sheet_lower for term in ['дтп', 'accident', 'incident']):
-                            sheet_name = sheet
-                            break
-                    else:
-                        sheet_name = wb.sheetnames[0]
-                
-                sheet = wb[sheet_name]
-                print(f"Processing accidents from sheet: {sheet.title}")
-                
-                # Find header row
-                header_row = None
-                header_keywords = ['occurred_at', 'accident_type', 'severity', 'casualties', 'address']
-                
-                for row_num in range(1, min(10, sheet.max_row + 1)):
-                    header_match_count = 0
-                    for col in range(1, min(10, sheet.max_column + 1)):
-                        cell_value = sheet.cell(row=row_num, column=col).value
-                        if cell_value and isinstance(cell_value, str):
-                            cell_lower = cell_value.lower()
-                            if any(keyword in cell_lower for keyword in header_keywords):
-                                header_match_count += 1
-                    
-                    if header_match_count >= 2:
-                        header_row = row_num
-                        break
-                
-                first_data_row = header_row + 1 if header_row else 2
-                
-                success_count = 0
-                error_count = 0
-                errors = []
-                
-                # Cache for locations
-                location_cache = {}
-                
-                for row_num in range(first_data_row, sheet.max_row + 1):
-                    try:
-                        # Skip empty rows
-                        if sheet.cell(row=row_num, column=1).value is None:
-                            continue
-                            
-                        # Extract row data
-                        row_data = {}
-                        for col in range(1, sheet.max_column + 1):
-                            header_cell = sheet.cell(row=header_row, column=col).value if header_row else f"col_{col}"
-                            value_cell = sheet.cell(row=row_num, column=col).value
-                            
-                            if value_cell is not None:
-                                mapped_key = column_mapping.get(str(header_cell).strip(), str(header_cell).strip())
-                                row_data[mapped_key] = value_cell
-                        
-                        if not row_data:
-                            continue
-                            
-                        # Process location
-                        address = str(row_data.get('address', '')).strip()
-                        if not address:
-                            continue
-                            
-                        if address in location_cache:
-                            location_id = location_cache[address]
-                        else:
-                            location = self.db.query(Location).filter(Location.address == address).first()
-                            if location:
-                                location_id = location.id
-                            else:
-                                location = Location(
-                                    id=uuid.uuid4(),
-                                    address=address
-                                )
-                                self.db.add(location)
-                                self.db.flush()
-                                location_id = location.id
-                            location_cache[address] = location_id
-                        
-                        # Process date
-                        occurred_at = row_data.get('occurred_at')
-                        if isinstance(occurred_at, datetime):
-                            occurred_at_date = occurred_at
-                        elif isinstance(occurred_at, str):
-                            try:
-                                occurred_at_date = datetime.strptime(occurred_at, '%Y-%m-%d %H:%M:%S')
-                            except:
-                                try:
-                                    occurred_at_date = datetime.strptime(occurred_at, '%Y-%m-%d')
-                                except:
-                                    occurred_at_date = datetime.now()
-                        else:
-                            occurred_at_date = datetime.now()
-                        
-                        # Create accident record
-                        accident_data = {
-                            'location_id': location_id,
-                            'accident_type': str(row_data.get('accident_type', '')),
-                            'severity': str(row_data.get('severity', 'minor')),
-                            'occurred_at': occurred_at_date,
-                            'casualties': int(row_data.get('casualties', 0)),
-                            'visibility': 'private'
-                        }
-                        
-                        accident = Accident(**accident_data)
-                        self.db.add(accident)
-                        success_count += 1
-                        
-                        if success_count % 50 == 0:
-                            self.db.commit()
-                            
-                    except Exception as e:
-                        error_count += 1
-                        errors.append(f"Row {row_num}: {str(e)}")
-                        continue
-                
-                self.db.commit()
-                
-                return {
-                    "total_processed": sheet.max_row - first_data_row + 1,
-                    "successful": success_count,
-                    "failed": error_count,
-                    "errors": errors
-                }
-                
-            else:
-                raise Exception("CSV import not yet implemented for accidents")
-                
-        except Exception as e:
-            self.db.rollback()
-            raise Exception(f"Accidents import failed: {str(e)}")
+        return self.import_spec(ACCIDENT_SPEC, source, file_type, column_mapping, sheet_name, mode)
 
 
 class TrafficLightImporter(DataImporter):
     def import_traffic_lights(
-        self, file_content: bytes, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None
+        self, source: ImportSource, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None,
+        mode: str = "append"
     ) -> Dict[str, Any]:
-        from app.models import TrafficLight, Location
-        import openpyxl
-        
-        try:
-            if file_type == "excel":
-                wb = openpyxl.load_workbook(io.BytesIO(file_content), data_only=True)
-                
-                # Use provided sheet name or auto-detect
-                if sheet_name is None:
-                    for sheet in wb.sheetnames:
-                        sheet_lower = sheet.lower()
-                        if any(term in sheet_lower for term in ['светофор', 'traffic', 'light']):
-                            sheet_name = sheet
-                            break
-                    else:
-                        sheet_name = wb.sheetnames[0]
-                
-                sheet = wb[sheet_name]
-                print(f"Processing traffic lights from sheet: {sheet.title}")
-                
-                # Find header row
-                header_row = None
-                header_keywords = ['type', 'status', 'install_date', 'address']
-                
-                for row_num in range(1, min(10, sheet.max_row + 1)):
-                    header_match_count = 0
-                    for col in range(1, min(10, sheet.max_column + 1)):
-                        cell_value = sheet.cell(row=row_num, column=col).value
-                        if cell_value and isinstance(cell_value, str):
-                            cell_lower = cell_value.lower()
-                            if any(keyword in cell_lower for keyword in header_keywords):
-                                header_match_count += 1
-                    
-                    if header_match_count >= 2:
-                        header_row = row_num
-                        break
-                
-                first_data_row = header_row + 1 if header_row else 2
-                
-                success_count = 0
-                error_count = 0
-                errors = []
-                
-                # Cache for locations
-                location_cache = {}
-                
-                for row_num in range(first_data_row, sheet.max_row + 1):
-                    try:
-                        # Skip empty rows
-                        if sheet.cell(row=row_num, column=1).value is None:
-                            continue
-                            
-                        # Extract row data
-                        row_data = {}
-                        for col in range(1, sheet.max_column + 1):
-                            header_cell = sheet.cell(row=header_row, column=col).value if header_row else f"col_{col}"
-                            value_cell = sheet.cell(row=row_num, column=col).value
-                            
-                            if value_cell is not None:
-                                mapped_key = column_mapping.get(str(header_cell).strip(), str(header_cell).strip())
-                                row_data[mapped_key] = value_cell
-                        
-                        if not row_data:
-                            continue
-                            
-                        # Process location
-                        address = str(row_data.get('address', '')).strip()
-                        if not address:
-                            continue
-                            
-                        if address in location_cache:
-                            location_id = location_cache[address]
-                        else:
-                            location = self.db.query(Location).filter(Location.address == address).first()
-                            if location:
-                                location_id = location.id
-                            else:
-                                location = Location(
-                                    id=uuid.uuid4(),
-                                    address=address
-                                )
-                                self.db.add(location)
-                                self.db.flush()
-                                location_id = location.id
-                            location_cache[address] = location_id
-                        
-                        # Process dates
-                        install_date = row_data.get('install_date')
-                        if isinstance(install_date, datetime):
-                            install_date_val = install_date.date()
-                        elif isinstance(install_date, str):
-                            try:
-                                install_date_val = datetime.strptime(install_date, '%Y-%m-%d').date()
-                            except:
-                                install_date_val = datetime.now().date()
-                        else:
-                            install_date_val = datetime.now().date()
-                        
-                        # Create traffic light record
-                        traffic_light_data = {
-                            'location_id': location_id,
-                            'type': str(row_data.get('type', '')),
-                            'status': str(row_data.get('status', 'working')),
-                            'install_date': install_date_val,
-                            'last_maintenance': None  # Can be updated later
-                        }
-                        
-                        traffic_light = TrafficLight(**traffic_light_data)
-                        self.db.add(traffic_light)
-                        success_count += 1
-                        
-                        if success_count % 50 == 0:
-                            self.db.commit()
-                            
-                    except Exception as e:
-                        error_count += 1
-                        errors.append(f"Row {row_num}: {str(e)}")
-                        continue
-                
-                self.db.commit()
-                
-                return {
-                    "total_processed": sheet.max_row - first_data_row + 1,
-                    "successful": success_count,
-                    "failed": error_count,
-                    "errors": errors
-                }
-                
-            else:
-                raise Exception("CSV import not yet implemented for traffic lights")
-                
-        except Exception as e:
-            self.db.rollback()
-            raise Exception(f"Traffic lights import failed: {str(e)}")
+        return self.import_spec(TRAFFIC_LIGHT_SPEC, source, file_type, column_mapping, sheet_name, mode)
 
 
 class EvacuationImporter(DataImporter):
     def import_evacuations(
-        self, file_content: bytes, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None
+        self, source: ImportSource, file_type: str, column_mapping: Dict[str, str], sheet_name: Optional[str] = None,
+        mode: str = "append"
     ) -> Dict[str, Any]:
-        from app.models import Evacuation, Location
-        import pandas as pd
-        from io import BytesIO
-        
-        try:
-            # First, ensure we have a location
-            print("Checking available locations...")
-            
-            existing_location = self.db.query(Location).first()
-            
-            if existing_location:
-                print(f"Using existing location with ID: {existing_location.id}")
-                location_id = existing_location.id
-            else:
-                print("No locations found, creating a new one...")
-                
-                location_data = {'id': uuid.uuid4()}
-                
-                try:
-                    if hasattr(Location, 'name'):
-                        location_data['name'] = "Default Evacuation Location"
-                    elif hasattr(Location, 'address'):
-                        location_data['address'] = "City-wide evacuation data"
-                    elif hasattr(Location, 'description'):
-                        location_data['description'] = "Default evacuation location"
-                except:
-                    pass
-                
-                try:
-                    new_location = Location(**location_data)
-                    self.db.add(new_location)
-                    self.db.commit()
-                    location_id = new_location.id
-                    print(f"Created new location with ID: {location_id}")
-                except Exception as e:
-                    print(f"Error creating location: {e}")
-                    location_id = uuid.uuid4()
-                    print(f"Using generated location ID: {location_id}")
-            
-            if file_type == "excel":
-                # Use pandas to read the Excel file with proper sheet handling
-                xls = pd.ExcelFile(BytesIO(file_content))
-                
-                # Auto-detect the right sheet if not provided
-                if sheet_name is None:
-                    sheet_name = self._detect_evacuation_sheet(xls.sheet_names)
-                
-                print(f"Available sheets: {xls.sheet_names}")
-                print(f"Selected sheet: {sheet_name}")
-                
-                # Read the specific sheet
-                df = pd.read_excel(BytesIO(file_content), sheet_name=sheet_name)
-                
-                print(f"DataFrame shape: {df.shape}")
-                print("Original columns:", df.columns.tolist())
-                print("First few rows:")
-                print(df.head())
-                
-                # Apply column mappings
-                reverse_mapping = {v: k for k, v in column_mapping.items()}
-                df_renamed = df.rename(columns=reverse_mapping)
-                
-                print("After applying mappings:")
-                print("Mapped columns:", df_renamed.columns.tolist())
-                print("Available data columns:", [col for col in df_renamed.columns if col in df_renamed])
-                
-                success_count = 0
-                error_count = 0
-                errors = []
-                
-                for index, row in df_renamed.iterrows():
-                    try:
-                        # Skip empty rows - check if evacuated_at is NaN or None
-                        evacuated_at_value = row.get('evacuated_at')
-                        if pd.isna(evacuated_at_value) or evacuated_at_value is None:
-                            continue
-                            
-                        print(f"Processing row {index}: evacuated_at = {evacuated_at_value}")
-                        
-                        # Parse date
-                        evacuated_at = self._parse_date(evacuated_at_value)
-                        if not evacuated_at:
-                            print(f"Skipping row {index} - invalid date: {evacuated_at_value}")
-                            continue
-                        
-                        # Create evacuation record with safe type conversion
-                        evacuation_data = {
-                            'evacuated_at': evacuated_at,
-                            'towing_vehicles_count': self._safe_int(row.get('towing_vehicles_count')),
-                            'dispatches_count': self._safe_int(row.get('dispatches_count')),
-                            'evacuations_count': self._safe_int(row.get('evacuations_count')),
-                            'revenue': self._safe_float(row.get('revenue')),
-                            'location_id': location_id,
-                            'visibility': 'private'
-                        }
-                        
-                        print(f"Evacuation data: {evacuation_data}")
-                        
-                        evacuation = Evacuation(**evacuation_data)
-                        self.db.add(evacuation)
-                        success_count += 1
-                        
-                        if success_count % 50 == 0:
-                            self.db.commit()
-                            print(f"Committed {success_count} records...")
-                            
-                    except Exception as e:
-                        error_count += 1
-                        error_msg = f"Row {index}: {str(e)}"
-                        errors.append(error_msg)
-                        print(f"Error on row {index}: {e}")
-                        import traceback
-                        print(traceback.format_exc())
-                        continue
-                
-                self.db.commit()
-                print(f"Import completed: {success_count} successful, {error_count} failed")
-                
-                return {
-                    "total_processed": len(df_renamed),
-                    "successful": success_count,
-                    "failed": error_count,
-                    "errors": errors
-                }
-                
-        except Exception as e:
-            self.db.rollback()
-            import traceback
-            print(f"Import error: {str(e)}")
-            print(traceback.format_exc())
-            raise Exception(f"Excel import failed: {str(e)}")
-    
-    def _detect_evacuation_sheet(self, sheet_names):
-        """Auto-detect the evacuation data sheet"""
-        evacuation_keywords = ['эвакуация', 'evacuation', 'эвакуации', 'evacuations']
-        
-        for sheet in sheet_names:
-            sheet_lower = sheet.lower()
-            if any(keyword in sheet_lower for keyword in evacuation_keywords):
-                return sheet
-        
-        # If no evacuation sheet found, look for data sheets (not route/map sheets)
-        non_route_keywords = ['маршрут', 'route', 'map', 'аналитик', 'пример']
-        for sheet in sheet_names:
-            sheet_lower = sheet.lower()
-            if not any(keyword in sheet_lower for keyword in non_route_keywords):
-                return sheet
-        
-        # Fallback to first sheet
-        return sheet_names[0] if sheet_names else None
-    
-    def _parse_date(self, date_value):
-        """Parse date from various formats"""
-        if pd.isna(date_value) or date_value is None:
-            return None
-            
-        if isinstance(date_value, datetime):
-            return date_value
-        elif isinstance(date_value, pd.Timestamp):
-            return date_value.to_pydatetime()
-        elif isinstance(date_value, str):
-            date_str = str(date_value).strip()
-            # Try different date formats
-            formats = [
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d',
-                '%d.%m.%Y',
-                '%m/%d/%Y',
-                '%d-%m-%Y'
-            ]
-            for fmt in formats:
-                try:
-                    return datetime.strptime(date_str, fmt)
-                except ValueError:
-                    continue
-        return None
-    
-    def _safe_int(self, value, default=0):
-        """Safely convert to integer"""
-        try:
-            if pd.isna(value) or value is None:
-                return default
-            return int(float(value))
-        except (ValueError, TypeError):
-            return default
-    
-    def _safe_float(self, value, default=0.0):
-        """Safely convert to float"""
-        try:
-            if pd.isna(value) or value is None:
-                return default
-            return float(value)
-        except (ValueError, TypeError):
-            return default
+        return self.import_spec(EVACUATION_SPEC, source, file_type, column_mapping, sheet_name, mode)
 
 
 class VehicleTrackReadingImporter(DataImporter):
     """Импортер данных с детекторов транспортных средств"""
     
-    def import_from_excel(self, file_content: bytes, column_mapping: Dict[str, str], 
+    # Координаты новых детекторов, если их нет в detector_coords (центр Смоленска)
+    DEFAULT_DETECTOR_COORDS = (54.7826, 32.0453)
+    
+    # Маппинг по умолчанию: поле БД -> колонка файла
+    DEFAULT_COLUMN_MAPPING = {
+        "detector_id": "ID_детектора",
+        "timestamp": "Временная_метка",
+        "vehicle_identifier": "Идентификатор_ТС",
+        "speed": "Скорость_прохождения"
+    }
+    
+    REQUIRED_COLUMNS = ["detector_id", "timestamp", "vehicle_identifier"]
+    
+    def import_from_excel(self, source: ImportSource, column_mapping: Dict[str, str], 
                          detector_coords: Optional[Dict[str, Tuple[float, float]]] = None,
-                         sheet_name: Optional[str] = 0) -> Dict[str, Any]:
+                         sheet_name: Optional[str] = 0, mode: str = "append") -> Dict[str, Any]:
         """
         Импорт данных с детекторов из Excel файла
         
@@ -802,143 +425,341 @@ class VehicleTrackReadingImporter(DataImporter):
         - Скорость_прохождения / speed (опционально)
         
         Args:
-            file_content: Содержимое Excel файла
+            source: Путь к Excel файлу, бинарный файловый объект или содержимое файла
             column_mapping: Маппинг колонок файла на поля БД
             detector_coords: Словарь {detector_id: (latitude, longitude)} для автоматического создания детекторов
             sheet_name: Имя листа в Excel файле
+            mode: append - добавить все чтения, upsert - слить с уже загруженными
+                по (детектор, ТС, метка времени) (только PostgreSQL)
         """
-        from app.models import Detector, VehicleTrackReading
+        try:
+            df = pd.read_excel(_open_source(source), sheet_name=sheet_name)
+            return self.import_dataframe(df, column_mapping, detector_coords, mode)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"VehicleTrackReading import error: {e}")
+            raise Exception(f"Import failed: {str(e)}")
+    
+    def import_from_csv(self, source, column_mapping: Dict[str, str],
+                        detector_coords: Optional[Dict[str, Tuple[float, float]]] = None,
+                        chunk_size: Optional[int] = None, mode: str = "append", **read_options) -> Dict[str, Any]:
+        """
+        Потоковый импорт данных с детекторов из CSV
+        
+        Файл читается блоками по chunk_size строк (по умолчанию
+        TRACK_IMPORT_BATCH_SIZE), в память попадают только колонки маппинга;
+        ID детектора и ТС читаются строками (без потери ведущих нулей).
         
+        Args:
+            source: Путь к файлу или бинарный файловый объект
+            read_options: Дополнительные параметры pd.read_csv (sep, encoding, ...)
+        """
+        file_columns = self._file_columns(column_mapping)
         try:
-            df = pd.read_excel(BytesIO(file_content), sheet_name=sheet_name)
-            
-            # Применяем маппинг колонок
-            reverse_mapping = {v: k for k, v in column_mapping.items()}
-            df_renamed = df.rename(columns=reverse_mapping)
-            
-            # Проверяем наличие обязательных колонок
-            required_cols = ['detector_id', 'timestamp', 'vehicle_identifier']
-            missing_cols = [col for col in required_cols if col not in df_renamed.columns]
-            if missing_cols:
-                raise ValueError(f"Missing required columns: {missing_cols}")
-            
-            # Создаем кэш детекторов для быстрого доступа
-            detector_cache = {}  # detector_id -> Detector объект
-            
-            # Если передан словарь координат, создаем недостающие детекторы
-            if detector_coords:
-                for detector_id, (lat, lon) in detector_coords.items():
-                    existing = self.db.query(Detector).filter(
-                        Detector.detector_id == str(detector_id)
-                    ).first()
-                    
-                    if not existing:
-                        detector = Detector(
-                            detector_id=str(detector_id),
-                            latitude=lat,
-                            longitude=lon
-                        )
-                        self.db.add(detector)
-                        self.db.flush()
-                        detector_cache[str(detector_id)] = detector
-                    else:
-                        detector_cache[str(detector_id)] = existing
-            
-            success_count = 0
-            error_count = 0
-            errors = []
-            
-            for index, row in df_renamed.iterrows():
-                try:
-                    # Пропускаем пустые строки
-                    detector_id = row.get('detector_id')
-                    timestamp = row.get('timestamp')
-                    vehicle_identifier = row.get('vehicle_identifier')
-                    
-                    if pd.isna(detector_id) or pd.isna(timestamp) or pd.isna(vehicle_identifier):
-                        continue
-                    
-                    # Получаем или создаем детектор
-                    detector_id_str = str(detector_id).strip()
-                    if detector_id_str not in detector_cache:
-                        detector = self.db.query(Detector).filter(
-                            Detector.detector_id == detector_id_str
-                        ).first()
-                        
-                        if detector:
-                            detector_cache[detector_id_str] = detector
-                        else:
-                            # Если детектора нет, пытаемся найти координаты или используем дефолтные
-                            if detector_coords and detector_id_str in detector_coords:
-                                lat, lon = detector_coords[detector_id_str]
-                            else:
-                                # Используем дефолтные координаты (центр Смоленска)
-                                lat, lon = 54.7826, 32.0453
-                            
-                            detector = Detector(
-                                detector_id=detector_id_str,
-                                latitude=lat,
-                                longitude=lon
-                            )
-                            self.db.add(detector)
-                            self.db.flush()
-                            detector_cache[detector_id_str] = detector
-                    
-                    detector_obj = detector_cache[detector_id_str]
-                    
-                    # Парсим временную метку
-                    if isinstance(timestamp, str):
-                        timestamp_dt = pd.to_datetime(timestamp, errors='coerce')
-                    elif isinstance(timestamp, datetime):
-                        timestamp_dt = timestamp
-                    else:
-                        timestamp_dt = pd.to_datetime(timestamp, errors='coerce')
-                    
-                    if pd.isna(timestamp_dt):
-                        errors.append(f"Row {index}: Invalid timestamp: {timestamp}")
-                        error_count += 1
-                        continue
-                    
-                    # Обрабатываем скорость (опционально)
-                    speed = None
-                    if 'speed' in row and not pd.isna(row.get('speed')):
-                        try:
-                            speed = float(row['speed'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Создаем запись о прохождении
-                    reading = VehicleTrackReading(
-                        detector_id=detector_obj.id,
-                        timestamp=timestamp_dt,
-                        vehicle_identifier=str(vehicle_identifier).strip(),
-                        speed=speed
-                    )
-                    
-                    self.db.add(reading)
-                    success_count += 1
-                    
-                    # Коммитим батчами для производительности
-                    if success_count % 1000 == 0:
-                        self.db.commit()
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_msg = f"Row {index}: {str(e)}"
-                    errors.append(error_msg)
-                    logger.warning(f"Row {index} failed: {e}")
-                    continue
-            
-            self.db.commit()
-            
-            return {
-                "total_processed": len(df_renamed),
-                "successful": success_count,
-                "failed": error_count,
-                "errors": errors[:100]  # Ограничиваем количество ошибок в ответе
-            }
+            chunks = pd.read_csv(
+                _open_source(source),
+                usecols=lambda column: column in file_columns,
+                dtype={column: str for column, field in file_columns.items() if field != "speed"},
+                chunksize=chunk_size or settings.TRACK_IMPORT_BATCH_SIZE,
+                **read_options
+            )
+            return self._import_chunks(chunks, column_mapping, detector_coords, mode)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"VehicleTrackReading CSV import error: {e}")
+            raise Exception(f"Import failed: {str(e)}")
+    
+    def import_from_parquet(self, source, column_mapping: Dict[str, str],
+                            detector_coords: Optional[Dict[str, Tuple[float, float]]] = None,
+                            chunk_size: Optional[int] = None, mode: str = "append") -> Dict[str, Any]:
+        """
+        Потоковый импорт данных с детекторов из Parquet
+        
+        Читаются только колонки маппинга, группы строк - пачками по
+        chunk_size строк (требуется pyarrow).
+        
+        Args:
+            source: Путь к файлу или бинарный файловый объект с произвольным доступом
+        """
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet import requires pyarrow")
+        
+        file_columns = self._file_columns(column_mapping)
+        try:
+            parquet_file = pq.ParquetFile(_open_source(source))
+            columns = [name for name in parquet_file.schema_arrow.names if name in file_columns]
+            batches = parquet_file.iter_batches(
+                batch_size=chunk_size or settings.TRACK_IMPORT_BATCH_SIZE, columns=columns
+            )
+            return self._import_chunks(self._arrow_chunks(batches), column_mapping, detector_coords, mode)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"VehicleTrackReading Parquet import error: {e}")
+            raise Exception(f"Import failed: {str(e)}")
+    
+    def import_from_arrow(self, source, column_mapping: Dict[str, str],
+                          detector_coords: Optional[Dict[str, Tuple[float, float]]] = None,
+                          mode: str = "append") -> Dict[str, Any]:
+        """
+        Потоковый импорт данных с детекторов из Arrow IPC (файл или поток, в т.ч. Feather v2)
+        
+        Записи обрабатываются по одному record batch (требуется pyarrow).
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Arrow import requires pyarrow")
+        
+        file_columns = self._file_columns(column_mapping)
+        if isinstance(source, (str, os.PathLike)):
+            source = pa.memory_map(os.fspath(source))  # Файл отображается в память без копирования
+        else:
+            source = _open_source(source)
+        try:
+            try:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+                names = reader.schema.names
+            except pa.ArrowInvalid:
+                source.seek(0)
+                reader = pa.ipc.open_stream(source)
+                batches = iter(reader)
+                names = reader.schema.names
             
+            columns = [name for name in names if name in file_columns]
+            projected = (batch.select(columns) for batch in batches)
+            return self._import_chunks(self._arrow_chunks(projected), column_mapping, detector_coords, mode)
         except Exception as e:
             self.db.rollback()
-            logger.error(f"VehicleTrackReading import error: {e}")
-            raise Exception(f"Import failed: {str(e)}")
\ No newline at end of file
+            logger.error(f"VehicleTrackReading Arrow import error: {e}")
+            raise Exception(f"Import failed: {str(e)}")
+    
+    def import_dataframe(self, df: pd.DataFrame, column_mapping: Dict[str, str],
+                         detector_coords: Optional[Dict[str, Tuple[float, float]]] = None,
+                         mode: str = "append") -> Dict[str, Any]:
+        """Импорт чтений из DataFrame, целиком находящегося в памяти"""
+        return self._import_chunks([df], column_mapping, detector_coords, mode)
+    
+    def _file_columns(self, column_mapping: Dict[str, str]) -> Dict[str, str]:
+        """Колонка файла -> поле БД для всех допустимых названий (из маппинга и самих полей)"""
+        file_columns = {field: field for field in self.REQUIRED_COLUMNS + ["speed"]}
+        file_columns.update({
+            column: field for field, column in column_mapping.items() if field in file_columns
+        })
+        return file_columns
+    
+    @staticmethod
+    def _arrow_chunks(batches):
+        """DataFrame на каждый Arrow record batch; индекс - сквозной номер строки"""
+        offset = 0
+        for batch in batches:
+            df = batch.to_pandas()
+            df.index = pd.RangeIndex(offset, offset + len(df))
+            offset += len(df)
+            yield df
+    
+    def _import_chunks(self, chunks, column_mapping: Dict[str, str],
+                       detector_coords: Optional[Dict[str, Tuple[float, float]]],
+                       mode: str = "append") -> Dict[str, Any]:
+        """
+        Импорт чтений блоками DataFrame
+        
+        Проверка и преобразование выполняются над колонками блока целиком
+        (pd.to_datetime, pd.to_numeric, сопоставление детекторов по словарю),
+        запись - пачками через TrackReadingBulkLoader (COPY в PostgreSQL).
+        Файл из нескольких блоков в PostgreSQL обрабатывается параллельно:
+        блоки загружают IMPORT_PARALLEL_WORKERS процессов, каждый через свое
+        соединение; в памяти находится не больше двух блоков на процесс.
+        Чтения сливаются с загруженными по естественному ключу (см.
+        TrackReadingBulkLoader): в режиме append уже загруженные пропускаются
+        (skipped), в режиме upsert обновляются; повторный импорт файла ничего
+        не меняет.
+        """
+        # Режим проверяется до чтения файла
+        loader = TrackReadingBulkLoader(self.db, mode=mode)
+        
+        total_processed = 0
+        successful = 0
+        failed = 0
+        errors = []
+        merged = {"inserted": 0, "updated": 0, "skipped": 0}
+        first_timestamp = None
+        last_timestamp = None
+        
+        # Детекторы из detector_coords создаются заранее - с заданными координатами
+        detector_map = self._resolve_detectors(set(), detector_coords) if detector_coords else {}
+        self.db.commit()
+        
+        parallel, chunks = parallel_chunks(self.db, chunks)
+        if parallel:
+            results = map_chunks(_load_reading_chunk, chunks, column_mapping, mode)
+        else:
+            results = ((len(df), self._load_chunk(df, column_mapping, detector_map, loader)) for df in chunks)
+        
+        for rows, result in results:
+            total_processed += rows
+            successful += result["loaded"]
+            failed += result["failed"]
+            errors.extend(result["errors"][:max(0, 100 - len(errors))])
+            for count in merged:
+                merged[count] += result[count]
+            self._report_progress(total_processed)
+            
+            if result["first_timestamp"] is None:
+                continue
+            # Границы периода импорта - для обновления статистики маршрутов
+            chunk_first, chunk_last = result["first_timestamp"], result["last_timestamp"]
+            first_timestamp = chunk_first if first_timestamp is None else min(first_timestamp, chunk_first)
+            last_timestamp = chunk_last if last_timestamp is None else max(last_timestamp, chunk_last)
+        
+        # Новые детекторы должны попасть в кэшированный справочник анализа
+        invalidate_detector_table()
+        
+        # Поездки и статистика затронутых часов пересчитываются в фоне, не задерживая импорт:
+        # период ставится в очередь, разбирает ее веб-процесс (импорт может идти в рабочем процессе)
+        if first_timestamp is not None:
+            try:
+                RouteStatsService(self.db).enqueue_refresh(first_timestamp, last_timestamp)
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Could not queue route stats refresh after import: {e}")
+        
+        return {
+            "total_processed": total_processed,
+            "successful": successful,
+            "failed": failed,
+            "errors": errors,  # Не более 100 ошибок в ответе
+            **merged
+        }
+    
+    def _load_chunk(self, df: pd.DataFrame, column_mapping: Dict[str, str], detector_map: Dict[str, Any],
+                    loader: TrackReadingBulkLoader) -> Dict[str, Any]:
+        """
+        Проверка, сопоставление детекторов и запись одного блока
+        
+        Returns:
+            loaded, failed, errors (не более 100), inserted / updated / skipped
+            и границы периода записанных чтений
+        """
+        frame, errors = self._prepare_chunk(df, column_mapping)
+        
+        # Детекторы: один запрос на новые ID блока, недостающие создаются пачкой
+        unknown = set(frame["detector_id"].unique()) - detector_map.keys()
+        if unknown:
+            detector_map.update(self._resolve_detectors(unknown, None))
+        self.db.commit()
+        frame["detector_id"] = frame["detector_id"].map(detector_map)
+        
+        result = loader.load(frame)
+        loaded = result["loaded"] > 0
+        return {
+            "loaded": result["loaded"],
+            "failed": len(errors) + result["failed"],
+            "errors": (errors + result["errors"])[:100],
+            "inserted": result["inserted"],
+            "updated": result["updated"],
+            "skipped": result["skipped"],
+            "first_timestamp": frame["timestamp"].min().to_pydatetime() if loaded else None,
+            "last_timestamp": frame["timestamp"].max().to_pydatetime() if loaded else None
+        }
+    
+    def _prepare_chunk(self, df: pd.DataFrame, column_mapping: Dict[str, str]) -> Tuple[pd.DataFrame, List[str]]:
+        """Блок в колонках detector_id, timestamp, vehicle_identifier, speed и ошибки его строк"""
+        # Применяем маппинг колонок
+        reverse_mapping = {v: k for k, v in column_mapping.items()}
+        df_renamed = df.rename(columns=reverse_mapping)
+        
+        # Проверяем наличие обязательных колонок
+        missing_cols = [col for col in self.REQUIRED_COLUMNS if col not in df_renamed.columns]
+        if missing_cols:
+            raise ValueError(f"Missing required columns: {missing_cols}")
+        
+        # Пропускаем пустые строки
+        frame = df_renamed.loc[df_renamed[self.REQUIRED_COLUMNS].notna().all(axis=1)]
+        frame = pd.DataFrame({
+            "detector_id": frame["detector_id"].astype(str).str.strip(),
+            "timestamp": self._parse_timestamps(frame["timestamp"]),
+            "vehicle_identifier": frame["vehicle_identifier"].astype(str).str.strip(),
+            "speed": (
+                pd.to_numeric(frame["speed"], errors="coerce").astype(float)
+                if "speed" in frame.columns else float("nan")
+            )
+        }, index=frame.index)
+        
+        invalid = frame["timestamp"].isna()
+        errors = [
+            f"Row {index}: Invalid timestamp: {value}"
+            for index, value in df_renamed.loc[invalid[invalid].index, "timestamp"].items()
+        ]
+        return frame.loc[~invalid], errors
+    
+    @staticmethod
+    def _parse_timestamps(values: pd.Series) -> pd.Series:
+        """
+        Временные метки колонкой; нераспознанные значения - NaT
+        
+        Формат определяется по выборке колонки, а не по первому значению, так что
+        01.02.2024 - всегда 1 февраля. Строки других форматов разбираются
+        остальными форматами DATE_FORMATS; метки с разными часовыми поясами
+        приводятся к UTC.
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        
+        detected = detect_date_format(values)
+        if detected:
+            excluded = {detected, AMBIGUOUS_DATE_FORMATS.get(detected)}
+            formats = [detected] + [f for f in DATE_FORMATS if f not in excluded]
+        else:
+            formats = DATE_FORMATS
+        
+        parts = []
+        pending = values.notna()
+        for date_format in formats:
+            if not pending.any():
+                break
+            try:
+                attempt = pd.to_datetime(values[pending], errors="coerce", format=date_format)
+            except ValueError:
+                attempt = pd.to_datetime(values[pending], errors="coerce", format=date_format, utc=True)
+            attempt = attempt.dropna()
+            # Метки без пояса и с поясом в одной колонке не смешиваются: остальные - NaT
+            if attempt.empty or (parts and getattr(attempt.dt, "tz", None) != getattr(parts[0].dt, "tz", None)):
+                continue
+            parts.append(attempt)
+            pending.loc[attempt.index] = False
+        
+        if not parts:
+            return pd.Series(pd.NaT, index=values.index, dtype="datetime64[us]")
+        return pd.concat(parts).reindex(values.index)
+    
+    def _resolve_detectors(self, detector_ids: set,
+                           detector_coords: Optional[Dict[str, Tuple[float, float]]]) -> Dict[str, Any]:
+        """
+        Соответствие ID_детектора -> UUID детектора
+        
+        Недостающие детекторы (из файла и из detector_coords) создаются с
+        координатами из detector_coords или координатами по умолчанию.
+        """
+        from app.models import Detector
+        
+        coords = {str(key): value for key, value in (detector_coords or {}).items()}
+        
+        def detector_defaults(key: str) -> Dict[str, float]:
+            lat, lon = coords.get(key, self.DEFAULT_DETECTOR_COORDS)
+            return {"latitude": lat, "longitude": lon}
+        
+        return self._get_or_create_ids(Detector, "detector_id", detector_ids | set(coords), detector_defaults)
+
+
+def _load_reading_chunk(df: pd.DataFrame, column_mapping: Dict[str, str], mode: str = "append") -> Dict[str, Any]:
+    """Процесс параллельного импорта: загрузка блока чтений через собственную сессию"""
+    db = SessionLocal()
+    try:
+        return VehicleTrackReadingImporter(db)._load_chunk(
+            df, column_mapping, {}, TrackReadingBulkLoader(db, mode=mode)
+        )
+    finally:
+        db.close()
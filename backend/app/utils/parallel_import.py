@@ -0,0 +1,64 @@
+"""
+Parallel chunked imports
+
+Imports read their file in chunks; on PostgreSQL, when a file has more
+than one chunk, the chunks are converted and written by a pool of
+IMPORT_PARALLEL_WORKERS processes, each through its own database
+connection. The parent process keeps reading and only collects results.
+
+Workers are started with the "spawn" method (the parent holds open
+database connections), so worker functions must be module-level and
+their arguments picklable.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Tuple
+import itertools
+import multiprocessing
+from sqlalchemy.orm import Session
+from app.config import settings
+
+
+def import_workers() -> int:
+    return max(1, settings.IMPORT_PARALLEL_WORKERS)
+
+
+def parallel_chunks(db: Session, chunks: Iterable) -> Tuple[bool, Iterator]:
+    """
+    Whether to import chunks in worker processes, and the chunks
+
+    Only PostgreSQL imports of more than one chunk go parallel: small files
+    do not pay for starting the pool. The first two chunks are read ahead.
+    """
+    chunks = iter(chunks)
+    if import_workers() < 2 or db.get_bind().dialect.name != "postgresql":
+        return False, chunks
+
+    head = list(itertools.islice(chunks, 2))
+    return len(head) > 1, itertools.chain(head, chunks)
+
+
+def map_chunks(function: Callable, chunks: Iterable, *args) -> Iterator[Tuple[int, Any]]:
+    """
+    (rows in chunk, function(chunk, *args)) for every chunk, in chunk order
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    while the file is read. A failing chunk raises here; chunks not started
+    yet are cancelled.
+    """
+    workers = import_workers()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append((len(chunk), executor.submit(function, chunk, *args)))
+            if len(pending) >= workers * 2:
+                rows, future = pending.popleft()
+                yield rows, future.result()
+
+        while pending:
+            rows, future = pending.popleft()
+            yield rows, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,76 @@
+"""
+Upload spooling for imports
+
+Uploaded files are copied to a temporary file in UPLOAD_DIR chunk by chunk,
+so a request never holds the whole upload in memory, and the size limit is
+enforced while copying: the request fails with 413 as soon as the limit is
+exceeded. Import jobs then read the spooled file by path and remove it
+when they finish.
+"""
+
+from typing import Optional
+import logging
+import os
+import tempfile
+from fastapi import HTTPException, UploadFile, status
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the size limit of {max_size} bytes"
+    )
+
+
+async def save_upload(file: UploadFile, max_size: Optional[int] = None) -> str:
+    """
+    Spool an upload to a temporary file and return its path
+
+    The file keeps the upload's extension; the caller owns it and must
+    remove it (remove_upload).
+
+    Args:
+        max_size: Size limit in bytes (default MAX_FILE_SIZE, 0 - no limit)
+    """
+    max_size = settings.MAX_FILE_SIZE if max_size is None else max_size
+
+    try:
+        # Size reported by the multipart parser lets oversized uploads fail before copying
+        if max_size and file.size is not None and file.size > max_size:
+            raise _too_large(max_size)
+
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        suffix = os.path.splitext(file.filename or "")[1].lower()
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=settings.UPLOAD_DIR)
+
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as spool:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise _too_large(max_size)
+                    spool.write(chunk)
+
+            if size == 0:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file")
+        except BaseException:
+            remove_upload(path)
+            raise
+    finally:
+        await file.close()
+
+    return os.path.abspath(path)
+
+
+def remove_upload(path: str):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not remove spooled upload {path}: {e}")
+
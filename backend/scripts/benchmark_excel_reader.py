@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Excel sheet reader used by the fines/accidents/traffic lights importers
+
+Writes a fines sheet with --rows data rows and reads it twice: with the
+previous reader (full workbook load, one sheet.cell() call per cell) and
+with the import pipeline reader (read-only streaming, row tuples).
+Prints the time of both; the previous reader is much slower, use
+--skip-cell-reader or fewer --rows for a quick run. Nothing is written to
+the database.
+
+Usage:
+    python scripts/benchmark_excel_reader.py
+    python scripts/benchmark_excel_reader.py --rows 50000 --skip-cell-reader
+"""
+import sys
+import os
+import argparse
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# parent directory to Python path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+import pandas as pd
+from app.utils.import_pipeline import iter_excel_chunks
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEADER = ["issued_at", "plate_number", "violation_code", "amount", "address", "status"]
+HEADER_KEYWORDS = HEADER
+
+
+def write_sheet(path, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet("Штрафы")
+    sheet.append(HEADER)
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        sheet.append([
+            start + timedelta(minutes=i),
+            f"A{i % 5000:04d}BC77",
+            "12.9.2",
+            500 + i % 7 * 250,
+            f"Street {i % 800}, {i % 40 + 1}",
+            "issued"
+        ])
+    wb.save(path)
+
+
+def read_cells(path):
+    """Previous reader: full workbook load, one sheet.cell() call per cell"""
+    wb = openpyxl.load_workbook(path, data_only=True)
+    sheet = wb[wb.sheetnames[0]]
+
+    header_row = None
+    for row_num in range(1, min(10, sheet.max_row + 1)):
+        header_match_count = 0
+        for col in range(1, min(10, sheet.max_column + 1)):
+            cell_value = sheet.cell(row=row_num, column=col).value
+            if cell_value and isinstance(cell_value, str):
+                if any(keyword in cell_value.lower() for keyword in HEADER_KEYWORDS):
+                    header_match_count += 1
+        if header_match_count >= 2:
+            header_row = row_num
+            break
+
+    first_data_row = header_row + 1 if header_row else 2
+    rows = []
+    for row_num in range(first_data_row, sheet.max_row + 1):
+        if sheet.cell(row=row_num, column=1).value is None:
+            continue
+        row_data = {}
+        for col in range(1, sheet.max_column + 1):
+            header_cell = sheet.cell(row=header_row, column=col).value if header_row else f"col_{col}"
+            value_cell = sheet.cell(row=row_num, column=col).value
+            if value_cell is not None:
+                row_data[str(header_cell).strip()] = value_cell
+        if row_data:
+            rows.append((row_num, row_data))
+    return rows
+
+
+def read_streaming(path):
+    rows = []
+    for chunk in iter_excel_chunks(path, None, HEADER_KEYWORDS, terms=["штраф", "fine"]):
+        for row_num, values in zip(chunk.index, chunk.itertuples(index=False)):
+            row_data = {name: value for name, value in zip(chunk.columns, values) if pd.notna(value)}
+            if row_data:
+                rows.append((row_num, row_data))
+    return rows
+
+
+def measure(name, reader, path):
+    started = time.perf_counter()
+    rows = reader(path)
+    elapsed = time.perf_counter() - started
+    logger.info(f"{name}: {len(rows)} rows in {elapsed:.1f} s ({len(rows) / elapsed:,.0f} rows/s)")
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000, help="Data rows in the generated sheet")
+    parser.add_argument("--skip-cell-reader", action="store_true", help="Only time the streaming reader")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        logger.info(f"Writing {args.rows} rows to {path}")
+        write_sheet(path, args.rows)
+        logger.info(f"File size: {os.path.getsize(path) / 1024 ** 2:.1f} MB")
+
+        streamed, streaming_time = measure("read_only + iter_rows", read_streaming, path)
+        if not args.skip_cell_reader:
+            cells, cell_time = measure("load_workbook + sheet.cell", read_cells, path)
+            if cells != streamed:
+                logger.error("Readers returned different rows")
+            logger.info(f"Speedup: {cell_time / streaming_time:.1f}x")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
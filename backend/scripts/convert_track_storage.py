@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Copy vehicle_track_readings into the compact storage table (PostgreSQL)
+
+Fills vehicles_dict and detector_codes, then copies readings partition
+range by partition range into vehicle_track_readings_compact and prints
+table + index sizes of both layouts. Set TRACK_STORAGE_MODE=compact
+afterwards to switch the application over.
+
+Usage:
+    python scripts/convert_track_storage.py
+"""
+import sys
+import os
+import logging
+from datetime import datetime, time, timezone
+
+# parent directory to Python path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app.database import SessionLocal
+from app import models
+from app.services.partition_manager import ensure_default_partition, ensure_partitions, partition_bounds
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SOURCE = models.VehicleTrackReading.__tablename__
+TARGET = models.CompactTrackReading.__tablename__
+
+
+def _total_size(db, table):
+    """Table + index size, summed over partitions for partitioned tables"""
+    return db.execute(text(
+        "SELECT pg_total_relation_size(CAST(:name AS regclass)) + COALESCE(("
+        "SELECT sum(pg_total_relation_size(inhrelid)) FROM pg_inherits "
+        "WHERE inhparent = CAST(:name AS regclass)), 0)"
+    ), {"name": table}).scalar()
+
+
+def convert_track_storage():
+    db = SessionLocal()
+    try:
+        if db.get_bind().dialect.name != "postgresql":
+            logger.error("Compact track storage requires PostgreSQL")
+            return False
+
+        db.execute(text(
+            f"INSERT INTO vehicles_dict (vehicle_identifier) "
+            f"SELECT DISTINCT vehicle_identifier FROM {SOURCE} "
+            f"ON CONFLICT (vehicle_identifier) DO NOTHING"
+        ))
+        db.execute(text(
+            "INSERT INTO detector_codes (detector_id) SELECT id FROM detectors "
+            "ON CONFLICT (detector_id) DO NOTHING"
+        ))
+        db.commit()
+
+        first, last = db.execute(text(f"SELECT min(timestamp), max(timestamp) FROM {SOURCE}")).one()
+        if first is None:
+            logger.info("No readings to convert")
+            return True
+
+        first_day = first.astimezone(timezone.utc).date()
+        last_day = last.astimezone(timezone.utc).date()
+        ensure_default_partition(db, TARGET)
+        ensure_partitions(db, first_day, last_day, TARGET)
+        db.commit()
+
+        # One partition range per transaction
+        day = first_day
+        while day <= last_day:
+            lower, upper = partition_bounds(day)
+            copied = db.execute(text(
+                f"INSERT INTO {TARGET} (timestamp, detector_code, vehicle_code, speed) "
+                f"SELECT r.timestamp, d.code, v.id, r.speed FROM {SOURCE} r "
+                f"JOIN detector_codes d ON d.detector_id = r.detector_id "
+                f"JOIN vehicles_dict v ON v.vehicle_identifier = r.vehicle_identifier "
+                f"WHERE r.timestamp >= :lower AND r.timestamp < :upper"
+            ), {
+                "lower": datetime.combine(lower, time(), tzinfo=timezone.utc),
+                "upper": datetime.combine(upper, time(), tzinfo=timezone.utc)
+            }).rowcount
+            db.commit()
+            logger.info(f"{lower} - {upper}: {copied} readings")
+            day = upper
+
+        db.execute(text(f"ANALYZE {TARGET}"))
+        db.commit()
+
+        source_size, target_size = _total_size(db, SOURCE), _total_size(db, TARGET)
+        logger.info(f"✅ {SOURCE}: {source_size / 1024 ** 2:.1f} MB, {TARGET}: {target_size / 1024 ** 2:.1f} MB")
+        return True
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    convert_track_storage()
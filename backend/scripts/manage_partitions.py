@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Maintain vehicle_track_readings partitions (run daily from cron)
+
+Creates partitions ahead of time and detaches partitions older than the
+retention period (moved to the archive schema, or dropped without one).
+
+Usage:
+    python scripts/manage_partitions.py
+    python scripts/manage_partitions.py --retention-days 365
+"""
+import sys
+import os
+import argparse
+import logging
+
+# parent directory to Python path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.services.partition_manager import maintain_partitions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def manage_partitions(retention_days=None):
+    db = SessionLocal()
+    try:
+        result = maintain_partitions(db, retention_days)
+        if not result["partitioned"]:
+            logger.warning("vehicle_track_readings is not partitioned, run 'alembic upgrade head' first")
+            return
+        logger.info(f"✅ Created partitions: {result['created'] or 'none'}")
+        logger.info(f"✅ Detached partitions: {result['detached'] or 'none'}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain vehicle_track_readings partitions")
+    parser.add_argument("--retention-days", type=int, default=None,
+                        help="Detach partitions older than this many days (default: TRACK_RETENTION_DAYS)")
+    args = parser.parse_args()
+
+    manage_partitions(args.retention_days)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Rebuild trips and hourly route statistics from raw vehicle track readings
+
+Usage:
+    python scripts/rebuild_route_stats.py
+    python scripts/rebuild_route_stats.py --start 2024-01-01 --end 2024-02-01 --step-hours 6
+"""
+import sys
+import os
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+# parent directory to Python path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.services.route_stats_service import RouteStatsService
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def rebuild_route_stats(start_time=None, end_time=None, step_hours=24):
+    db = SessionLocal()
+    try:
+        total_buckets = 0
+        for result in RouteStatsService(db).rebuild(start_time, end_time, timedelta(hours=step_hours)):
+            total_buckets += result["buckets_count"]
+            logger.info(
+                f"{result['start_hour']} - {result['end_hour']}: "
+                f"{result['routes_count']} routes, {result['buckets_count']} hourly buckets"
+            )
+        logger.info(f"✅ Route statistics rebuilt: {total_buckets} hourly buckets")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild trips and hourly route statistics")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="Start of the period (ISO format), defaults to the first reading")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="End of the period (ISO format), defaults to the last reading")
+    parser.add_argument("--step-hours", type=int, default=24,
+                        help="Hours processed per step (sessions crossing a step boundary are re-segmented whole)")
+    args = parser.parse_args()
+
+    rebuild_route_stats(args.start, args.end, args.step_hours)
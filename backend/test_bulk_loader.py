@@ -0,0 +1,177 @@
+# test_bulk_loader.py
+"""
+Bulk loading of detector readings
+
+TrackReadingBulkLoader writes readings in batches: batched INSERT on
+SQLite, COPY through a staging table on PostgreSQL. Loading the same
+readings again must insert nothing, an upsert must update only readings
+whose speed changed, and a failing batch must only lose its own rows. Runs on an in-memory SQLite database; the COPY path runs
+against PostgreSQL when TEST_POSTGRES_URL is set (the tables of that
+database are dropped and recreated):
+
+    python -m pytest test_bulk_loader.py
+    TEST_POSTGRES_URL=postgresql+psycopg2://user@/test python -m pytest test_bulk_loader.py
+    python test_bulk_loader.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own engines
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from datetime import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.services.partition_manager import ensure_default_partition
+from app.services.track_storage import TrackStorage
+from app.utils.bulk_loader import TrackReadingBulkLoader
+
+DAY_START = datetime(2024, 1, 1)
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def postgres_session():
+    """Session on TEST_POSTGRES_URL with freshly created tables (skips the test without it)"""
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    for storage in (TrackStorage("standard"), TrackStorage("compact")):
+        ensure_default_partition(db, storage.table_name)
+    db.commit()
+    return db
+
+
+def add_detectors(db, count=3):
+    detectors = [
+        models.Detector(detector_id=f"D{i:02d}", latitude=55.0 + i * 0.01, longitude=37.0 + i * 0.01)
+        for i in range(count)
+    ]
+    db.add_all(detectors)
+    db.commit()
+    return [detector.id for detector in detectors]
+
+
+def readings_frame(detector_ids, count, speed=40.0, tz=None):
+    """count readings in the importer's frame layout, indexed by file row number"""
+    return pd.DataFrame({
+        "detector_id": [detector_ids[idx % len(detector_ids)] for idx in range(count)],
+        "timestamp": pd.date_range(DAY_START, periods=count, freq="min", tz=tz),
+        "vehicle_identifier": [f"V{idx % 4}" for idx in range(count)],
+        "speed": [speed] * count
+    }, index=range(2, count + 2))
+
+
+def stored_count(db, storage):
+    return db.execute(select(func.count()).select_from(storage.model)).scalar()
+
+
+def test_batched_insert_skips_stored_readings():
+    db = make_session()
+    try:
+        storage = TrackStorage("standard")
+        detector_ids = add_detectors(db)
+        frame = readings_frame(detector_ids, 10)
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=4).load(frame)
+        assert (result["loaded"], result["inserted"], result["skipped"], result["failed"]) == (10, 10, 0, 0)
+
+        # Same readings again, plus in-file duplicates of two of them
+        again = pd.concat([frame, frame.iloc[:2]])
+        result = TrackReadingBulkLoader(db, storage, batch_size=4).load(again)
+        assert (result["inserted"], result["skipped"]) == (0, 12)
+        assert stored_count(db, storage) == 10
+
+        with pytest.raises(ValueError):
+            TrackReadingBulkLoader(db, storage, mode="upsert")
+    finally:
+        db.close()
+
+
+def test_failed_batch_keeps_other_batches():
+    db = make_session()
+    try:
+        storage = TrackStorage("standard")
+        frame = readings_frame(add_detectors(db), 9)
+        frame.loc[6, "vehicle_identifier"] = None  # NOT NULL: the second batch (rows 5-7) fails
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=3).load(frame)
+        assert (result["loaded"], result["failed"]) == (6, 3)
+        assert result["errors"][0].startswith("Rows 5-7:")
+        assert stored_count(db, storage) == 6
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("mode", ["standard", "compact"])
+def test_copy_skips_stored_readings(mode):
+    db = postgres_session()
+    try:
+        storage = TrackStorage(mode)
+        frame = readings_frame(add_detectors(db), 10, tz="UTC")
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=4).load(frame)
+        assert (result["inserted"], result["skipped"], result["failed"]) == (10, 0, 0), result["errors"]
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=4).load(pd.concat([frame, frame.iloc[:2]]))
+        assert (result["inserted"], result["skipped"]) == (0, 12)
+        assert stored_count(db, storage) == 10
+
+        stored = db.execute(storage.readings_select().order_by(storage.timestamp)).all()
+        assert [row.vehicle_identifier for row in stored] == frame["vehicle_identifier"].tolist()
+        assert [row.timestamp for row in stored] == frame["timestamp"].dt.to_pydatetime().tolist()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("mode", ["standard", "compact"])
+def test_upsert_updates_changed_readings(mode):
+    db = postgres_session()
+    try:
+        storage = TrackStorage(mode)
+        frame = readings_frame(add_detectors(db), 10, tz="UTC")
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=4, mode="upsert").load(frame)
+        assert (result["inserted"], result["updated"], result["skipped"], result["failed"]) == (10, 0, 0, 0), \
+            result["errors"]
+
+        result = TrackReadingBulkLoader(db, storage, batch_size=4, mode="upsert").load(frame)
+        assert (result["inserted"], result["updated"], result["skipped"]) == (0, 0, 10)
+
+        # Three speeds changed; a reading repeated in the file takes its last speed
+        changed = frame.copy()
+        changed.loc[[2, 5, 9], "speed"] = 55.0
+        repeated = changed.loc[[5]].assign(speed=60.0).set_axis([12])
+        result = TrackReadingBulkLoader(db, storage, batch_size=20, mode="upsert").load(
+            pd.concat([changed, repeated])
+        )
+        assert (result["inserted"], result["updated"], result["skipped"]) == (0, 3, 8)
+
+        stored = db.execute(storage.readings_select().order_by(storage.timestamp)).all()
+        assert len(stored) == 10
+        assert [float(row.speed) for row in stored] == [55.0, 40.0, 40.0, 60.0] + [40.0] * 3 + [55.0, 40.0, 40.0]
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_batched_insert_skips_stored_readings()
+    test_failed_batch_keeps_other_batches()
+    if os.environ.get("TEST_POSTGRES_URL"):
+        test_copy_skips_stored_readings("standard")
+        test_copy_skips_stored_readings("compact")
+        test_upsert_updates_changed_readings("standard")
+        test_upsert_updates_changed_readings("compact")
+    print("OK")
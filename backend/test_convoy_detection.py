@@ -0,0 +1,114 @@
+# test_convoy_detection.py
+"""
+Batch convoy detection
+
+_detector_pairs must find exactly the pairs a brute-force scan finds, and a
+run must store the same pairs whatever the length of the time slices the
+window is read in (pairs across slice edges are neither lost nor counted
+twice). Runs on an in-memory SQLite database:
+
+    python -m pytest test_convoy_detection.py
+    python test_convoy_detection.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import random
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.services import convoy_service
+from app.services.convoy_service import ConvoyDetectionService, _detector_pairs
+
+WINDOW_START = datetime(2024, 1, 1)
+WINDOW_END = datetime(2024, 1, 2)
+
+
+def brute_force_pairs(vehicles, timestamps, detectors, max_gap_ms):
+    pairs = set()
+    for i in range(len(vehicles)):
+        for j in range(i + 1, len(vehicles)):
+            if (detectors[i] == detectors[j] and vehicles[i] != vehicles[j]
+                    and abs(timestamps[j] - timestamps[i]) <= max_gap_ms):
+                a, b = (i, j) if vehicles[i] < vehicles[j] else (j, i)
+                pairs.add((vehicles[a], vehicles[b], a, b))
+    return pairs
+
+
+def test_detector_pairs_match_brute_force():
+    generator = np.random.default_rng(3)
+    for _ in range(20):
+        count = int(generator.integers(0, 300))
+        vehicles = generator.integers(0, 15, count)
+        detectors = generator.integers(0, 6, count)
+        # Coarse timestamps give ties on the same detector
+        timestamps = generator.integers(0, 200, count) * 10000
+        order = np.lexsort((timestamps, detectors))
+        vehicles, detectors, timestamps = vehicles[order], detectors[order], timestamps[order]
+        max_gap_ms = int(generator.integers(0, 100000))
+
+        found = set(zip(*(column.tolist() for column in _detector_pairs(vehicles, timestamps, detectors, max_gap_ms))))
+        assert found == brute_force_pairs(vehicles.tolist(), timestamps.tolist(), detectors.tolist(), max_gap_ms)
+
+
+def make_session():
+    """SQLite session with groups of vehicles driving the same routes minutes apart"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    detectors = [
+        models.Detector(detector_id=f"D{i:02d}", latitude=55.0 + i * 0.01, longitude=37.0 + i * 0.01)
+        for i in range(20)
+    ]
+    db.add_all(detectors)
+    db.flush()
+
+    generator = random.Random(4)
+    routes = [generator.sample(detectors, 6) for _ in range(4)]
+    for vehicle in range(60):
+        route = routes[vehicle % len(routes)]
+        timestamp = WINDOW_START + timedelta(hours=8, seconds=generator.randint(0, 3600))
+        for detector in route:
+            timestamp += timedelta(seconds=generator.randint(30, 200))
+            db.add(models.VehicleTrackReading(
+                detector_id=detector.id, timestamp=timestamp, vehicle_identifier=f"V{vehicle}", speed=40.0
+            ))
+    db.commit()
+    return db
+
+
+def stored_pairs(db, slice_length):
+    convoy_service.READINGS_SLICE = slice_length
+    service = ConvoyDetectionService(db)
+    run = service.create_run(WINDOW_START, WINDOW_END, min_common_nodes=3,
+                             max_time_gap_seconds=300, max_lead_seconds=60)
+    run = service.run(run.id)
+    assert run.status == "completed", run.error
+    return {(pair.vehicle_a, pair.vehicle_b, pair.common_nodes_count) for pair in run.pairs}
+
+
+def test_run_does_not_depend_on_slice_length():
+    slice_length = convoy_service.READINGS_SLICE
+    db = make_session()
+    try:
+        expected = stored_pairs(db, timedelta(days=1))
+        assert expected
+        # Slices shorter than the time gap: pairs span several slices
+        for length in (timedelta(hours=1), timedelta(minutes=10), timedelta(minutes=2)):
+            assert stored_pairs(db, length) == expected
+    finally:
+        convoy_service.READINGS_SLICE = slice_length
+        db.close()
+
+
+if __name__ == "__main__":
+    test_detector_pairs_match_brute_force()
+    test_run_does_not_depend_on_slice_length()
+    print("OK")
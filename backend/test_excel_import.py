@@ -0,0 +1,130 @@
+# test_excel_import.py
+"""
+Streaming Excel import
+
+Sheets are read in read-only mode in chunks of rows: the sheet is picked
+by its name, the header row is found below title rows, and every chunk is
+indexed by sheet row number, so row errors point at the row in Excel.
+Runs on an in-memory SQLite database:
+
+    python -m pytest test_excel_import.py
+    python test_excel_import.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import tempfile
+from datetime import date, datetime
+import openpyxl
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.utils import import_pipeline
+from app.utils.import_pipeline import iter_excel_chunks
+from app.utils.importer import TrafficLightImporter
+
+HEADER = ["Адрес", "Тип", "Статус", "Дата установки"]
+MAPPING = {"address": "Адрес", "type": "Тип", "status": "Статус", "install_date": "Дата установки"}
+
+# Sheet rows 4-10: row 6 has no address, row 8 an invalid date, row 9 is empty
+SHEET_ROWS = [
+    ["ул. Ленина, 1", "vehicular", "working", datetime(2020, 5, 1)],
+    ["ул. Ленина, 3", "pedestrian", None, "31.12.2020"],
+    [None, "vehicular", "working", datetime(2021, 1, 1)],
+    ["ул. Ленина, 1", "pedestrian", "outage", None],
+    ["пр. Гагарина, 2", "vehicular", "working", "не указана"],
+    [None, None, None, None],
+    ["пр. Гагарина, 2", None, "maintenance", datetime(2019, 7, 15)],
+]
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def write_workbook(path):
+    """A notes sheet first, then the data sheet with a title above the header"""
+    wb = openpyxl.Workbook()
+    wb.active.title = "Справка"
+    wb.active.append(["Адрес", "Тип", "Пояснение"])
+    sheet = wb.create_sheet("Светофоры 2024")
+    sheet.append(["Реестр светофоров"])
+    sheet.append([])
+    sheet.append(HEADER)
+    for row in SHEET_ROWS:
+        sheet.append(row)
+    wb.save(path)
+
+
+def test_sheet_is_streamed_in_chunks():
+    opened = []
+    load_workbook = openpyxl.load_workbook
+
+    def recording_load_workbook(*args, **kwargs):
+        opened.append(kwargs)
+        return load_workbook(*args, **kwargs)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lights.xlsx")
+        write_workbook(path)
+
+        openpyxl.load_workbook = recording_load_workbook
+        try:
+            chunks = list(iter_excel_chunks(path, None, ["адрес", "тип"], ["светофор"], chunk_size=3))
+        finally:
+            openpyxl.load_workbook = load_workbook
+
+    assert opened and opened[0]["read_only"]
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [list(chunk.index) for chunk in chunks] == [[4, 5, 6], [7, 8, 9], [10]]
+    assert all(list(chunk.columns) == HEADER for chunk in chunks)
+    assert chunks[0].loc[4, "Адрес"] == "ул. Ленина, 1"
+    assert chunks[2].loc[10, "Статус"] == "maintenance"
+
+
+def test_pick_sheet():
+    assert import_pipeline.pick_sheet(["Справка", "Светофоры 2024"], ["светофор"], []) == "Светофоры 2024"
+    # No sheet matches: the first one not excluded
+    assert import_pipeline.pick_sheet(["Пример", "Данные"], ["эвакуация"], ["пример"]) == "Данные"
+    assert import_pipeline.pick_sheet(["Пример"], ["эвакуация"], ["пример"]) == "Пример"
+
+
+def test_excel_import_reports_sheet_rows():
+    db = make_session()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lights.xlsx")
+            write_workbook(path)
+            result = TrafficLightImporter(db).import_traffic_lights(path, "excel", MAPPING)
+
+        assert (result["total_processed"], result["successful"], result["failed"]) == (7, 4, 2)
+        assert result["errors"] == ["Row 6: Missing address", "Row 8: Invalid install_date: не указана"]
+
+        lights = db.execute(
+            select(models.Location.address, models.TrafficLight.type, models.TrafficLight.status,
+                   models.TrafficLight.install_date)
+            .join(models.TrafficLight.location)
+        ).all()
+        assert sorted(lights) == [
+            ("пр. Гагарина, 2", "", "maintenance", date(2019, 7, 15)),
+            ("ул. Ленина, 1", "pedestrian", "outage", None),
+            ("ул. Ленина, 1", "vehicular", "working", date(2020, 5, 1)),
+            ("ул. Ленина, 3", "pedestrian", "working", date(2020, 12, 31)),
+        ]
+        # One location per address, rows with a failed value create none
+        assert len(db.execute(select(models.Location)).all()) == 3
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_sheet_is_streamed_in_chunks()
+    test_pick_sheet()
+    test_excel_import_reports_sheet_rows()
+    print("OK")
@@ -0,0 +1,310 @@
+# test_export.py
+"""
+Streaming exports
+
+Exports are produced from a server-side cursor a batch at a time: CSV as
+a header chunk and one chunk per batch, Excel through a write-only
+workbook. The query runs when the export is requested, so its errors
+surface before a response is started. Exported readings can be imported
+again. COPY output is regrouped into chunks of COPY_CHUNK_BYTES; with
+psycopg2 it is produced by a thread, which stops when the response is
+closed early and whose errors reach the response. Parquet and Arrow
+exports take their schema from the query's column types, so every batch
+has the same types even when a column is all NULL in the first one. Runs
+on an in-memory SQLite database (COPY with a fake cursor):
+
+    python -m pytest test_export.py
+    python test_export.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import io
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.utils import exporter as exporter_module
+from app.utils.exporter import DataExporter, PredefinedExports, copy_to_csv, _rechunk
+from app.utils.importer import VehicleTrackReadingImporter
+
+START = datetime(2024, 1, 1, 8, 0)
+
+
+class FakeCopyCursor:
+    """psycopg2-like cursor: copy_expert writes rows of COPY output into the file, without end unless rows is given"""
+
+    def __init__(self, rows=None, error=None):
+        self.rows = rows
+        self.error = error
+        self.written = 0
+        self.stopped_by = None
+        self.closed = False
+
+    def copy_expert(self, statement, file):
+        try:
+            for row in self.rows if self.rows is not None else iter(lambda: b"x" * 99 + b"\n", None):
+                file.write(row)
+                self.written += 1
+        except Exception as e:
+            self.stopped_by = e
+            raise
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def copy_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "export-copy"]
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def add_readings(db, count):
+    detectors = [
+        models.Detector(detector_id=f"00{i}", latitude=55.0 + i * 0.01, longitude=37.0 + i * 0.01)
+        for i in range(3)
+    ]
+    db.add_all(detectors)
+    db.flush()
+    db.add_all([
+        models.VehicleTrackReading(
+            detector_id=detectors[idx % 3].id, timestamp=START + timedelta(minutes=idx),
+            vehicle_identifier=f"V{idx % 4}", speed=40.0 + idx
+        )
+        for idx in range(count)
+    ])
+    db.commit()
+
+
+def readings_query():
+    return select(
+        models.VehicleTrackReading.vehicle_identifier, models.VehicleTrackReading.timestamp,
+        models.VehicleTrackReading.speed
+    ).order_by(models.VehicleTrackReading.timestamp)
+
+
+def test_csv_is_written_per_batch():
+    db = make_session()
+    try:
+        add_readings(db, 25)
+        exporter = DataExporter(db)
+
+        batches = exporter._query_batches(readings_query(), fetch_size=10)
+        chunks = list(exporter._csv_chunks(next(batches), batches))
+        assert len(chunks) == 4
+        assert chunks[0] == b"vehicle_identifier,timestamp,speed\n"
+        assert [chunk.count(b"\n") for chunk in chunks[1:]] == [10, 10, 5]
+
+        exported = pd.read_csv(io.BytesIO(b"".join(exporter.export_to_csv(readings_query()))))
+        assert len(exported) == 25
+        assert exported.iloc[0].tolist() == ["V0", "2024-01-01 08:00:00", 40.0]
+        assert exported.iloc[-1].tolist() == ["V0", "2024-01-01 08:24:00", 64.0]
+
+        # No rows: the header only
+        empty = exporter.export_to_csv(readings_query().where(models.VehicleTrackReading.speed < 0))
+        assert b"".join(empty) == b"vehicle_identifier,timestamp,speed\n"
+    finally:
+        db.close()
+
+
+def test_query_errors_surface_on_request():
+    db = make_session()
+    try:
+        exporter = DataExporter(db)
+        with pytest.raises(Exception, match="no such table"):
+            exporter.export_to_csv("SELECT * FROM missing_table")
+        with pytest.raises(Exception, match="no such table"):
+            exporter.export_to_excel("SELECT * FROM missing_table")
+    finally:
+        db.close()
+
+
+def test_excel_export():
+    db = make_session()
+    try:
+        add_readings(db, 3)
+        detector = uuid.uuid4()
+        rows = [
+            (detector, datetime(2024, 1, 1, 11, 0, tzinfo=timezone(timedelta(hours=3))), 1.5),
+            (None, None, 2.0),
+        ]
+
+        exporter = DataExporter(db)
+        workbook = openpyxl.load_workbook(io.BytesIO(b"".join(
+            exporter._excel_chunks(["detector", "at", "value"], iter([rows]), "Данные")
+        )))
+        sheet = workbook["Данные"]
+        assert [list(row) for row in sheet.iter_rows(values_only=True)] == [
+            ["detector", "at", "value"],
+            [str(detector), datetime(2024, 1, 1, 8, 0), 1.5],  # UUIDs as text, timestamps in UTC
+            [None, None, 2.0],
+        ]
+
+        workbook = openpyxl.load_workbook(io.BytesIO(b"".join(
+            exporter.export_to_excel(readings_query(), sheet_name="Прохождения ТС")
+        )))
+        assert [list(row) for row in workbook["Прохождения ТС"].iter_rows(values_only=True)] == [
+            ["vehicle_identifier", "timestamp", "speed"],
+            ["V0", START, 40.0],
+            ["V1", START + timedelta(minutes=1), 41.0],
+            ["V2", START + timedelta(minutes=2), 42.0],
+        ]
+    finally:
+        db.close()
+
+
+def test_exported_readings_import_again():
+    source = make_session()
+    target = make_session()
+    try:
+        add_readings(source, 12)
+        exported = b"".join(PredefinedExports(source).export_track_readings(
+            "csv", START + timedelta(minutes=2), START + timedelta(minutes=10)
+        ))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "readings.csv")
+            with open(path, "wb") as file:
+                file.write(exported)
+            result = VehicleTrackReadingImporter(target).import_from_csv(
+                path, VehicleTrackReadingImporter.DEFAULT_COLUMN_MAPPING
+            )
+        assert (result["inserted"], result["failed"]) == (8, 0)
+
+        imported = target.execute(
+            select(models.Detector.detector_id, models.VehicleTrackReading.timestamp,
+                   models.VehicleTrackReading.speed)
+            .join(models.Detector).order_by(models.VehicleTrackReading.timestamp)
+        ).all()
+        # Source detector IDs keep their leading zeros
+        assert [(detector, timestamp.replace(tzinfo=None), float(speed)) for detector, timestamp, speed in imported] == [
+            (f"00{idx % 3}", START + timedelta(minutes=idx), 40.0 + idx) for idx in range(2, 10)
+        ]
+    finally:
+        source.close()
+        target.close()
+
+
+def test_rechunk():
+    assert list(_rechunk([b"ab", b"cd", b"e", b"fghij", b"k"], size=4)) == [b"abcd", b"efghij", b"k"]
+    assert list(_rechunk([b"ab", b"c"], size=4)) == [b"abc"]
+    assert list(_rechunk([], size=4)) == []
+
+
+def test_copy_output_is_passed_through():
+    rows = [f"{idx},V{idx}\n".encode() for idx in range(20000)]
+    cursor = FakeCopyCursor(rows)
+    chunks = list(copy_to_csv(FakeConnection(cursor), "COPY (SELECT 1) TO STDOUT"))
+
+    assert b"".join(chunks) == b"".join(rows)
+    assert all(len(chunk) >= exporter_module.COPY_CHUNK_BYTES for chunk in chunks[:-1])
+    assert cursor.closed and not copy_threads()
+
+
+def test_closing_the_export_stops_the_copy():
+    cursor = FakeCopyCursor()  # endless output
+    chunks = copy_to_csv(FakeConnection(cursor), "COPY (SELECT 1) TO STDOUT")
+    assert next(chunks).startswith(b"x")
+
+    chunks.close()  # the client went away
+    assert isinstance(cursor.stopped_by, RuntimeError)
+    assert cursor.closed and not copy_threads()
+    # The bounded queue kept the thread from reading far ahead: the queued chunks,
+    # the one taken, the one waiting to be queued and the writer's buffer
+    queued_bytes = (exporter_module.COPY_QUEUE_SIZE + 3) * exporter_module.COPY_CHUNK_BYTES
+    assert cursor.written * 100 <= queued_bytes
+
+
+def test_copy_errors_reach_the_export():
+    cursor = FakeCopyCursor([b"1,V1\n", b"2,V2\n"], error=ValueError("canceling statement due to statement timeout"))
+    with pytest.raises(ValueError, match="statement timeout"):
+        list(copy_to_csv(FakeConnection(cursor), "COPY (SELECT 1) TO STDOUT"))
+    assert cursor.closed and not copy_threads()
+
+
+def test_arrow_types_do_not_depend_on_the_first_batch():
+    db = make_session()
+    row_group_size = exporter_module.PARQUET_ROW_GROUP_SIZE
+    exporter_module.PARQUET_ROW_GROUP_SIZE = 4
+    try:
+        add_readings(db, 10)
+        # No speed in the first batch
+        db.query(models.VehicleTrackReading).filter(
+            models.VehicleTrackReading.timestamp < START + timedelta(minutes=4)
+        ).update({"speed": None})
+        db.commit()
+
+        query = select(
+            models.VehicleTrackReading.detector_id, models.VehicleTrackReading.timestamp,
+            models.VehicleTrackReading.vehicle_identifier, models.VehicleTrackReading.speed
+        ).order_by(models.VehicleTrackReading.timestamp)
+        exporter = DataExporter(db)
+
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(exporter.export_to_parquet(query))))
+        stream = pa.ipc.open_stream(io.BytesIO(b"".join(exporter.export_to_arrow(query))))
+        schema = pa.schema([
+            # timestamp is a column with a time zone: UTC, also where SQLite returns naive values
+            ("detector_id", pa.string()), ("timestamp", pa.timestamp("us", tz="UTC")),
+            ("vehicle_identifier", pa.string()), ("speed", pa.float64())
+        ])
+        assert parquet.metadata.num_row_groups == 3
+        assert parquet.schema_arrow.remove_metadata() == schema
+        assert stream.schema.remove_metadata() == schema
+
+        batches = list(stream)
+        assert [batch.num_rows for batch in batches] == [4, 4, 2]
+        assert all(batch.schema == stream.schema for batch in batches)
+
+        expected = pd.read_sql(query, db.get_bind())
+        expected["detector_id"] = expected["detector_id"].map(str)
+        for table in (parquet.read(), pa.Table.from_batches(batches)):
+            frame = table.to_pandas()
+            assert frame["speed"].isna().tolist() == [True] * 4 + [False] * 6
+            assert frame["speed"].iloc[4:].tolist() == [40.0 + idx for idx in range(4, 10)]
+            assert frame["detector_id"].tolist() == expected["detector_id"].tolist()
+            assert frame["timestamp"].tolist() == [
+                pd.Timestamp(START + timedelta(minutes=idx), tz="UTC") for idx in range(10)
+            ]
+    finally:
+        exporter_module.PARQUET_ROW_GROUP_SIZE = row_group_size
+        db.close()
+
+
+if __name__ == "__main__":
+    test_csv_is_written_per_batch()
+    test_query_errors_surface_on_request()
+    test_excel_export()
+    test_exported_readings_import_again()
+    test_rechunk()
+    test_copy_output_is_passed_through()
+    test_closing_the_export_stops_the_copy()
+    test_copy_errors_reach_the_export()
+    test_arrow_types_do_not_depend_on_the_first_batch()
+    print("OK")
@@ -0,0 +1,136 @@
+# test_import_jobs.py
+"""
+Import job claiming and recovery
+
+A job is claimed by a conditional UPDATE, so a job queued twice runs once.
+Recovery settles only jobs whose owner process is gone - silent for
+IMPORT_JOB_STALE_SECONDS or a dead process on this host - and each of them
+once, whichever process gets there first. Runs on an in-memory SQLite
+database:
+
+    python -m pytest test_import_jobs.py
+    python test_import_jobs.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.config import settings
+from app.services import import_jobs
+from app.services.import_jobs import ImportJobService
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def add_job(db, status, owner, heartbeat_age=0, file_path="missing.csv"):
+    job = models.ImportJob(
+        model_type="fines", file_name="fines.csv", file_path=file_path, file_type="csv",
+        column_mapping="{}", mode="append", status=status, rows_processed=0, owner=owner,
+        heartbeat_at=datetime.now(timezone.utc) - timedelta(seconds=heartbeat_age)
+    )
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def test_job_runs_once():
+    db = make_session()
+    try:
+        service = ImportJobService(db)
+        job_id = add_job(db, "pending", import_jobs.OWNER)
+
+        # The upload is missing: the job fails inside run()
+        service.run(job_id)
+        job = db.get(models.ImportJob, job_id)
+        assert job.status == "failed" and job.started_at is not None
+        finished_at = job.finished_at
+
+        # Queued again (e.g. by two recovering processes): not claimed, left as is
+        service.run(job_id)
+        db.refresh(job)
+        assert (job.status, job.finished_at) == ("failed", finished_at)
+
+        running_id = add_job(db, "running", import_jobs.OWNER)
+        service.run(running_id)
+        assert db.get(models.ImportJob, running_id).status == "running"
+    finally:
+        db.close()
+
+
+def test_recovery_settles_only_orphaned_jobs():
+    db = make_session()
+    host = socket.gethostname()
+    stale = settings.IMPORT_JOB_STALE_SECONDS + 60
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as upload:
+            upload_path = upload.name
+
+        service = ImportJobService(db)
+        own = add_job(db, "running", import_jobs.OWNER)
+        other_host = add_job(db, "running", "elsewhere:1234:abcdef01")
+        live_here = add_job(db, "pending", f"{host}:{os.getpid()}:0000beef", file_path=upload_path)
+        dead_here = add_job(db, "pending", f"{host}:{dead_pid()}:0000dead", file_path=upload_path)
+        silent = add_job(db, "running", "elsewhere:1234:abcdef01", heartbeat_age=stale)
+        lost_upload = add_job(db, "pending", "elsewhere:1234:abcdef01", heartbeat_age=stale)
+
+        assert service.recover_orphaned_jobs() == [dead_here]
+        # The resubmitted job now belongs to this process; a second pass finds nothing
+        assert db.get(models.ImportJob, dead_here).owner == import_jobs.OWNER
+        assert service.recover_orphaned_jobs() == []
+
+        statuses = {job_id: db.get(models.ImportJob, job_id).status for job_id in
+                    (own, other_host, live_here, dead_here, silent, lost_upload)}
+        assert statuses == {
+            own: "running", other_host: "running", live_here: "pending",
+            dead_here: "pending", silent: "failed", lost_upload: "failed"
+        }
+        assert os.path.exists(upload_path)
+
+        # Heartbeats keep this process's jobs from going stale
+        assert service.touch_owned_jobs() == 2
+    finally:
+        db.close()
+        os.remove(upload_path)
+
+
+def test_orphaned_job_is_taken_over_once():
+    db = make_session()
+    try:
+        job_id = add_job(db, "pending", "elsewhere:1234:abcdef01", heartbeat_age=settings.IMPORT_JOB_STALE_SECONDS + 60)
+        first, second = ImportJobService(db), ImportJobService(db)
+        # Both processes saw the job before either took it over
+        job = db.get(models.ImportJob, job_id)
+        seen = models.ImportJob(id=job.id, status=job.status, owner=job.owner, heartbeat_at=job.heartbeat_at)
+
+        assert first._take_over(job)
+        assert not second._take_over(seen)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_job_runs_once()
+    test_recovery_settles_only_orphaned_jobs()
+    test_orphaned_job_is_taken_over_once()
+    print("OK")
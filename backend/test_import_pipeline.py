@@ -0,0 +1,126 @@
+# test_import_pipeline.py
+"""
+Declarative import pipeline
+
+convert_chunk converts a chunk column by column: empty values take the
+column default, a missing required value or a value that cannot be
+converted fails its row, reported by file row number. An import fills
+foreign keys by get-or-create (one referenced row per key, existing rows
+reused) and sets the spec constants. Runs on an in-memory SQLite database:
+
+    python -m pytest test_import_pipeline.py
+    python test_import_pipeline.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import tempfile
+from datetime import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.utils.import_pipeline import convert_chunk
+from app.utils.importer import ACCIDENT_SPEC, FINE_SPEC, FineImporter
+
+MAPPING = {
+    "plate_number": "Госномер", "address": "Адрес", "issued_at": "Дата",
+    "amount": "Сумма", "violation_code": "Статья",
+}
+
+# File lines 2-7: line 4 has no plate, line 6 an invalid date and amount
+FILE_ROWS = pd.DataFrame({
+    "Госномер": ["А001АА67", "В002ВВ67", "", "А001АА67", "С003СС67", "В002ВВ67"],
+    "Адрес": ["ул. Ленина, 1", "ул. Ленина, 1", "ул. Ленина, 3", "пр. Гагарина, 2", "ул. Ленина, 3", "ул. Ленина, 3"],
+    "Дата": ["01.03.2024 10:00", "01.03.2024 11:30", "02.03.2024 09:00", "05.03.2024 18:15", "31.02.2024", "07.03.2024 08:00"],
+    "Сумма": ["500", "1 500,50", "500", "", "много", "3000"],
+    "Статья": ["12.9", "12.16", "12.9", "12.12", "12.9", ""],
+})
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_convert_chunk():
+    chunk = pd.DataFrame({
+        "address": ["ул. Ленина, 1", "  ", "пр. Гагарина, 2", "ул. Ленина, 3"],
+        "occurred_at": ["2024-03-01 10:00:00", "2024-03-01 11:00:00", "вчера", "2024-03-02 12:00:00"],
+        "casualties": ["2", "1", "0", None],
+    }, index=range(10, 14))
+
+    frame, errors = convert_chunk(ACCIDENT_SPEC, chunk)
+
+    assert errors == ["Row 11: Missing address", "Row 12: Invalid occurred_at: вчера"]
+    assert list(frame.index) == [10, 13]
+    assert frame["occurred_at"].tolist() == [datetime(2024, 3, 1, 10), datetime(2024, 3, 2, 12)]
+    # Columns missing from the file and empty values take the defaults
+    assert frame["accident_type"].tolist() == ["", ""]
+    assert frame["severity"].tolist() == ["minor", "minor"]
+    assert frame["casualties"].tolist() == [2, 0]
+
+
+def test_csv_import_creates_referenced_rows_once():
+    db = make_session()
+    try:
+        existing = models.Vehicle(plate_number="С003СС67", type="truck")
+        db.add(existing)
+        db.commit()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "fines.csv")
+            FILE_ROWS.to_csv(path, index=False)
+            result = FineImporter(db).import_fines(path, "csv", MAPPING)
+
+        assert (result["total_processed"], result["successful"], result["failed"]) == (6, 4, 2)
+        assert result["errors"] == [
+            "Row 4: Missing plate_number", "Row 6: Invalid issued_at: 31.02.2024"
+        ]
+
+        fines = db.execute(
+            select(models.Vehicle.plate_number, models.Location.address, models.Fine.issued_at,
+                   models.Fine.amount, models.Fine.violation_code, models.Fine.status, models.Fine.visibility)
+            .join(models.Vehicle, models.Fine.vehicle_id == models.Vehicle.id)
+            .join(models.Location, models.Fine.location_id == models.Location.id)
+            .order_by(models.Fine.issued_at)
+        ).all()
+        assert [(plate, address, issued_at.replace(tzinfo=None), float(amount), code, status, visibility)
+                for plate, address, issued_at, amount, code, status, visibility in fines] == [
+            ("А001АА67", "ул. Ленина, 1", datetime(2024, 3, 1, 10, 0), 500.0, "12.9", "issued", "private"),
+            ("В002ВВ67", "ул. Ленина, 1", datetime(2024, 3, 1, 11, 30), 1500.5, "12.16", "issued", "private"),
+            ("А001АА67", "пр. Гагарина, 2", datetime(2024, 3, 5, 18, 15), 0.0, "12.12", "issued", "private"),
+            ("В002ВВ67", "ул. Ленина, 3", datetime(2024, 3, 7, 8, 0), 3000.0, "", "issued", "private"),
+        ]
+
+        # A failed row creates no referenced rows; new vehicles get the default type
+        vehicles = dict(db.execute(select(models.Vehicle.plate_number, models.Vehicle.type)).all())
+        assert vehicles == {"А001АА67": "car", "В002ВВ67": "car", "С003СС67": "truck"}
+        addresses = db.execute(select(models.Location.address)).scalars().all()
+        assert sorted(addresses) == ["пр. Гагарина, 2", "ул. Ленина, 1", "ул. Ленина, 3"]
+    finally:
+        db.close()
+
+
+def test_unsupported_modes():
+    db = make_session()
+    try:
+        with pytest.raises(Exception, match="Unsupported import mode"):
+            FineImporter(db).import_spec(FINE_SPEC, "missing.csv", "csv", MAPPING, mode="replace")
+        with pytest.raises(Exception, match="require PostgreSQL"):
+            FineImporter(db).import_spec(FINE_SPEC, "missing.csv", "csv", MAPPING, mode="upsert")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_convert_chunk()
+    test_csv_import_creates_referenced_rows_once()
+    test_unsupported_modes()
+    print("OK")
@@ -0,0 +1,212 @@
+# test_parallel_import.py
+"""
+Parallel chunked imports and compact dictionary codes
+
+On PostgreSQL a file of more than one chunk is imported by worker
+processes, each through its own connection: the result must be the one of
+a sequential import, with every detector, vehicle and location created
+once however many workers meet it. Compact storage codes are created with
+INSERT ... ON CONFLICT DO NOTHING, so a value another import inserted
+after the lookup resolves to its stored code instead of failing.
+
+The dictionary codes are checked on an in-memory SQLite database as well.
+Workers connect through app.database, so the parallel imports run only
+when DATABASE_URL points at the PostgreSQL database of TEST_POSTGRES_URL
+(its tables are dropped and recreated):
+
+    python -m pytest test_parallel_import.py
+    DATABASE_URL=postgresql+psycopg2://user@/test TEST_POSTGRES_URL=postgresql+psycopg2://user@/test \\
+        python -m pytest test_parallel_import.py
+    python test_parallel_import.py
+"""
+import os
+
+# app.database builds its engine at import time; worker processes use that engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import tempfile
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.config import settings
+from app.database import Base, engine
+from app import models
+from app.services.partition_manager import ensure_default_partition
+from app.services.track_storage import TrackStorage
+from app.utils.import_pipeline import IMPORT_CHUNK_SIZE
+from app.utils.importer import FineImporter, VehicleTrackReadingImporter
+
+START = datetime(2024, 3, 1, 8, 0)
+
+
+class StaleLookupStorage(TrackStorage):
+    """Storage whose first code lookup misses: the values are inserted concurrently after it"""
+
+    def __init__(self, mode):
+        super().__init__(mode)
+        self.stale = True
+
+    def _lookup_codes(self, db, key_column, code_column, keys):
+        if self.stale:
+            self.stale = False
+            return {}
+        return super()._lookup_codes(db, key_column, code_column, keys)
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def postgres_session():
+    """Session on TEST_POSTGRES_URL with freshly created tables (skips the test without it)"""
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    test_engine = create_engine(url)
+    Base.metadata.drop_all(test_engine)
+    Base.metadata.create_all(test_engine)
+    db = sessionmaker(bind=test_engine)()
+    for storage in (TrackStorage("standard"), TrackStorage("compact")):
+        ensure_default_partition(db, storage.table_name)
+    db.commit()
+    return db
+
+
+def parallel_session():
+    """PostgreSQL session for imports with two workers (skips the test unless DATABASE_URL is that database)"""
+    db = postgres_session()
+    if engine.url.render_as_string(hide_password=False) != db.get_bind().url.render_as_string(hide_password=False):
+        db.close()
+        pytest.skip("DATABASE_URL does not point at TEST_POSTGRES_URL")
+    return db
+
+
+def check_codes(db):
+    storage = TrackStorage("compact")
+    codes = storage._get_or_create_codes(
+        db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, ["A001", "A002"]
+    )
+    assert sorted(codes) == ["A001", "A002"] and len(set(codes.values())) == 2
+
+    # Stored values keep their codes, new ones get new codes
+    again = storage._get_or_create_codes(
+        db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, ["A002", "A003"]
+    )
+    assert again["A002"] == codes["A002"] and again["A003"] not in codes.values()
+
+    # A value inserted after the lookup (by another import) resolves to its stored code
+    stale = StaleLookupStorage("compact")
+    inserted = stale._get_or_create_codes(
+        db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, ["A001", "A004"]
+    )
+    assert inserted["A001"] == codes["A001"]
+    stored = dict(db.execute(select(models.VehicleDict.vehicle_identifier, models.VehicleDict.id)).all())
+    assert stored == {**codes, **again, **inserted}
+    db.commit()
+
+
+def test_codes_round_trip_postgres():
+    db = postgres_session()
+    try:
+        check_codes(db)
+    finally:
+        db.close()
+
+
+def test_codes_round_trip_sqlite():
+    db = make_session()
+    try:
+        # SQLite has no concurrent imports: the stale lookup is not covered there
+        storage = TrackStorage("compact")
+        codes = storage._get_or_create_codes(
+            db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, ["A001", "A002"]
+        )
+        again = storage._get_or_create_codes(
+            db, models.VehicleDict, models.VehicleDict.vehicle_identifier, models.VehicleDict.id, ["A002", "A003"]
+        )
+        assert again["A002"] == codes["A002"] and again["A003"] not in codes.values()
+        assert db.execute(select(func.count()).select_from(models.VehicleDict)).scalar() == 3
+    finally:
+        db.close()
+
+
+def test_parallel_reading_import():
+    db = parallel_session()
+    workers = settings.IMPORT_PARALLEL_WORKERS
+    settings.IMPORT_PARALLEL_WORKERS = 2
+    try:
+        # 40 rows in 4 chunks; every chunk meets every detector
+        frame = pd.DataFrame({
+            "ID_детектора": [f"D{idx % 5}" for idx in range(40)],
+            "Временная_метка": [(START + timedelta(minutes=idx)).isoformat(sep=" ") for idx in range(40)],
+            "Идентификатор_ТС": [f"V{idx % 7}" for idx in range(40)],
+            "Скорость_прохождения": [40.0 + idx for idx in range(40)],
+        })
+        frame.loc[13, "Временная_метка"] = "not a time"
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "readings.csv")
+            frame.to_csv(path, index=False)
+            importer = VehicleTrackReadingImporter(db)
+            mapping = VehicleTrackReadingImporter.DEFAULT_COLUMN_MAPPING
+
+            result = importer.import_from_csv(path, mapping, chunk_size=10)
+            assert (result["total_processed"], result["successful"], result["failed"]) == (40, 39, 1)
+            assert result["errors"] == ["Row 13: Invalid timestamp: not a time"]
+
+            again = importer.import_from_csv(path, mapping, chunk_size=10)
+            assert (again["inserted"], again["skipped"]) == (0, 39)
+
+        detectors = db.execute(select(models.Detector.detector_id)).scalars().all()
+        assert sorted(detectors) == [f"D{idx}" for idx in range(5)]
+        assert db.execute(select(func.count()).select_from(models.VehicleTrackReading)).scalar() == 39
+    finally:
+        settings.IMPORT_PARALLEL_WORKERS = workers
+        db.close()
+
+
+def test_parallel_spec_import():
+    db = parallel_session()
+    workers = settings.IMPORT_PARALLEL_WORKERS
+    settings.IMPORT_PARALLEL_WORKERS = 2
+    try:
+        # A full chunk and five rows; the second chunk repeats plates and addresses of the first
+        count = IMPORT_CHUNK_SIZE + 5
+        frame = pd.DataFrame({
+            "plate_number": [f"P{idx % 50:03d}" for idx in range(count)],
+            "address": [f"ул. Ленина, {idx % 20}" for idx in range(count)],
+            "issued_at": [(START + timedelta(minutes=idx)).strftime("%d.%m.%Y %H:%M") for idx in range(count)],
+            "amount": ["500"] * count,
+        })
+        frame.loc[IMPORT_CHUNK_SIZE + 2, "amount"] = "много"
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "fines.csv")
+            frame.to_csv(path, index=False)
+            result = FineImporter(db).import_fines(path, "csv", {})
+
+        assert (result["total_processed"], result["successful"], result["failed"]) == (count, count - 1, 1)
+        assert result["errors"] == [f"Row {IMPORT_CHUNK_SIZE + 4}: Invalid amount: много"]
+
+        assert db.execute(select(func.count()).select_from(models.Fine)).scalar() == count - 1
+        assert db.execute(select(func.count()).select_from(models.Vehicle)).scalar() == 50
+        assert db.execute(select(func.count()).select_from(models.Location)).scalar() == 20
+        first = db.execute(select(func.min(models.Fine.issued_at), func.max(models.Fine.issued_at))).one()
+        assert [stamp.replace(tzinfo=None) for stamp in first] == [START, START + timedelta(minutes=count - 1)]
+    finally:
+        settings.IMPORT_PARALLEL_WORKERS = workers
+        db.close()
+
+
+if __name__ == "__main__":
+    test_codes_round_trip_sqlite()
+    if os.environ.get("TEST_POSTGRES_URL"):
+        test_codes_round_trip_postgres()
+        test_parallel_reading_import()
+        test_parallel_spec_import()
+    print("OK")
@@ -0,0 +1,107 @@
+# test_route_similarity.py
+"""
+Approximate route clustering (MinHash/LSH + LCS)
+
+The bit-parallel LCS must agree with the dynamic-programming definition,
+MinHash signatures must estimate the Jaccard similarity of the shingle
+sets, and cluster_sequences must merge routes that differ by a missed
+detection while keeping different routes apart. Runs without a database:
+
+    python -m pytest test_route_similarity.py
+    python test_route_similarity.py
+"""
+import os
+
+# app.database builds its engine at import time
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import random
+import numpy as np
+from app.services.route_similarity import (
+    NUM_PERMUTATIONS, SHINGLE_SIZE, cluster_sequences, lcs_length, minhash_signatures, sequence_similarity
+)
+
+
+def dp_lcs_length(first, second):
+    previous = [0] * (len(second) + 1)
+    for token in first:
+        current = [0]
+        for idx, other in enumerate(second):
+            current.append(previous[idx] + 1 if token == other else max(previous[idx + 1], current[idx]))
+        previous = current
+    return previous[-1]
+
+
+def test_lcs_matches_dynamic_programming():
+    generator = random.Random(8)
+    for _ in range(300):
+        first = [generator.randrange(6) for _ in range(generator.randrange(0, 90))]
+        second = [generator.randrange(6) for _ in range(generator.randrange(0, 90))]
+        assert lcs_length(first, second) == dp_lcs_length(first, second)
+
+    assert sequence_similarity([], []) == 1.0
+    assert sequence_similarity([1, 2, 3, 4], [1, 2, 4]) == 0.75
+
+
+def test_minhash_estimates_jaccard_similarity():
+    generator = np.random.default_rng(8)
+    base = generator.permutation(400)[:60]
+    # Same route with the last 15 detectors replaced
+    variant = np.r_[base[:45], generator.permutation(np.arange(400, 500))[:15]]
+    signatures = minhash_signatures([base, variant, base.copy()])
+
+    def shingles(sequence):
+        return {tuple(sequence[idx:idx + SHINGLE_SIZE]) for idx in range(len(sequence) - SHINGLE_SIZE + 1)}
+
+    jaccard = len(shingles(base) & shingles(variant)) / len(shingles(base) | shingles(variant))
+    estimate = np.mean(signatures[0] == signatures[1])
+    assert signatures.shape == (3, NUM_PERMUTATIONS)
+    assert abs(estimate - jaccard) < 0.2
+    assert (signatures[0] == signatures[2]).all()
+
+
+def test_cluster_sequences_merges_missed_detections():
+    generator = random.Random(8)
+    routes = [generator.sample(range(200), 12) for _ in range(5)]
+
+    sequences, weights, expected = [], [], []
+    for route_idx, route in enumerate(routes):
+        # The full route travelled by most vehicles, variants miss one detector
+        sequences.append(np.array(route))
+        weights.append(20)
+        expected.append(route_idx)
+        for missed in generator.sample(range(len(route)), 4):
+            sequences.append(np.array(route[:missed] + route[missed + 1:]))
+            weights.append(1)
+            expected.append(route_idx)
+
+    labels, medoids = cluster_sequences(sequences, weights, similarity_threshold=0.8)
+
+    assert len(medoids) == len(routes)
+    for route_idx in range(len(routes)):
+        members = {label for label, route in zip(labels.tolist(), expected) if route == route_idx}
+        assert len(members) == 1
+        # The medoid is the full route, not one of the variants
+        assert sequences[medoids[members.pop()]].tolist() == routes[route_idx]
+
+
+def test_cluster_sequences_respects_threshold():
+    # LCS similarity 0.9; similar enough to be an LSH candidate with near certainty
+    route = list(range(30))
+    sequences = [np.array(route), np.array(route[:27] + [50, 51, 52])]
+
+    labels, _ = cluster_sequences(sequences, [1, 1], similarity_threshold=0.95)
+    assert labels[0] != labels[1]
+    labels, _ = cluster_sequences(sequences, [1, 1], similarity_threshold=0.9)
+    assert labels[0] == labels[1]
+
+    labels, medoids = cluster_sequences([], [])
+    assert len(labels) == 0 and medoids == {}
+
+
+if __name__ == "__main__":
+    test_lcs_matches_dynamic_programming()
+    test_minhash_estimates_jaccard_similarity()
+    test_cluster_sequences_merges_missed_detections()
+    test_cluster_sequences_respects_threshold()
+    print("OK")
@@ -0,0 +1,137 @@
+# test_track_import.py
+"""
+Chunked CSV, Parquet and Arrow import of detector readings
+
+Every reader of VehicleTrackReadingImporter must store the same readings
+from the same data, whatever the chunk size: IDs keep their leading zeros,
+new detectors get the coordinates from detector_coords, invalid timestamps
+become row errors, and importing the file again inserts nothing. The
+import queues a route stats refresh for the period it loaded. Runs on an
+in-memory SQLite database:
+
+    python -m pytest test_track_import.py
+    python test_track_import.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import tempfile
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.utils.importer import VehicleTrackReadingImporter
+
+MAPPING = VehicleTrackReadingImporter.DEFAULT_COLUMN_MAPPING
+COORDS = {"007": (55.5, 37.5)}
+
+# File rows: the fourth has an invalid timestamp, the last has no speed
+FILE_ROWS = pd.DataFrame({
+    "ID_детектора": ["007", "007", "12", "12", "007", "12", "0012"],
+    "Временная_метка": [
+        "2024-01-01 08:00:00", "2024-01-01 08:05:00", "2024-01-01 08:01:00", "not a time",
+        "2024-01-01 09:00:00", "2024-01-01 09:30:00", "2024-01-01 10:00:00"
+    ],
+    "Идентификатор_ТС": ["A001", "A002", "A001", "A002", "A001", "A002", "0042"],
+    "Скорость_прохождения": [40.5, 52.0, 38.25, 41.0, 60.0, 45.0, None],
+})
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def write_file(directory, file_type):
+    path = os.path.join(directory, f"readings.{file_type}")
+    if file_type == "csv":
+        FILE_ROWS.to_csv(path, index=False)
+        return path
+
+    table = pa.Table.from_pandas(FILE_ROWS, preserve_index=False)
+    if file_type == "parquet":
+        pq.write_table(table, path, row_group_size=3)
+    elif file_type == "arrow":
+        with pa.ipc.new_file(path, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=3):
+                writer.write_batch(batch)
+    else:
+        with pa.ipc.new_stream(path, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=3):
+                writer.write_batch(batch)
+    return path
+
+
+def import_file(db, path, file_type):
+    importer = VehicleTrackReadingImporter(db)
+    if file_type == "csv":
+        return importer.import_from_csv(path, MAPPING, COORDS, chunk_size=3)
+    if file_type == "parquet":
+        return importer.import_from_parquet(path, MAPPING, COORDS, chunk_size=3)
+    return importer.import_from_arrow(path, MAPPING, COORDS)
+
+
+def stored_readings(db):
+    rows = db.execute(
+        select(
+            models.Detector.detector_id,
+            models.VehicleTrackReading.timestamp,
+            models.VehicleTrackReading.vehicle_identifier,
+            models.VehicleTrackReading.speed
+        ).join(models.Detector).order_by(models.VehicleTrackReading.timestamp)
+    ).all()
+    return [
+        (detector_id, timestamp.replace(tzinfo=None), vehicle, None if speed is None else float(speed))
+        for detector_id, timestamp, vehicle, speed in rows
+    ]
+
+
+def check_import(file_type):
+    db = make_session()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_file(directory, file_type)
+            result = import_file(db, path, file_type)
+
+            assert (result["total_processed"], result["successful"], result["failed"]) == (7, 6, 1)
+            assert result["errors"] == ["Row 3: Invalid timestamp: not a time"]
+            assert (result["inserted"], result["skipped"]) == (6, 0)
+
+            readings = stored_readings(db)
+            assert readings[0] == ("007", datetime(2024, 1, 1, 8, 0), "A001", 40.5)
+            assert readings[-1] == ("0012", datetime(2024, 1, 1, 10, 0), "0042", None)
+            assert {detector for detector, _, _, _ in readings} == {"007", "12", "0012"}
+
+            detector = db.execute(select(models.Detector).where(models.Detector.detector_id == "007")).scalar_one()
+            assert (float(detector.latitude), float(detector.longitude)) == COORDS["007"]
+
+            refresh = db.execute(select(models.RouteStatsRefresh)).scalar_one()
+            assert (refresh.start_time.replace(tzinfo=None), refresh.end_time.replace(tzinfo=None)) == (
+                datetime(2024, 1, 1, 8, 0), datetime(2024, 1, 1, 10, 0)
+            )
+
+            again = import_file(db, path, file_type)
+            assert (again["inserted"], again["skipped"]) == (0, 6)
+            assert stored_readings(db) == readings
+            return readings
+    finally:
+        db.close()
+
+
+def test_readers_store_the_same_readings():
+    readings = check_import("csv")
+    for file_type in ("parquet", "arrow", "stream"):
+        assert check_import(file_type) == readings
+
+
+if __name__ == "__main__":
+    test_readers_store_the_same_readings()
+    print("OK")
@@ -0,0 +1,148 @@
+# test_traffic_analysis_queries.py
+"""
+Query count of track reads in TrafficAnalysisService
+
+cluster_routes and get_vehicle_track must issue a fixed number of SQL
+statements, independent of the number of vehicles (no per-vehicle or
+per-reading queries). Readings at a detector added after the detector
+table was cached must not be dropped. Runs on an in-memory SQLite database:
+
+    python -m pytest test_traffic_analysis_queries.py
+    python test_traffic_analysis_queries.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.services.tracks import get_detector_table, invalidate_detector_table
+from app.services.traffic_analysis_service import TrafficAnalysisService
+
+DAY_START = datetime(2024, 1, 1)
+DAY_END = datetime(2024, 1, 2)
+
+
+def make_session(vehicles_count):
+    """SQLite session with 10 detectors and vehicles_count vehicles, 5 readings each"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    detectors = [
+        models.Detector(detector_id=f"D{i:02d}", latitude=55.0 + i * 0.01, longitude=37.0 + i * 0.01)
+        for i in range(10)
+    ]
+    db.add_all(detectors)
+    db.flush()
+
+    for vehicle in range(vehicles_count):
+        start = DAY_START + timedelta(hours=8, minutes=vehicle)
+        db.add_all([
+            models.VehicleTrackReading(
+                detector_id=detectors[(vehicle + step) % len(detectors)].id,
+                timestamp=start + timedelta(minutes=2 * step),
+                vehicle_identifier=f"V{vehicle}",
+                speed=40.0
+            )
+            for step in range(5)
+        ])
+    db.commit()
+    return engine, db
+
+
+def count_statements(engine, action):
+    """Number of SQL statements executed by action()"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        action()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+def query_counts(vehicles_count):
+    engine, db = make_session(vehicles_count)
+    try:
+        # Detector table is cached per process: load it for this database before counting
+        invalidate_detector_table()
+        get_detector_table(db)
+        service = TrafficAnalysisService(db)
+
+        clusters = []
+        cluster_queries = count_statements(
+            engine, lambda: clusters.extend(service.cluster_routes(DAY_START, DAY_END, min_vehicles_per_route=1))
+        )
+        assert clusters
+
+        track = []
+        track_queries = count_statements(engine, lambda: track.extend(service.get_vehicle_track("V0")))
+        assert len(track) == 5
+
+        return cluster_queries, track_queries
+    finally:
+        db.close()
+        invalidate_detector_table()
+
+
+def test_cluster_routes_and_vehicle_track_query_count():
+    # One streamed readings query each, whatever the number of vehicles
+    assert query_counts(5) == (1, 1)
+    assert query_counts(50) == (1, 1)
+
+
+def add_reading_at_new_detector(db, external_id, hour):
+    detector = models.Detector(detector_id=external_id, latitude=55.5, longitude=37.5)
+    db.add(detector)
+    db.flush()
+    db.add(models.VehicleTrackReading(
+        detector_id=detector.id, timestamp=DAY_START + timedelta(hours=hour),
+        vehicle_identifier="V0", speed=40.0
+    ))
+    db.commit()
+
+
+def test_detector_added_after_caching_is_reloaded():
+    engine, db = make_session(1)
+    try:
+        invalidate_detector_table()
+        cached = get_detector_table(db)
+
+        # The process cache only re-checks the table every DETECTOR_TABLE_CHECK_SECONDS
+        add_reading_at_new_detector(db, "D10", 9)
+        assert get_detector_table(db) is cached
+
+        # Streamed tracks (one per vehicle)
+        service = TrafficAnalysisService(db)
+        routes = service.cluster_routes(DAY_START, DAY_END, min_vehicles_per_route=1)
+        assert [point["detector_id"] for point in routes[0]["coordinates"]][-1] == "D10"
+        assert len(routes[0]["coordinates"]) == 6
+        # Ordinals of the cached detectors are kept, the new one is appended
+        assert service.detectors.ids[:len(cached)] == cached.ids
+        assert len(get_detector_table(db)) == len(cached) + 1
+
+        # Tracks built in memory
+        cached = get_detector_table(db)
+        add_reading_at_new_detector(db, "D11", 10)
+        track = TrafficAnalysisService(db).get_vehicle_track("V0")
+        assert [reading["detector_external_id"] for reading in track][-2:] == ["D10", "D11"]
+        assert len(get_detector_table(db)) == len(cached) + 1
+    finally:
+        db.close()
+        invalidate_detector_table()
+
+
+if __name__ == "__main__":
+    test_cluster_routes_and_vehicle_track_query_count()
+    test_detector_added_after_caching_is_reloaded()
+    print("OK")
@@ -0,0 +1,107 @@
+# test_trip_segmentation.py
+"""
+Idempotent trip segmentation
+
+Segmenting a period in overlapping or adjacent windows, or the same window
+twice, must store the same trips as segmenting the whole period at once:
+window edges are not trip boundaries. Runs on an in-memory SQLite database:
+
+    python -m pytest test_trip_segmentation.py
+    python test_trip_segmentation.py
+"""
+import os
+
+# app.database builds its engine at import time; the test uses its own SQLite engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models
+from app.services.road_graph import invalidate_road_graph
+from app.services.tracks import invalidate_detector_table
+from app.services.trip_service import TripSegmentationService
+
+PERIOD_START = datetime(2024, 1, 1)
+PERIOD_END = datetime(2024, 1, 4)
+DWELL_GAP_SECONDS = 1800
+
+
+def make_session():
+    """SQLite session with 20 vehicles driving 3 days; sessions cross midnight and window edges"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    detectors = [
+        models.Detector(detector_id=f"D{i:02d}", latitude=55.0 + i * 0.01, longitude=37.0 + i * 0.01)
+        for i in range(15)
+    ]
+    db.add_all(detectors)
+    db.flush()
+
+    generator = random.Random(9)
+    for vehicle in range(20):
+        timestamp = PERIOD_START + timedelta(minutes=generator.randint(0, 600))
+        while timestamp < PERIOD_END:
+            # Stop longer than the dwell gap, then a drive of up to 40 readings
+            for _ in range(generator.randint(2, 40)):
+                db.add(models.VehicleTrackReading(
+                    detector_id=generator.choice(detectors).id,
+                    timestamp=timestamp,
+                    vehicle_identifier=f"V{vehicle}",
+                    speed=40.0
+                ))
+                timestamp += timedelta(seconds=generator.randint(60, 1500))
+            timestamp += timedelta(seconds=generator.randint(DWELL_GAP_SECONDS + 60, 6 * 3600))
+    db.commit()
+    return db
+
+
+def stored_trips(db):
+    return sorted(
+        (trip.vehicle_identifier, trip.start_time, trip.end_time, trip.detector_sequence, trip.end_reason)
+        for trip in db.query(models.Trip)
+    )
+
+
+def segment_windows(db, windows):
+    db.execute(delete(models.Trip))
+    db.commit()
+    service = TripSegmentationService(db)
+    for start, end in windows:
+        service.segment(start, end, dwell_gap_seconds=DWELL_GAP_SECONDS, max_speed_kmh=1000)
+    return stored_trips(db)
+
+
+def test_segmentation_is_idempotent_across_windows():
+    invalidate_detector_table()
+    invalidate_road_graph()
+    db = make_session()
+    try:
+        expected = segment_windows(db, [(PERIOD_START, PERIOD_END)])
+        assert expected
+
+        # The same window twice
+        assert segment_windows(db, [(PERIOD_START, PERIOD_END)] * 2) == expected
+
+        # Adjacent windows (step edges fall inside sessions)
+        hours = [PERIOD_START + timedelta(hours=7 * step) for step in range(12)]
+        adjacent = [(start, end - timedelta(microseconds=1)) for start, end in zip(hours, hours[1:] + [PERIOD_END])]
+        assert segment_windows(db, adjacent) == expected
+
+        # Overlapping windows, in reverse order, then repeated
+        overlapping = [(start, start + timedelta(hours=10)) for start in reversed(hours)]
+        assert segment_windows(db, overlapping + overlapping) == expected
+    finally:
+        db.close()
+        invalidate_detector_table()
+        invalidate_road_graph()
+
+
+if __name__ == "__main__":
+    test_segmentation_is_idempotent_across_windows()
+    print("OK")
@@ -0,0 +1,140 @@
+# test_upsert_import.py
+"""
+Upsert and append imports of fines
+
+Fines, accidents and evacuations may share their natural key, so the
+tables have no unique index on it: append inserts every row, and only an
+upsert merges rows by the key. Of rows repeated in one file the last one
+is taken, a stored row is updated only when a value changed, and
+importing the same file again changes nothing. An address stored twice
+resolves to one location, so no row is merged twice.
+
+Upserts stage the file through app.database, so the test runs only when
+DATABASE_URL points at the PostgreSQL database of TEST_POSTGRES_URL (its
+tables are dropped and recreated):
+
+    DATABASE_URL=postgresql+psycopg2://user@/test TEST_POSTGRES_URL=postgresql+psycopg2://user@/test \\
+        python -m pytest test_upsert_import.py
+    python test_upsert_import.py
+"""
+import os
+
+# app.database builds its engine at import time; the staging COPY uses that engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import tempfile
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from app.config import settings
+from app.database import Base, engine
+from app import models
+from app.utils.importer import FineImporter
+
+MAPPING = {"plate_number": "Госномер", "address": "Адрес", "issued_at": "Дата", "amount": "Сумма", "violation_code": "Статья"}
+
+# File lines 2-5; line 4 repeats the key of line 2 with another amount
+FILE_ROWS = pd.DataFrame({
+    "Госномер": ["А001АА67", "В002ВВ67", "А001АА67", "С003СС67"],
+    "Адрес": ["ул. Ленина, 1", "ул. Ленина, 3", "ул. Ленина, 1", "ул. Ленина, 1"],
+    "Дата": ["01.03.2024 10:00", "01.03.2024 11:30", "01.03.2024 10:00", "02.03.2024 09:00"],
+    "Сумма": ["500", "1500", "700", "3000"],
+    "Статья": ["12.9", "12.16", "12.9", "12.12"],
+})
+
+
+def upsert_session():
+    """PostgreSQL session with freshly created tables (skips the test unless DATABASE_URL is TEST_POSTGRES_URL)"""
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    test_engine = create_engine(url)
+    if engine.url.render_as_string(hide_password=False) != test_engine.url.render_as_string(hide_password=False):
+        pytest.skip("DATABASE_URL does not point at TEST_POSTGRES_URL")
+    Base.metadata.drop_all(test_engine)
+    Base.metadata.create_all(test_engine)
+    return sessionmaker(bind=test_engine)()
+
+
+def import_rows(db, rows, mode):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fines.csv")
+        rows.to_csv(path, index=False)
+        return FineImporter(db).import_fines(path, "csv", MAPPING, mode=mode)
+
+
+def counts(result):
+    return result["inserted"], result["updated"], result["skipped"], result["failed"]
+
+
+def stored_amounts(db):
+    rows = db.execute(
+        select(models.Vehicle.plate_number, models.Fine.amount)
+        .join(models.Vehicle, models.Fine.vehicle_id == models.Vehicle.id)
+        .order_by(models.Fine.issued_at, models.Vehicle.plate_number)
+    ).all()
+    return [(plate, float(amount)) for plate, amount in rows]
+
+
+def test_upsert_merges_by_natural_key():
+    db = upsert_session()
+    workers = settings.IMPORT_PARALLEL_WORKERS
+    settings.IMPORT_PARALLEL_WORKERS = 1
+    try:
+        # An address stored twice (the API allows it): rows resolve to its oldest location
+        db.add(models.Location(address="ул. Ленина, 1"))
+        db.commit()
+        db.add(models.Location(address="ул. Ленина, 1"))
+        db.commit()
+
+        result = import_rows(db, FILE_ROWS, "upsert")
+        assert counts(result) == (3, 0, 1, 0)
+        assert stored_amounts(db) == [("А001АА67", 700.0), ("В002ВВ67", 1500.0), ("С003СС67", 3000.0)]
+
+        again = import_rows(db, FILE_ROWS, "upsert")
+        assert counts(again) == (0, 0, 4, 0)
+
+        # One amount changed, one new fine
+        changed = pd.concat([FILE_ROWS.iloc[[1, 2, 3]], FILE_ROWS.iloc[[3]]], ignore_index=True)
+        changed.loc[0, "Сумма"] = "1800"
+        changed.loc[3, ["Госномер", "Дата"]] = ["С003СС67", "03.03.2024 12:00"]
+        result = import_rows(db, changed, "upsert")
+        assert counts(result) == (1, 1, 2, 0)
+        assert stored_amounts(db) == [
+            ("А001АА67", 700.0), ("В002ВВ67", 1800.0), ("С003СС67", 3000.0), ("С003СС67", 3000.0)
+        ]
+
+        oldest = db.execute(
+            select(models.Location.id).where(models.Location.address == "ул. Ленина, 1")
+            .order_by(models.Location.created_at, models.Location.id).limit(1)
+        ).scalar()
+        locations = set(db.execute(
+            select(models.Fine.location_id).join(models.Vehicle, models.Fine.vehicle_id == models.Vehicle.id)
+            .where(models.Vehicle.plate_number != "В002ВВ67")
+        ).scalars())
+        assert locations == {oldest}
+    finally:
+        settings.IMPORT_PARALLEL_WORKERS = workers
+        db.close()
+
+
+def test_append_inserts_every_row():
+    db = upsert_session()
+    try:
+        result = import_rows(db, FILE_ROWS, "append")
+        assert counts(result) == (4, 0, 0, 0)
+
+        # Fines sharing a key are distinct fines: a second import appends them again
+        result = import_rows(db, FILE_ROWS, "append")
+        assert counts(result) == (4, 0, 0, 0)
+        assert db.execute(select(func.count()).select_from(models.Fine)).scalar() == 8
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if os.environ.get("TEST_POSTGRES_URL"):
+        test_upsert_merges_by_natural_key()
+        test_append_inserts_every_row()
+    print("OK")
@@ -0,0 +1,85 @@
+# test_value_parsing.py
+"""
+Parsing of file values
+
+Date formats are detected per column from a sample of its values, not
+from the first value, so a column of Russian dates reads 01.02.2024 as
+the 1st of February wherever the row is; values in other formats are
+retried with the remaining formats, and values nothing parses become row
+errors. Numbers may use spaces (incl. non-breaking) as thousands
+separators and a decimal comma. No database is needed:
+
+    python -m pytest test_value_parsing.py
+    python test_value_parsing.py
+"""
+import os
+
+# app.database builds its engine at import time
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from datetime import datetime
+import pandas as pd
+from app.utils.import_pipeline import _to_datetime, _to_float, detect_date_format
+from app.utils.importer import VehicleTrackReadingImporter
+
+parse_timestamps = VehicleTrackReadingImporter._parse_timestamps
+
+
+def test_detect_date_format():
+    assert detect_date_format(pd.Series(["2024-02-01 08:00:00", "01.02.2024 08:00", None])) == "ISO8601"
+    assert detect_date_format(pd.Series(["01.02.2024 08:00", "13.02.2024 09:30", "2024-02-01"])) == "%d.%m.%Y %H:%M"
+    # 13/02 settles the day/month order of the column
+    assert detect_date_format(pd.Series(["01/02/2024", "13/02/2024"])) == "%d/%m/%Y"
+    assert detect_date_format(pd.Series([None, 5])) is None
+
+
+def test_mixed_dates():
+    values = pd.Series(["01.02.2024 08:00", "2024-02-03 09:00:00", "13.02.2024 10:15", "вчера", None])
+    assert _to_datetime(values).tolist()[:4] == [
+        datetime(2024, 2, 1, 8, 0), datetime(2024, 2, 3, 9, 0), datetime(2024, 2, 13, 10, 15), pd.NaT
+    ]
+    # Most values are day-first; the month-first twin is not tried, so 02/13/2024 is an error
+    assert _to_datetime(pd.Series(["01/02/2024", "13/02/2024", "14/02/2024", "02/13/2024"])).tolist() == [
+        datetime(2024, 2, 1), datetime(2024, 2, 13), datetime(2024, 2, 14), pd.NaT
+    ]
+
+
+def test_reading_timestamps_do_not_depend_on_row_order():
+    rows = ["2024-02-01 08:00:00", "01.02.2024 09:00", "13.02.2024 10:00", "not a time", None]
+    expected = [datetime(2024, 2, 1, 8), datetime(2024, 2, 1, 9), datetime(2024, 2, 13, 10), pd.NaT, pd.NaT]
+
+    assert parse_timestamps(pd.Series(rows)).tolist() == expected
+    reordered = [1, 0, 2, 3, 4]
+    assert parse_timestamps(pd.Series([rows[i] for i in reordered])).tolist() == [expected[i] for i in reordered]
+
+
+def test_reading_timestamps_with_offsets():
+    parsed = parse_timestamps(pd.Series(["2024-02-01T08:00:00+03:00", "2024-02-01T08:00:00+05:00", "01.02.2024 09:00"]))
+    assert str(parsed.dt.tz) == "UTC"
+    assert parsed.iloc[:2].tolist() == [
+        pd.Timestamp("2024-02-01 05:00", tz="UTC"), pd.Timestamp("2024-02-01 03:00", tz="UTC")
+    ]
+    # A value without an offset is not guessed into UTC: it becomes a row error
+    assert pd.isna(parsed.iloc[2])
+
+    stamps = pd.Series(pd.date_range("2024-02-01", periods=3, freq="h"))
+    assert parse_timestamps(stamps) is stamps
+
+
+def test_numbers():
+    values = pd.Series(["1 234,50", "1 234,5", "12.5", " 7 ", "", "много", None])
+    expected = [1234.5, 1234.5, 12.5, 7.0]
+    assert _to_float(values).tolist()[:4] == expected
+    assert _to_float(values).iloc[4:].isna().all()
+    # Arrow-backed strings (pandas' default string dtype) take the same path
+    assert _to_float(values.astype("string[pyarrow]")).tolist()[:4] == expected
+    assert _to_float(pd.Series([1, 2.5])).tolist() == [1.0, 2.5]
+
+
+if __name__ == "__main__":
+    test_detect_date_format()
+    test_mixed_dates()
+    test_reading_timestamps_do_not_depend_on_row_order()
+    test_reading_timestamps_with_offsets()
+    test_numbers()
+    print("OK")
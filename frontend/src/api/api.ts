@@ -29,6 +29,7 @@ export const api = {
 
   // Import/Export - FIXED: Use consistent endpoints
   importData: (modelType: string) => `${API_BASE_URL}/api/v1/import/${modelType}`,
+  importJob: (jobId: string) => `${API_BASE_URL}/api/v1/import/jobs/${jobId}`,
   getColumnMappings: (modelType: string) => `${API_BASE_URL}/api/v1/import/mappings/${modelType}`,
   exportData: (exportType: string) => `${API_BASE_URL}/api/v1/export/${exportType}`,
   
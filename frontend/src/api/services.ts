@@ -128,10 +128,30 @@ export class ApiService {
       ...(token && { 'api-key': token }),
     };
     
+    // Imports run as background jobs: queue the job, then poll it until it finishes
     const res = await axios.post(api.importData(modelType), formData, {
       headers,
     });
-    return res.data;
+    return this.waitForImportJob(res.data.id);
+  }
+
+  static async waitForImportJob(jobId: string, pollIntervalMs: number = 2000) {
+    const token = localStorage.getItem('api_key');
+    const headers: Record<string, string> = {
+      ...(token && { 'api-key': token }),
+    };
+
+    while (true) {
+      const res = await axios.get(api.importJob(jobId), { headers });
+      const job = res.data;
+      if (job.status === 'completed') {
+        return job;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Import job failed');
+      }
+      await new Promise((resolve) => setTimeout(resolve, pollIntervalMs));
+    }
   }
 
   // Add export method - UPDATED